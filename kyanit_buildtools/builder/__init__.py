@@ -1,14 +1,30 @@
 import io
 import os
+import re
+import ast
+import glob
+import json
+import math
+import time
 import stat
 import errno
 import shutil
+import signal
+import hashlib
+import threading
+import tarfile
+import platform
+import tempfile
 import pathlib
 import argparse
+import collections
+import urllib.parse
 import subprocess
+import concurrent.futures
 
 import semver
 
+from .device import DeviceSession, PortError, ConnectError, TransferError, VerifyError
 from ..versioning import GitReleaseStatus
 
 ESP_OPEN_SDK_URL = "https://github.com/kyanit-project/esp-open-sdk"
@@ -17,6 +33,92 @@ MICROPYTHON_URL = "https://github.com/micropython/micropython"
 MICROPYTHON_REV = "42342fa"
 WORK_DIR = os.path.join(pathlib.Path.home(), ".kyanit-builder")
 
+# bare mirrors of the repositories, checkouts are worktrees of these
+MIRROR_DIR = os.path.join(WORK_DIR, "mirrors")
+# submodules `make submodules` needs for the esp8266 port, checked out from mirrors
+MICROPYTHON_SUBMODULES = ("lib/axtls", "lib/berkeley-db-1.xx")
+
+# stages of the build running make, and the ones that aren't safe to run with parallel
+# jobs (the crosstool-ng build of esp-open-sdk)
+MAKE_STAGES = ("esp-open-sdk", "mpy-cross", "submodules", "firmware")
+SERIAL_MAKE_STAGES = ("esp-open-sdk",)
+
+# stages of the build and the stages they depend on, stages not depending on each other
+# run concurrently (the micropython checkout and mpy-cross don't need the toolchain, the
+# frozen modules are compiled with mpy-cross when configuring)
+BUILD_STAGES = {
+    "clone-sdk": (),
+    "build-sdk": ("clone-sdk",),
+    "clone-mpy": (),
+    "build-mpy-cross": ("clone-mpy",),
+    "submodules": ("clone-mpy", "build-sdk"),
+    "configure": ("clone-mpy", "build-sdk", "build-mpy-cross"),
+    "firmware": ("build-sdk", "build-mpy-cross", "submodules", "configure"),
+}
+
+# built firmwares by the hash of their inputs, least recently used ones are evicted
+# above the maximum total size
+FIRMWARE_CACHE_DIR = os.path.join(WORK_DIR, "firmware-cache")
+FIRMWARE_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# compiler cache of the firmware build (if ccache is installed), and the compilers of
+# the toolchain it wraps
+CCACHE_DIR = os.path.join(WORK_DIR, "ccache")
+TOOLCHAIN_COMPILERS = (
+    "xtensa-lx106-elf-gcc",
+    "xtensa-lx106-elf-cc",
+    "xtensa-lx106-elf-g++",
+    "xtensa-lx106-elf-c++",
+)
+
+# frozen modules compiled by mpy-cross, by the hash of their source, mpy-cross and its
+# flags (the ones the firmware build would freeze them with), least recently used ones
+# are evicted above the maximum total size
+MPY_CACHE_DIR = os.path.join(WORK_DIR, "mpy-cache")
+MPY_CACHE_MAX_SIZE = 16 * 1024 * 1024
+
+# the flash of the ESP8266 is erased (and written by uploads) in sectors of this size
+FLASH_SECTOR_SIZE = 4096
+# images last uploaded to devices by their MAC addresses, later uploads to the same
+# device only write the sectors that changed since
+FLASHED_IMAGES_DIR = os.path.join(WORK_DIR, "flashed")
+
+# baud rates uploads are tried at, fastest first, the fastest one that works is
+# remembered for the serial port; the link is tested by reading this much of the flash
+UPLOAD_BAUD_RATES = (921600, 460800, 230400)
+UPLOAD_BAUD_RATES_FILE = os.path.join(WORK_DIR, "upload-baud-rates.json")
+BAUD_RATE_PROBE_SIZE = 0x4000
+
+# devices uploaded to at the same time, and how many times failed uploads are retried
+UPLOAD_JOBS = 8
+UPLOAD_RETRIES = 1
+
+# status lines of running builds are updated at most this many times a second, and this
+# many of the last lines of the output of a failed build are printed
+PROGRESS_RATE = 10
+TAIL_LINES = 20
+
+# seconds a stopped build gets to exit after SIGTERM, before it's killed
+STOP_TIMEOUT = 10
+
+# patterns of fatal errors in the output of the make stages, with the categories they're
+# reported as; a build is stopped as soon as one of them appears
+_COMPILER_ERROR = ("compiler error", rb"^[^\s:]+:\d+(?::\d+)?: (?:fatal )?error: ")
+_LINKER_ERROR = (
+    "linker error",
+    rb"(?:undefined reference to|region `[^']*' overflowed)",
+)
+_MAKE_ERROR = ("make error", rb"^make(?:\[\d+\])?: \*\*\* ")
+BUILD_ERROR_PATTERNS = {
+    "esp-open-sdk": (
+        ("configure error", rb"^configure: error: "),
+        ("toolchain error", rb"^\[ERROR\]"),
+    ),
+    "mpy-cross": (_COMPILER_ERROR, _LINKER_ERROR, _MAKE_ERROR),
+    "submodules": (("git error", rb"^(?:fatal|error): "), _MAKE_ERROR),
+    "firmware": (_COMPILER_ERROR, _LINKER_ERROR, _MAKE_ERROR),
+}
+
 if not os.path.exists(WORK_DIR):
     os.makedirs(WORK_DIR)
 
@@ -36,18 +138,203 @@ class Progress:
         ]
 
 
-def print_status(proc_name, message, error=False, check_file_path=None, end="\n"):
-    print("kyanit-builder: ", end="")
-    if not error:
-        print(f"{proc_name}: {message}", end=end)
-    else:
-        if check_file_path is not None:
-            print(
-                f"{proc_name} ERROR: {message} (check file '{check_file_path}')",
-                end=end,
-            )
+class OutputPump:
+    """
+    Copy the output of a build to its log file in chunks as it's read, showing a
+    spinner in the status line (if `progress`) at most PROGRESS_RATE times a second,
+    and keeping the last `tail_lines` lines of the output for error messages.
+
+    Lines of the output are matched as they come against `success` (the output of a
+    successful build contains it, sets `succeeded`) and the `(category, pattern)` tuples
+    of `errors` (the first match sets `error` to the category and the line).
+    """
+
+    def __init__(
+        self,
+        proc_name,
+        message,
+        log_file,
+        progress=True,
+        tail_lines=TAIL_LINES,
+        success=None,
+        errors=(),
+    ):
+        self.proc_name = proc_name
+        self.message = message
+        self.log_file = log_file
+        self.progress = Progress() if progress else None
+        self.next_update = 0
+        self.lines = collections.deque(maxlen=tail_lines)
+        self.partial_line = b""
+        self.success = success
+        self.succeeded = False
+        self.errors = [
+            (category, re.compile(pattern, re.MULTILINE))
+            for category, pattern in errors
+        ]
+        self.error = None
+
+    def write(self, data):
+        self.log_file.write(data)
+        data = self.partial_line + data
+        end = data.rfind(b"\n") + 1
+        # only the end of a very long unfinished line is kept
+        complete, self.partial_line = data[:end], data[end:][-1024:]
+        if complete:
+            self.lines.extend(complete[:-1].rsplit(b"\n", self.lines.maxlen))
+            self._match(complete)
+        if self.progress is not None:
+            now = time.monotonic()
+            if now >= self.next_update:
+                self.next_update = now + 1 / PROGRESS_RATE
+                print_status(
+                    self.proc_name,
+                    f"{self.message} ... {self.progress.tick()}",
+                    end="\r",
+                )
+
+    def _match(self, lines):
+        if self.success is not None and self.success in lines:
+            self.succeeded = True
+        if self.error is None:
+            for category, pattern in self.errors:
+                match = pattern.search(lines)
+                if match is not None:
+                    start = lines.rfind(b"\n", 0, match.start()) + 1
+                    end = lines.find(b"\n", match.end())
+                    line = lines[start:end].decode("utf-8", "replace").strip()
+                    self.error = (category, line)
+                    break
+
+    def pump(self, proc):
+        """
+        Copy the output of `proc` until it ends, or until an error is matched, then
+        stop it and wait for it. `proc` must be started with `start_new_session`, so
+        that it's stopped with the processes it started (its process group), first with
+        SIGTERM, then with SIGKILL if it doesn't exit in STOP_TIMEOUT seconds.
+        """
+
+        try:
+            # read1 returns what's available in the pipe (up to the size), not waiting
+            # for a full chunk
+            while self.error is None:
+                data = proc.stdout.read1(1 << 16)
+                if not data:
+                    break
+                self.write(data)
+        except BaseException:
+            # in its own session, the build doesn't get the SIGINT of a Ctrl-C
+            _kill_group(proc, signal.SIGKILL)
+            raise
+        if self.error is not None:
+            _kill_group(proc, signal.SIGTERM)
+            # jobs of make still running get EPIPE instead of blocking on a full pipe
+            proc.stdout.close()
+            try:
+                proc.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                _kill_group(proc, signal.SIGKILL)
+        proc.wait()
+        if self.progress is not None:
+            print_status(self.proc_name, f"{self.message} ... {self.progress.clear()}")
+
+    def tail(self):
+        lines = list(self.lines)
+        if self.partial_line:
+            lines.append(self.partial_line)
+        return [
+            line.decode("utf-8", "replace").rstrip()
+            for line in lines[-self.lines.maxlen :]
+        ]
+
+    def error_message(self, message):
+        # error message of a failed build, with the error matched in its output
+        if self.error is None:
+            return message
+        category, line = self.error
+        return f"{message} {category}: {line}"
+
+
+def _kill_group(proc, sig):
+    # send `sig` to the process group of `proc`, unless it has exited already
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+# stages running concurrently print their status lines one at a time
+_print_lock = threading.Lock()
+
+
+def print_status(
+    proc_name, message, error=False, check_file_path=None, end="\n", tail=None
+):
+    with _print_lock:
+        print("kyanit-builder: ", end="")
+        if not error:
+            print(f"{proc_name}: {message}", end=end)
         else:
-            print(f"{proc_name} ERROR: {message}", end=end)
+            if check_file_path is not None:
+                print(
+                    f"{proc_name} ERROR: {message} (check file '{check_file_path}')",
+                    end=end,
+                )
+            else:
+                print(f"{proc_name} ERROR: {message}", end=end)
+            # last lines of the output of a failed build (or of esptool)
+            for line in tail or ():
+                print(f"    {line}")
+
+
+def available_cpus():
+    """
+    Return the number of CPUs this process can use, taking the CPU affinity and the
+    CPU quota of the cgroup (ex. of a container) into account.
+    """
+
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            max_quota, period = f.read().split()
+        if max_quota != "max":
+            quota = int(max_quota) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                max_quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if max_quota > 0 and period > 0:
+                quota = max_quota / period
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def make_jobs(default=None, overrides=None):
+    """
+    Return a dictionary of the number of make jobs for each of MAKE_STAGES: `default`
+    (the number of available CPUs if None) for all stages, except 1 for the
+    SERIAL_MAKE_STAGES, then updated with `overrides`.
+    """
+
+    default = default or available_cpus()
+    jobs = {
+        stage: 1 if stage in SERIAL_MAKE_STAGES else default for stage in MAKE_STAGES
+    }
+    jobs.update(overrides or {})
+    return jobs
 
 
 def remove_dir_tree(path):
@@ -62,75 +349,188 @@ def remove_dir_tree(path):
     shutil.rmtree(path, onerror=handle_remove_ro)
 
 
-def git_clone_and_checkout(url, rev, recursive=False):
-    # TODO: GIT: Do some progress feedback
-    folder_name = url.rpartition("/")[2]
-
+def run_git(args, cwd=None):
+    # run git quietly, return the CompletedProcess (stdout captured), or None if git
+    # isn't found
     try:
-        print_status("git", f"cloning into '{url}' ...")
-        proc = subprocess.Popen(
-            ["git", "clone", url],
-            cwd=WORK_DIR,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+        return subprocess.run(
+            ["git", *args], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
         )
-        proc.wait()
     except FileNotFoundError:
         print_status("git", f"git not found.", error=True)
-        return False
+        return None
+
+
+def mirror_path(url):
+    # path of the bare mirror of the repository at `url`
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", re.sub(r"^[a-z]+://", "", url))
+    return os.path.join(MIRROR_DIR, name if name.endswith(".git") else f"{name}.git")
+
+
+def update_mirror(url, revs, blobless=True):
+    """
+    Make sure the bare mirror of `url` contains the commits `revs`, creating or
+    fetching it if needed (full hashes are fetched alone and shallow, others with the
+    history of all branches and tags). Blobless mirrors fetch file contents on demand,
+    only for what's checked out. Return the path of the mirror, or None on failure.
+
+    Nothing is fetched if the mirror already has all `revs`, so it works offline.
+    """
+
+    mirror = mirror_path(url)
+    missing = []
+    for rev in revs:
+        proc = None
+        if os.path.exists(mirror):
+            proc = run_git(
+                ["rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}"], cwd=mirror
+            )
+        if proc is None or proc.returncode:
+            missing.append(rev)
+    if not missing:
+        return mirror
+
+    if not os.path.exists(mirror):
+        print_status("git", f"creating mirror of '{url}' ...")
+        os.makedirs(mirror)
+        for args in (
+            ["init", "--bare", "--quiet"],
+            ["remote", "add", "origin", url],
+            ["config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"],
+            # commits fetched by hash are not on any branch, but can be fetched from
+            # the mirror (by submodule updates)
+            ["config", "uploadpack.allowAnySHA1InWant", "true"],
+        ) + (
+            (
+                ["config", "remote.origin.promisor", "true"],
+                ["config", "remote.origin.partialclonefilter", "blob:none"],
+            )
+            if blobless
+            else ()
+        ):
+            proc = run_git(args, cwd=mirror)
+            if proc is None or proc.returncode:
+                remove_dir_tree(mirror)
+                print_status("git", f"cannot create mirror of '{url}'.", error=True)
+                return None
+
+    print_status("git", f"fetching '{url}' ...")
+    filter_args = ["--filter=blob:none"] if blobless else []
+    full_hashes = [rev for rev in missing if re.match(r"^[0-9a-f]{40}$", rev)]
+    if len(full_hashes) == len(missing):
+        # servers only allow fetching commits by their full hash
+        fetch_args = ["--depth=1", "origin", *full_hashes]
     else:
-        if proc.returncode > 0:
-            print_status("git", f"cannot clone repository '{url}'.", error=True)
-            return False
-        if folder_name is None:
-            print_status("git", f"cannot find cloned repository '{url}'.", error=True)
-            return False
-    
-    try:
-        print_status("git", f"checking out rev '{rev}' ...")
-        proc = subprocess.Popen(
-            ["git", "checkout", rev],
-            cwd=os.path.join(WORK_DIR, folder_name),
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+        fetch_args = ["--tags", "origin"]
+    proc = run_git(["fetch", "--quiet", *filter_args, *fetch_args], cwd=mirror)
+    if proc is None or proc.returncode:
+        print_status("git", f"cannot fetch '{url}'.", error=True)
+        return None
+    return mirror
+
+
+def git_clone_and_checkout(url, rev, recursive=False, submodules=None, jobs=None):
+    """
+    Check out `rev` of the repository at `url` into the work directory, as a worktree
+    of its bare mirror (see `update_mirror`), then update the submodules in the list
+    `submodules` (all of them recursively if `recursive`) from their own mirrors, with
+    `jobs` parallel jobs. Return True on success.
+    """
+
+    folder_name = url.rpartition("/")[2]
+    dest = os.path.join(WORK_DIR, folder_name)
+
+    mirror = update_mirror(url, [rev])
+    if mirror is None:
+        return False
+
+    print_status("git", f"checking out rev '{rev}' of '{url}' ...")
+    run_git(["worktree", "prune"], cwd=mirror)  # of removed checkouts
+    proc = run_git(["worktree", "add", "--detach", "--force", dest, rev], cwd=mirror)
+    if proc is None:
+        return False
+    if proc.returncode:
+        print_status(
+            "git", f"cannot check out rev '{rev}' in '{folder_name}'.", error=True
         )
-        proc.wait()
-    except FileNotFoundError:
-        print_status("git", f"git not found.", error=True)
         return False
-    else:
-        if proc.returncode > 0:
-            print_status(
-                "git", f"cannot check out rev '{rev}' in '{folder_name}'.", error=True
-            )
-            return False
-    
-    if recursive:
+
+    if recursive or submodules:
+        return update_submodules(
+            dest, url, submodules if not recursive else None, recursive, jobs
+        )
+    return True
+
+
+def update_submodules(path, url, paths=None, recursive=False, jobs=None):
+    """
+    Initialize and update the submodules of the checkout in `path` (of the repository
+    at `url`), only the ones in `paths` if given, cloning them from their mirrors (see
+    `update_mirror`). Nested submodules are updated from their own URLs if
+    `recursive`. Return True on success.
+    """
+
+    folder_name = os.path.basename(path)
+    print_status("git", "updating submodules (if any) ...")
+
+    proc = run_git(
+        ["config", "-f", ".gitmodules", "--get-regexp", r"^submodule\..*\.path$"],
+        cwd=path,
+    )
+    if proc is None:
+        return False
+    names = {}
+    for line in proc.stdout.decode().splitlines():
+        key, _, submodule_path = line.partition(" ")
+        if paths is None or submodule_path in paths:
+            names[key[len("submodule.") : -len(".path")]] = submodule_path
+
+    for name, submodule_path in names.items():
+        submodule_url = run_git(
+            ["config", "-f", ".gitmodules", f"submodule.{name}.url"], cwd=path
+        ).stdout.decode().strip()
+        if submodule_url.startswith(("./", "../")):
+            submodule_url = urllib.parse.urljoin(url + "/", submodule_url)
+        tree_entry = run_git(["ls-tree", "HEAD", submodule_path], cwd=path).stdout
         try:
-            print_status("git", "updating submodules (if any) ...")
-            proc = subprocess.Popen(
-                ["git", "submodule", "update", "--init"],
-                cwd=os.path.join(WORK_DIR, folder_name),
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-            proc.wait()
-        except FileNotFoundError:
-            print_status("git", f"git not found.", error=True)
+            commit = tree_entry.split()[2].decode()
+        except IndexError:
+            continue  # not in this revision
+        # submodules are cloned from local mirrors, which can't be partial
+        mirror = update_mirror(submodule_url, [commit], blobless=False)
+        if mirror is None:
             return False
-        else:
-            if proc.returncode > 0:
+        for args in (
+            ["submodule", "init", "--", submodule_path],
+            ["config", f"submodule.{name}.url", mirror],
+        ):
+            proc = run_git(args, cwd=path)
+            if proc is None or proc.returncode:
                 print_status(
                     "git", f"cannot update submodules in '{folder_name}'.", error=True
                 )
                 return False
-            else:
-                return True
-    else:
-        return True
+
+    # submodules are cloned from paths, which git refuses by default (since 2.38.1),
+    # the option is passed on to the clones of nested submodules too
+    proc = run_git(
+        ["-c", "protocol.file.allow=always", "submodule", "update", "--init"]
+        + [f"--jobs={jobs or available_cpus()}"]
+        + (["--recursive"] if recursive else [])
+        + ["--", *names.values()],
+        cwd=path,
+    )
+    if proc is None:
+        return False
+    if proc.returncode:
+        print_status("git", f"cannot update submodules in '{folder_name}'.", error=True)
+        return False
+    return True
 
 
-def build_esp_open_sdk(force_rebuild=False):
+def clone_esp_open_sdk(force_rebuild=False, jobs=None):
+    jobs = jobs or make_jobs()
+
     if force_rebuild:
         if os.path.exists(os.path.join(WORK_DIR, "esp-open-sdk")):
             print_status("esp-open-sdk", "removing existing build ...")
@@ -139,44 +539,53 @@ def build_esp_open_sdk(force_rebuild=False):
             os.remove(os.path.join(WORK_DIR, "esp-open-sdk-build.done"))
     if not os.path.exists(os.path.join(WORK_DIR, "esp-open-sdk")):
         if not git_clone_and_checkout(
-            ESP_OPEN_SDK_URL, ESP_OPEN_SDK_REV, recursive=True
+            ESP_OPEN_SDK_URL,
+            ESP_OPEN_SDK_REV,
+            recursive=True,
+            jobs=jobs["submodules"],
         ):
             exit()
+
+
+def make_esp_open_sdk(force_rebuild=False, jobs=None):
+    jobs = jobs or make_jobs()
+
     if (
         not os.path.exists(os.path.join(WORK_DIR, "esp-open-sdk-build.done"))
         or force_rebuild
     ):
         try:
             proc = subprocess.Popen(
-                "make",
+                f"make -j{jobs['esp-open-sdk']}",
                 cwd=os.path.join(WORK_DIR, "esp-open-sdk"),
                 shell=True,
                 stderr=subprocess.STDOUT,
                 stdout=subprocess.PIPE,
+                start_new_session=True,
             )
-            with open(os.path.join(WORK_DIR, "esp-open-sdk-build.log"), "w") as f:
-                p = Progress()
-                for line in io.TextIOWrapper(proc.stdout, encoding="utf-8"):
-                    print_status("esp-open-sdk", f"building ... {p.tick()}", end="\r")
-                    f.write(line)
-                print_status("esp-open-sdk", f"building ... {p.clear()}")
-            proc.wait()
+            with open(os.path.join(WORK_DIR, "esp-open-sdk-build.log"), "wb") as f:
+                output = OutputPump(
+                    "esp-open-sdk",
+                    "building",
+                    f,
+                    success=b"Xtensa toolchain is built",
+                    errors=BUILD_ERROR_PATTERNS["esp-open-sdk"],
+                )
+                output.pump(proc)
         except FileNotFoundError:
             print_status("esp-open-sdk", "make not found.", error=True)
         else:
-            if proc.returncode > 0:
+            if proc.returncode or output.error is not None:
                 print_status(
                     "esp-open-sdk",
-                    "cannot build.",
+                    output.error_message("cannot build."),
                     error=True,
                     check_file_path=os.path.join(WORK_DIR, "esp-open-sdk-build.log"),
+                    tail=output.tail(),
                 )
                 exit()
             # check output (could also check for xtensa binary)
-            if (
-                "Xtensa toolchain is built"
-                in open(os.path.join(WORK_DIR, "esp-open-sdk-build.log")).read()
-            ):
+            if output.succeeded:
                 with open(os.path.join(WORK_DIR, "esp-open-sdk-build.done"), "w"):
                     pass
                 print_status("esp-open-sdk", "done building.")
@@ -186,21 +595,36 @@ def build_esp_open_sdk(force_rebuild=False):
                     "cannot build.",
                     error=True,
                     check_file_path=os.path.join(WORK_DIR, "esp-open-sdk-build.log"),
+                    tail=output.tail(),
                 )
                 exit()
 
 
-def build_mpy(force_rebuild=False):
+def build_esp_open_sdk(force_rebuild=False, jobs=None):
+    clone_esp_open_sdk(force_rebuild, jobs)
+    make_esp_open_sdk(force_rebuild, jobs)
+
+
+def clone_mpy(force_rebuild=False, jobs=None):
+    jobs = jobs or make_jobs()
+
     if force_rebuild:
         if os.path.exists(os.path.join(WORK_DIR, "micropython")):
             print_status("micropython", "removing existing build ...")
             remove_dir_tree(os.path.join(WORK_DIR, "micropython"))
 
     if not os.path.exists(os.path.join(WORK_DIR, "micropython")):
-        if not git_clone_and_checkout(MICROPYTHON_URL, MICROPYTHON_REV):
+        if not git_clone_and_checkout(
+            MICROPYTHON_URL,
+            MICROPYTHON_REV,
+            submodules=MICROPYTHON_SUBMODULES,
+            jobs=jobs["submodules"],
+        ):
             exit()
 
-    # BUILD MPY-CROSS
+
+def build_mpy_cross(force_rebuild=False, jobs=None):
+    jobs = jobs or make_jobs()
 
     if (
         not os.path.exists(os.path.join(WORK_DIR, "mpy-cross-build.done"))
@@ -210,30 +634,31 @@ def build_mpy(force_rebuild=False):
             os.remove(os.path.join(WORK_DIR, "mpy-cross-build.done"))
         try:
             proc = subprocess.Popen(
-                "make",
+                f"make -j{jobs['mpy-cross']}",
                 cwd=os.path.join(WORK_DIR, "micropython", "mpy-cross"),
                 shell=True,
                 stderr=subprocess.STDOUT,
                 stdout=subprocess.PIPE,
+                start_new_session=True,
             )
-            with open(os.path.join(WORK_DIR, "mpy-cross-build.log"), "w") as f:
-                p = Progress()
-                for line in io.TextIOWrapper(proc.stdout, encoding="utf-8"):
-                    print_status(
-                        "micropython", f"building mpy-cross ... {p.tick()}", end="\r"
-                    )
-                    f.write(line)
-                print_status("micropython", f"building mpy-cross ... {p.clear()}")
-            proc.wait()
+            with open(os.path.join(WORK_DIR, "mpy-cross-build.log"), "wb") as f:
+                output = OutputPump(
+                    "micropython",
+                    "building mpy-cross",
+                    f,
+                    errors=BUILD_ERROR_PATTERNS["mpy-cross"],
+                )
+                output.pump(proc)
         except FileNotFoundError:
             print_status("micropython", "make not found.", error=True)
         else:
-            if proc.returncode > 0:
+            if proc.returncode or output.error is not None:
                 print_status(
                     "micropython",
-                    "cannot build mpy-cross.",
+                    output.error_message("cannot build mpy-cross."),
                     error=True,
                     check_file_path=os.path.join(WORK_DIR, "mpy-cross-build.log"),
+                    tail=output.tail(),
                 )
                 exit()
             # check mpy-cross binary exists
@@ -249,10 +674,13 @@ def build_mpy(force_rebuild=False):
                     "cannot build mpy-cross.",
                     error=True,
                     check_file_path=os.path.join(WORK_DIR, "mpy-cross-build.log"),
+                    tail=output.tail(),
                 )
                 exit()
 
-    # BUILD SUBMODULES
+
+def build_mpy_submodules(force_rebuild=False, jobs=None):
+    jobs = jobs or make_jobs()
 
     if (
         not os.path.exists(os.path.join(WORK_DIR, "mpy-submodules-build.done"))
@@ -261,60 +689,42 @@ def build_mpy(force_rebuild=False):
         if os.path.exists(os.path.join(WORK_DIR, "mpy-submodules-build.done")):
             os.remove(os.path.join(WORK_DIR, "mpy-submodules-build.done"))
         try:
-            custom_env = os.environ.copy()
-            custom_env["PATH"] = (
-                os.path.join(WORK_DIR, "esp-open-sdk", "xtensa-lx106-elf", "bin")
-                + ":"
-                + custom_env["PATH"]
-            )
+            custom_env = toolchain_env()
             tries = 0
             while True:
                 tries += 1
                 proc = subprocess.Popen(
-                    "make submodules",
+                    f"make -j{jobs['submodules']} submodules",
                     cwd=os.path.join(WORK_DIR, "micropython", "ports", "esp8266"),
                     shell=True,
                     env=custom_env,
-                    stderr=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
                     stdout=subprocess.PIPE,
+                    start_new_session=True,
                 )
-                with open(os.path.join(WORK_DIR, "mpy-submodules-build.log"), "w") as f:
-                    p = Progress()
-                    for line in io.TextIOWrapper(proc.stdout, encoding="utf-8"):
-                        if tries == 1:
-                            print_status(
-                                "micropython",
-                                f"building esp8266 submodules ... {p.tick()}",
-                                end="\r",
-                            )
-                        f.write(line)
-                    if tries == 1:
-                        print_status(
-                            "micropython",
-                            f"building esp8266 submodules ... {p.clear()}",
-                        )
-                    proc_output = proc.communicate()
-                    f.write(proc_output[0].decode())
-                    f.write(proc_output[1].decode())
-                if tries == 2 or not proc_output[1]:
+                log_path = os.path.join(WORK_DIR, "mpy-submodules-build.log")
+                with open(log_path, "wb") as f:
+                    output = OutputPump(
+                        "micropython",
+                        "building esp8266 submodules",
+                        f,
+                        progress=tries == 1,
+                        errors=BUILD_ERROR_PATTERNS["submodules"],
+                    )
+                    output.pump(proc)
+                # retried once on errors
+                if tries == 2 or not (proc.returncode or output.error is not None):
                     break
         except FileNotFoundError:
             print_status("micropython", "make not found.", error=True)
         else:
-            if proc.returncode > 0:
+            if proc.returncode or output.error is not None:
                 print_status(
                     "micropython",
-                    "cannot build esp8266 submodules.",
-                    error=True,
-                    check_file_path=os.path.join(WORK_DIR, "mpy-submodules-build.log"),
-                )
-                exit()
-            if proc_output[1]:
-                print_status(
-                    "micropython",
-                    "cannot build esp8266 submodules.",
+                    output.error_message("cannot build esp8266 submodules."),
                     error=True,
                     check_file_path=os.path.join(WORK_DIR, "mpy-submodules-build.log"),
+                    tail=output.tail(),
                 )
                 exit()
             else:
@@ -323,83 +733,707 @@ def build_mpy(force_rebuild=False):
                 print_status("micropython", "done building esp8266 submodules.")
 
 
-def configure_mpy(version):
-    print_status("configure", "creating board configuration ...")
+def build_mpy(force_rebuild=False, jobs=None):
+    clone_mpy(force_rebuild, jobs)
+    build_mpy_cross(force_rebuild, jobs)
+    build_mpy_submodules(force_rebuild, jobs)
+
+
+# what a toolchain bundle contains, relative to the work directory
+TOOLCHAIN_BUNDLE_PATHS = (
+    os.path.join("esp-open-sdk", "xtensa-lx106-elf"),
+    "esp-open-sdk-build.done",
+    os.path.join("micropython", "mpy-cross", "mpy-cross"),
+    "mpy-cross-build.done",
+)
+
+
+class _HashingFile:
+    # file wrapper updating a hash with everything read or written
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.hash.update(data)
+        return data
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+
+def toolchain_bundle_info():
+    # identifies what a toolchain bundle was built from, and for
+    return {
+        "esp-open-sdk": ESP_OPEN_SDK_REV,
+        "micropython": MICROPYTHON_REV,
+        "system": platform.system(),
+        "machine": platform.machine(),
+    }
+
 
-    # CREATE BOARD DIRECTORY
+def export_toolchain(path):
+    """
+    Pack the built esp-open-sdk toolchain and mpy-cross (with their `.done` markers)
+    into a gzip compressed tar archive at `path`, and write its SHA-256 checksum to
+    `path` + ".sha256". Return True on success.
+    """
+
+    for bundle_path in TOOLCHAIN_BUNDLE_PATHS:
+        if not os.path.exists(os.path.join(WORK_DIR, bundle_path)):
+            print_status(
+                "export", "toolchain not built, build it first (--init).", error=True
+            )
+            return False
+
+    print_status("export", f"exporting toolchain to '{path}' ...")
     try:
-        # fmt: off
-        # remove possibly existing board configuration
-        if os.path.exists(
-            os.path.join(
-                WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "KYANIT"
+        with open(path, "wb") as f:
+            hashing_file = _HashingFile(f)
+            with tarfile.open(fileobj=hashing_file, mode="w|gz") as tar:
+                info = json.dumps(toolchain_bundle_info(), indent=2).encode()
+                tar_info = tarfile.TarInfo("toolchain.json")
+                tar_info.size = len(info)
+                tar.addfile(tar_info, io.BytesIO(info))
+                for bundle_path in TOOLCHAIN_BUNDLE_PATHS:
+                    tar.add(os.path.join(WORK_DIR, bundle_path), bundle_path)
+        with open(f"{path}.sha256", "w") as f:
+            f.write(f"{hashing_file.hash.hexdigest()}  {os.path.basename(path)}\n")
+    except OSError as e:
+        print_status("export", f"cannot export toolchain ({e}).", error=True)
+        return False
+    print_status("export", f"toolchain exported to '{path}'.")
+    return True
+
+
+def _in_toolchain_bundle(member):
+    # whether a tar member (and what it links to) is one of TOOLCHAIN_BUNDLE_PATHS
+    names = [os.path.normpath(member.name)]
+    if member.issym():
+        names.append(
+            os.path.normpath(
+                os.path.join(os.path.dirname(member.name), member.linkname)
             )
-        ):
-            remove_dir_tree(
-                os.path.join(
-                    WORK_DIR, "micropython", "ports", "esp8266",
-                    "boards", "KYANIT"
-                )
+        )
+    elif member.islnk():
+        names.append(os.path.normpath(member.linkname))
+    return all(
+        not os.path.isabs(name)
+        and any(
+            name == bundle_path or name.startswith(bundle_path + os.sep)
+            for bundle_path in TOOLCHAIN_BUNDLE_PATHS
+        )
+        for name in names
+    )
+
+
+def import_toolchain(path):
+    """
+    Unpack a toolchain bundle created by `export_toolchain` into the work directory.
+    The archive is extracted as it's read into a temporary directory, and moved in
+    place only if its checksum (from `path` + ".sha256") matches, and it was built for
+    the same esp-open-sdk and MicroPython revisions and platform. Return True on
+    success.
+    """
+
+    try:
+        with open(f"{path}.sha256") as f:
+            checksum = f.read().split()[0]
+    except (OSError, IndexError):
+        print_status("import", f"checksum file '{path}.sha256' not found.", error=True)
+        return False
+
+    print_status("import", f"importing toolchain from '{path}' ...")
+    temp_dir = tempfile.mkdtemp(dir=WORK_DIR, prefix=".toolchain-")
+    # extraction filters (python 3.12, and security updates of earlier versions)
+    extract_args = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    try:
+        info = None
+        with open(path, "rb") as f:
+            hashing_file = _HashingFile(f)
+            with tarfile.open(fileobj=hashing_file, mode="r|*") as tar:
+                for member in tar:
+                    if member.name == "toolchain.json":
+                        info = json.load(tar.extractfile(member))
+                    elif _in_toolchain_bundle(member):
+                        tar.extract(member, temp_dir, **extract_args)
+                    else:
+                        raise tarfile.TarError(f"unexpected member '{member.name}'")
+            while hashing_file.read(1 << 16):
+                pass  # rest of the file (padding) is checksummed too
+
+        if hashing_file.hash.hexdigest() != checksum:
+            print_status("import", "checksum mismatch.", error=True)
+            return False
+        if info != toolchain_bundle_info():
+            print_status(
+                "import",
+                f"toolchain was built for {info}, not {toolchain_bundle_info()}.",
+                error=True,
             )
+            return False
 
-        # create new board configuration
-        shutil.copytree(
-            os.path.join(
-                WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "GENERIC"
-            ),
-            os.path.join(
-                WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "KYANIT"
-            ),
+        # mpy-cross is part of the micropython checkout
+        if not os.path.exists(os.path.join(WORK_DIR, "micropython")):
+            if not git_clone_and_checkout(
+                MICROPYTHON_URL, MICROPYTHON_REV, submodules=MICROPYTHON_SUBMODULES
+            ):
+                return False
+        for bundle_path in TOOLCHAIN_BUNDLE_PATHS:
+            dest = os.path.join(WORK_DIR, bundle_path)
+            if os.path.isdir(dest):
+                remove_dir_tree(dest)
+            elif os.path.exists(dest):
+                os.remove(dest)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.rename(os.path.join(temp_dir, bundle_path), dest)
+    except (OSError, ValueError, tarfile.TarError) as e:
+        print_status("import", f"cannot import toolchain ({e}).", error=True)
+        return False
+    finally:
+        remove_dir_tree(temp_dir)
+    print_status("import", "toolchain imported.")
+    return True
+
+
+def toolchain_env(ccache=None, ccache_dir=CCACHE_DIR):
+    """
+    Return the environment for running make with the xtensa toolchain on PATH. If
+    `ccache` (the path of the ccache executable) is given, the compilers of the
+    toolchain are wrapped with it, caching in `ccache_dir`.
+    """
+
+    env = os.environ.copy()
+    path = [os.path.join(WORK_DIR, "esp-open-sdk", "xtensa-lx106-elf", "bin")]
+    if ccache is not None:
+        # links named as the compilers make ccache run the next compiler of that name
+        # on PATH (the real one)
+        wrapper_dir = os.path.join(WORK_DIR, "ccache-bin")
+        os.makedirs(wrapper_dir, exist_ok=True)
+        for compiler in TOOLCHAIN_COMPILERS:
+            link = os.path.join(wrapper_dir, compiler)
+            if os.path.realpath(link) != os.path.realpath(ccache):
+                if os.path.lexists(link):
+                    os.remove(link)
+                os.symlink(ccache, link)
+        path.insert(0, wrapper_dir)
+        env["CCACHE_DIR"] = ccache_dir
+    env["PATH"] = ":".join(path + [env["PATH"]])
+    return env
+
+
+def ccache_stats(ccache, env):
+    """
+    Return a tuple of the cache hits and misses of ccache (since its statistics were
+    zeroed), or None if they can't be determined.
+    """
+
+    proc = subprocess.run(
+        [ccache, "--print-stats"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if proc.returncode == 0:
+        stats = dict(
+            line.split("\t", 1)
+            for line in proc.stdout.decode().splitlines()
+            if "\t" in line
         )
-        shutil.copytree(
-            os.path.join(WORK_DIR, "micropython", "ports", "esp8266", "modules"),
-            os.path.join(
-                WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "KYANIT", "modules",
-            ),
+        try:
+            return (
+                int(stats.get("direct_cache_hit", 0))
+                + int(stats.get("preprocessed_cache_hit", 0)),
+                int(stats.get("cache_miss", 0)),
+            )
+        except ValueError:
+            return None
+
+    # ccache before 4.0 only has the human readable statistics
+    proc = subprocess.run(
+        [ccache, "-s"], env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    stats = proc.stdout.decode()
+    misses = re.search(r"^cache miss\s+(\d+)", stats, re.MULTILINE)
+    if misses is None:
+        return None
+    hits = re.findall(r"^cache hit \((?:direct|preprocessed)\)\s+(\d+)", stats, re.M)
+    return sum(int(count) for count in hits), int(misses.group(1))
+
+
+def file_hash(path):
+    hash_ = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            hash_.update(chunk)
+    return hash_.digest()
+
+
+def tree_files(src_dir, prefix=""):
+    # relative paths (under `prefix`) of the files in `src_dir`, to their paths
+    files = {}
+    for root, dirs, names in os.walk(src_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            files[os.path.join(prefix, os.path.relpath(path, src_dir))] = path
+    return files
+
+
+def sync_files(files, dest_dir):
+    """
+    Make `dest_dir` contain exactly `files`, a dictionary of relative paths to source
+    file paths (or to the contents as bytes). Only files that are added, changed
+    (compared by size, then by content hash) or removed are touched, so modification
+    times only change with the contents, and make rebuilds only what depends on them.
+
+    Return a tuple of the number of files added, updated and removed.
+    """
+
+    added = updated = removed = 0
+
+    for rel_path, source in files.items():
+        dest = os.path.join(dest_dir, rel_path)
+        if isinstance(source, bytes):
+            size = len(source)
+        else:
+            size = os.path.getsize(source)
+
+        if not os.path.exists(dest):
+            added += 1
+        elif os.path.getsize(dest) != size:
+            updated += 1
+        elif file_hash(dest) == (
+            hashlib.sha256(source).digest()
+            if isinstance(source, bytes)
+            else file_hash(source)
+        ):
+            continue
+        else:
+            updated += 1
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if isinstance(source, bytes):
+            with open(dest, "wb") as f:
+                f.write(source)
+        else:
+            # copied without the source's modification time, so make sees it as new
+            shutil.copyfile(source, dest)
+            shutil.copymode(source, dest)
+
+    for root, dirs, names in os.walk(dest_dir, topdown=False):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, dest_dir) not in files:
+                os.remove(path)
+                removed += 1
+        if root != dest_dir and not os.listdir(root):
+            os.rmdir(root)
+
+    return added, updated, removed
+
+
+def _compile_module(mpy_cross, flags, source, source_name, cache_path):
+    # compile `source` (a path, or the contents as bytes) named `source_name` in the
+    # firmware into `cache_path` with `flags`, return the output of mpy-cross if it
+    # fails
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=MPY_CACHE_DIR, prefix=".tmp-") as temp_dir:
+        if isinstance(source, bytes):
+            source_path = os.path.join(temp_dir, "source.py")
+            with open(source_path, "wb") as f:
+                f.write(source)
+        else:
+            source_path = source
+        mpy_path = os.path.join(temp_dir, "module.mpy")
+        args = ["-o", mpy_path, "-s", source_name, source_path]
+        proc = subprocess.run(
+            [mpy_cross, *flags, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
         )
-        shutil.copytree(
-            os.path.join(os.getcwd(), "src"),
-            os.path.join(
-                WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "KYANIT", "modules",
-            ),
-            dirs_exist_ok=True,
+        if proc.returncode:
+            return proc.stdout.decode(errors="replace")
+        # renamed into the cache, so entries are always complete
+        os.replace(mpy_path, cache_path)
+    return None
+
+
+def evict_cached_modules(keep=(), max_size=MPY_CACHE_MAX_SIZE):
+    # evict the least recently used compiled modules (except the ones in `keep`) while
+    # the cache is larger than `max_size` bytes
+    entries = []
+    for root, dirs, names in os.walk(MPY_CACHE_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            path = os.path.join(root, name)
+            stat_result = os.stat(path)
+            entries.append((stat_result.st_mtime, stat_result.st_size, path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        if path not in keep:
+            os.remove(path)
+            total_size -= size
+
+
+def mpy_cross_flags(manifest):
+    """
+    Return the flags the firmware build compiles the frozen modules of the KYANIT board
+    with, if it's built with the manifest in `manifest` (the MPY_CROSS_FLAGS of the
+    esp8266 port's Makefile, and the optimization level of the manifest), or None if
+    the modules can't be precompiled: if the manifest doesn't freeze the `modules`
+    directory of the board as a whole (with `freeze`, without a script), freezes a part
+    of it, or can't be read.
+    """
+
+    makefile = os.path.join(WORK_DIR, "micropython", "ports", "esp8266", "Makefile")
+    flags = []
+    try:
+        with open(makefile) as f:
+            for line in f:
+                match = re.match(r"MPY_CROSS_FLAGS\s*(\+|:|\?)?=(.*)", line)
+                if match is not None:
+                    if match.group(1) != "+":
+                        flags.clear()
+                    flags.extend(match.group(2).split())
+        with open(manifest) as f:
+            tree = ast.parse(f.read(), manifest)
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    # the directory the modules are synced to, as manifests refer to it
+    modules_dirs = ("$(BOARD_DIR)/modules", "$(PORT_DIR)/boards/KYANIT/modules")
+    opt = None
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+            continue
+        if not node.func.id.startswith("freeze"):
+            continue
+        if not node.args or not isinstance(node.args[0], ast.Constant):
+            return None  # frozen paths that aren't known
+        path = str(node.args[0].value).rstrip("/")
+        if not path.startswith(modules_dirs):
+            continue
+        keywords = {keyword.arg: keyword.value for keyword in node.keywords}
+        if (
+            path not in modules_dirs
+            or node.func.id != "freeze"
+            or len(node.args) > 1
+            or keywords.keys() - {"opt"}
+            or opt is not None
+        ):
+            return None
+        opt = keywords.get("opt", ast.Constant(0))
+        if not isinstance(opt, ast.Constant) or not isinstance(opt.value, int):
+            return None
+    if opt is None:
+        return None
+    return tuple(flags) + (f"-O{opt.value}",)
+
+
+def precompile_modules(files, flags, jobs=None):
+    """
+    Return `files` (see `sync_files`) with the Python modules under `modules` replaced
+    by their compiled `.mpy` files, which the freeze step of the firmware build includes
+    as they are. Modules are compiled with mpy-cross and `flags` (see
+    `mpy_cross_flags`) `jobs` at a time (the number of available CPUs if None), into a
+    cache by the hash of their source, mpy-cross and the flags, so unchanged modules are
+    never compiled again. Exit if a module can't be compiled.
+    """
+
+    mpy_cross = os.path.join(WORK_DIR, "micropython", "mpy-cross", "mpy-cross")
+    try:
+        mpy_cross_hash = file_hash(mpy_cross)
+    except OSError:
+        print_status("configure", "mpy-cross not found.", error=True)
+        exit()
+
+    compiled = {}
+    missing = {}
+    for rel_path, source in files.items():
+        path = pathlib.PurePath(rel_path)
+        if path.parts[0] != "modules" or path.suffix != ".py":
+            continue
+        # the name of the module in the firmware is its path in the frozen directory
+        source_name = path.relative_to("modules").as_posix()
+        key = hashlib.sha256(mpy_cross_hash)
+        key.update(f"{' '.join(flags)}\0{source_name}\0".encode())
+        if isinstance(source, bytes):
+            key.update(hashlib.sha256(source).digest())
+        else:
+            key.update(file_hash(source))
+        key = key.hexdigest()
+        compiled[rel_path] = os.path.join(MPY_CACHE_DIR, key[:2], f"{key}.mpy")
+        if not os.path.exists(compiled[rel_path]):
+            missing[rel_path] = (source, source_name, compiled[rel_path])
+
+    if missing:
+        print_status(
+            "configure",
+            f"compiling {len(missing)} of {len(compiled)} frozen modules ...",
         )
-        shutil.copy2(
-            os.path.join(os.getcwd(), "mpbuild", "manifest.py"),
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs or available_cpus()
+        ) as executor:
+            # every module is compiled by its own mpy-cross process
+            results = {
+                rel_path: executor.submit(_compile_module, mpy_cross, flags, *args)
+                for rel_path, args in missing.items()
+            }
+        for rel_path, result in results.items():
+            if result.result() is not None:
+                print_status(
+                    "configure",
+                    f"cannot compile '{rel_path}'.",
+                    error=True,
+                    tail=result.result().splitlines()[-TAIL_LINES:],
+                )
+                exit()
+    print_status(
+        "configure",
+        f"frozen modules compiled ({len(compiled) - len(missing)} from cache).",
+    )
+
+    # mark the entries used as recently used
+    for cache_path in compiled.values():
+        os.utime(cache_path)
+    evict_cached_modules(keep=set(compiled.values()))
+
+    files = {
+        rel_path: source
+        for rel_path, source in files.items()
+        if rel_path not in compiled
+    }
+    for rel_path, cache_path in compiled.items():
+        files[rel_path[: -len(".py")] + ".mpy"] = cache_path
+    return files
+
+
+def configure_mpy(version, precompile_flags=None, jobs=None):
+    print_status("configure", "syncing board configuration ...")
+
+    # SYNC BOARD DIRECTORY
+    try:
+        # fmt: off
+        # board configuration from the generic board, the esp8266 port's modules,
+        # kyanit's sources (in this order of precedence) and the manifest
+        files = tree_files(
             os.path.join(
                 WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "KYANIT", "manifest.py",
-            ),
+                "boards", "GENERIC"
+            )
         )
-        os.remove(
-            os.path.join(
-                WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "KYANIT", "modules", "inisetup.py",
+        files.update(
+            tree_files(
+                os.path.join(WORK_DIR, "micropython", "ports", "esp8266", "modules"),
+                "modules",
             )
         )
-        # create version file
-        with open(
+        files.update(tree_files(os.path.join(os.getcwd(), "src"), "modules"))
+        files["manifest.py"] = os.path.join(os.getcwd(), "mpbuild", "manifest.py")
+        files.pop(os.path.join("modules", "inisetup.py"), None)
+        # version file
+        files[os.path.join("modules", "kyanit", "_version.py")] = (
+            f'__version__ = "{version}"\n'.encode()
+        )
+        if precompile_flags is not None:
+            files = precompile_modules(files, precompile_flags, jobs)
+
+        added, updated, removed = sync_files(
+            files,
             os.path.join(
                 WORK_DIR, "micropython", "ports", "esp8266",
-                "boards", "KYANIT", "modules", "kyanit", "_version.py",
+                "boards", "KYANIT"
             ),
-            "w",
-        ) as f:
-            f.write(f'__version__ = "{version}"\n')
+        )
         # fmt: on
     except Exception as e:
         print_status("configure", f"configuration failed with '{e}'.", error=True)
         exit()
     else:
-        print_status("configure", "board configuration created.")
+        print_status(
+            "configure",
+            f"board configuration synced ({added} added, {updated} updated, "
+            f"{removed} removed, {len(files) - added - updated} unchanged).",
+        )
+
+
+def git_rev(path):
+    # full hash of the checked out commit of the repository in `path`, or None
+    try:
+        proc = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=path,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if proc.returncode:
+        return None
+    return proc.stdout.decode().strip()
+
+
+def firmware_build_inputs():
+    """
+    Return a dictionary identifying what a firmware build depends on, besides the
+    sources make tracks itself: the MicroPython and esp-open-sdk revisions, the
+    toolchain (the SHA-256 of its compiler) and the board configuration (all files of
+    the KYANIT board, except the frozen modules).
+    """
+
+    board_dir = os.path.join(
+        WORK_DIR, "micropython", "ports", "esp8266", "boards", "KYANIT"
+    )
+    board_hash = hashlib.sha256()
+    for root, dirs, files in os.walk(board_dir):
+        if root == board_dir:
+            dirs[:] = [d for d in dirs if d != "modules"]
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            board_hash.update(os.path.relpath(path, board_dir).encode() + b"\0")
+            with open(path, "rb") as f:
+                board_hash.update(hashlib.sha256(f.read()).digest())
+
+    compiler = os.path.join(
+        WORK_DIR, "esp-open-sdk", "xtensa-lx106-elf", "bin", "xtensa-lx106-elf-gcc"
+    )
+    try:
+        # by its contents, an imported toolchain has the times of the exported one
+        toolchain = file_hash(compiler).hex()
+    except OSError:
+        toolchain = None
+
+    return {
+        "micropython": git_rev(os.path.join(WORK_DIR, "micropython")),
+        "esp-open-sdk": git_rev(os.path.join(WORK_DIR, "esp-open-sdk")),
+        "toolchain": toolchain,
+        "board": board_hash.hexdigest(),
+    }
+
+
+def firmware_cache_key(version, precompile_flags=None):
+    """
+    Return the cache key of the firmware built from the current directory with
+    `version`, from the contents of `src` and `mpbuild/manifest.py`, the MicroPython and
+    esp-open-sdk revisions, the toolchain, the version, and mpy-cross and its flags if
+    the frozen modules are precompiled with `precompile_flags` (see `configure_mpy`),
+    or None if the toolchain (or mpy-cross) isn't built.
+    """
+
+    compiler = os.path.join(
+        WORK_DIR, "esp-open-sdk", "xtensa-lx106-elf", "bin", "xtensa-lx106-elf-gcc"
+    )
+    if not os.path.exists(compiler):
+        return None
+
+    key = hashlib.sha256()
+    key.update(f"{MICROPYTHON_REV}\0{ESP_OPEN_SDK_REV}\0{version}\0".encode())
+    key.update(file_hash(compiler))
+    if precompile_flags is None:
+        key.update(b"no precompile\0")
+    else:
+        mpy_cross = os.path.join(WORK_DIR, "micropython", "mpy-cross", "mpy-cross")
+        if not os.path.exists(mpy_cross):
+            return None
+        key.update(f"precompile {' '.join(precompile_flags)}\0".encode())
+        key.update(file_hash(mpy_cross))
+    files = tree_files(os.path.join(os.getcwd(), "src"), "src")
+    files["manifest.py"] = os.path.join(os.getcwd(), "mpbuild", "manifest.py")
+    for rel_path in sorted(files):
+        key.update(rel_path.encode() + b"\0" + file_hash(files[rel_path]))
+    return key.hexdigest()
+
+
+def restore_cached_firmware(key):
+    """
+    Restore the firmware cached with `key` to the build directory (and its version to
+    `kyanit-build.done`), return True if it was found.
+    """
+
+    entry = os.path.join(FIRMWARE_CACHE_DIR, key)
+    try:
+        with open(os.path.join(entry, "version")) as f:
+            version = f.read()
+        build_dir = os.path.join(
+            WORK_DIR, "micropython", "ports", "esp8266", "build-KYANIT"
+        )
+        os.makedirs(build_dir, exist_ok=True)
+        shutil.copyfile(
+            os.path.join(entry, "firmware-combined.bin"),
+            os.path.join(build_dir, "firmware-combined.bin"),
+        )
+    except OSError:
+        return False
+
+    # the rest of the build directory is from a different build, remove the firmware
+    # it linked, so the next make links it again and replaces the restored firmware
+    # (which keeps the current time, like a built one)
+    try:
+        os.remove(os.path.join(build_dir, "firmware.elf"))
+    except FileNotFoundError:
+        pass
+    # mark the entry as recently used
+    os.utime(entry)
+    with open(os.path.join(WORK_DIR, "kyanit-build.done"), "w") as f:
+        f.write(version)
+    return True
+
+
+def store_cached_firmware(key, version, max_size=FIRMWARE_CACHE_MAX_SIZE):
+    """
+    Store the built firmware in the cache with `key`, then evict the least recently
+    used entries while the cache is larger than `max_size` bytes.
+    """
 
+    os.makedirs(FIRMWARE_CACHE_DIR, exist_ok=True)
+    entry = os.path.join(FIRMWARE_CACHE_DIR, key)
+    # fill a temporary directory and rename it, so entries are always complete
+    temp_entry = tempfile.mkdtemp(dir=FIRMWARE_CACHE_DIR, prefix=".tmp-")
+    try:
+        shutil.copyfile(
+            get_fw_binary(), os.path.join(temp_entry, "firmware-combined.bin")
+        )
+        with open(os.path.join(temp_entry, "version"), "w") as f:
+            f.write(version)
+        if os.path.exists(entry):
+            remove_dir_tree(entry)
+        os.rename(temp_entry, entry)
+    except OSError:
+        remove_dir_tree(temp_entry)
+        raise
+
+    entries = []
+    for name in os.listdir(FIRMWARE_CACHE_DIR):
+        path = os.path.join(FIRMWARE_CACHE_DIR, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        size = sum(
+            os.path.getsize(os.path.join(path, file_name))
+            for file_name in os.listdir(path)
+        )
+        entries.append((os.path.getmtime(path), size, path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        remove_dir_tree(path)
+        total_size -= size
+
+
+def configure_kyanit_core(cache=True, precompile=False, jobs=None):
+    """
+    Determine the version of the firmware and configure the board (see
+    `configure_mpy`, the frozen modules are compiled when configuring if `precompile`
+    and the manifest supports it), return a tuple of the version and the cache key of
+    the firmware, or None if the firmware was restored from the cache instead.
+    """
 
-def build_kyanit_core():
     if not os.path.exists(os.path.join(os.getcwd(), "src", "kyanit")):
         print_status("build", "current directory is not kyanit core repo.", error=True)
         exit()
@@ -417,52 +1451,114 @@ def build_kyanit_core():
         else:
             print_status("build", f"building development version '{version}'")
 
+    precompile_flags = None
+    if precompile:
+        precompile_flags = mpy_cross_flags(
+            os.path.join(os.getcwd(), "mpbuild", "manifest.py")
+        )
+        if precompile_flags is None:
+            print_status(
+                "configure",
+                "the manifest doesn't freeze the modules directory as a whole, the "
+                "frozen modules are compiled by the firmware build.",
+            )
+
+    # RESTORE FROM CACHE
+    cache_key = firmware_cache_key(version, precompile_flags) if cache else None
+    if cache_key is not None and restore_cached_firmware(cache_key):
+        print_status("build", "restored firmware from cache.")
+        return None
+
     # CONFIGURE
-    configure_mpy(version)
+    configure_mpy(version, precompile_flags, (jobs or make_jobs())["firmware"])
+    return version, cache_key
+
+
+def make_kyanit_core(version, cache_key=None, clean=False, jobs=None, ccache_dir=None):
+    jobs = jobs or make_jobs()
 
-    # BUILD FIRMWARE
     try:
         if os.path.exists(os.path.join(WORK_DIR, "kyanit-build.done")):
             os.remove(os.path.join(WORK_DIR, "kyanit-build.done"))
+        # the previous build is reused (make only rebuilds what changed), unless it
+        # was made with different inputs, that make doesn't track
+        build_inputs = firmware_build_inputs()
+        try:
+            with open(os.path.join(WORK_DIR, "kyanit-build.inputs")) as f:
+                previous_inputs = json.load(f)
+        except (OSError, ValueError):
+            previous_inputs = None
         if os.path.exists(
             os.path.join(WORK_DIR, "micropython", "ports", "esp8266", "build-KYANIT")
         ):
-            print_status("build", "removing previous build ...")
-            remove_dir_tree(
-                os.path.join(
-                    WORK_DIR, "micropython", "ports", "esp8266", "build-KYANIT"
+            if clean or previous_inputs != build_inputs:
+                if clean:
+                    print_status("build", "removing previous build ...")
+                else:
+                    changed = [
+                        name
+                        for name in build_inputs
+                        if (previous_inputs or {}).get(name) != build_inputs[name]
+                    ]
+                    print_status(
+                        "build",
+                        f"{', '.join(changed)} changed, removing previous build ...",
+                    )
+                remove_dir_tree(
+                    os.path.join(
+                        WORK_DIR, "micropython", "ports", "esp8266", "build-KYANIT"
+                    )
                 )
+            else:
+                print_status("build", "reusing previous build ...")
+        with open(os.path.join(WORK_DIR, "kyanit-build.inputs"), "w") as f:
+            json.dump(build_inputs, f)
+        ccache = shutil.which("ccache") if ccache_dir is not None else None
+        custom_env = toolchain_env(ccache, ccache_dir)
+        if ccache is not None:
+            # statistics of this build only
+            subprocess.run(
+                [ccache, "-z"],
+                env=custom_env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
             )
-        custom_env = os.environ.copy()
-        custom_env["PATH"] = (
-            os.path.join(WORK_DIR, "esp-open-sdk", "xtensa-lx106-elf", "bin")
-            + ":"
-            + custom_env["PATH"]
-        )
         proc = subprocess.Popen(
-            "make BOARD=KYANIT",
+            f"make -j{jobs['firmware']} BOARD=KYANIT",
             cwd=os.path.join(WORK_DIR, "micropython", "ports", "esp8266"),
             shell=True,
             env=custom_env,
             stderr=subprocess.STDOUT,
             stdout=subprocess.PIPE,
+            start_new_session=True,
         )
-        with open(os.path.join(WORK_DIR, "kyanit-build.log"), "w") as f:
-            p = Progress()
-            for line in io.TextIOWrapper(proc.stdout, encoding="utf-8"):
-                print_status("build", f"building firmware ... {p.tick()}", end="\r")
-                f.write(line)
-            print_status("build", f"building firmware ... {p.clear()}")
-        proc.wait()
+        with open(os.path.join(WORK_DIR, "kyanit-build.log"), "wb") as f:
+            output = OutputPump(
+                "build",
+                "building firmware",
+                f,
+                errors=BUILD_ERROR_PATTERNS["firmware"],
+            )
+            output.pump(proc)
+        if ccache is not None:
+            stats = ccache_stats(ccache, custom_env)
+            if stats is not None:
+                hits, misses = stats
+                rate = 100 * hits / (hits + misses) if hits + misses else 0
+                print_status(
+                    "build",
+                    f"ccache: {hits} hits, {misses} misses ({rate:.0f}% hit rate).",
+                )
     except FileNotFoundError:
         print_status("build", "make not found.", error=True)
     else:
-        if proc.returncode > 0:
+        if proc.returncode or output.error is not None:
             print_status(
                 "build",
-                "cannot build firmware.",
+                output.error_message("cannot build firmware."),
                 error=True,
                 check_file_path=os.path.join(WORK_DIR, "kyanit-build.log"),
+                tail=output.tail(),
             )
             exit()
         if not os.path.exists(
@@ -480,14 +1576,128 @@ def build_kyanit_core():
                 "cannot build firmware.",
                 error=True,
                 check_file_path=os.path.join(WORK_DIR, "kyanit-build.log"),
+                tail=output.tail(),
             )
             exit()
         else:
             with open(os.path.join(WORK_DIR, "kyanit-build.done"), "w") as f:
                 f.write(version)
+            if cache_key is not None:
+                try:
+                    store_cached_firmware(cache_key, version)
+                except OSError as e:
+                    print_status("build", f"cannot cache firmware ({e}).", error=True)
             print_status("build", "done building firmware.")
 
 
+def build_kyanit_core(
+    clean=False, jobs=None, cache=True, ccache_dir=CCACHE_DIR, precompile=False
+):
+    configured = configure_kyanit_core(cache, precompile, jobs)
+    if configured is not None:
+        make_kyanit_core(*configured, clean, jobs, ccache_dir)
+
+
+def build_stages(
+    rebuild_esp_open_sdk=False,
+    rebuild_mpy=False,
+    clean=False,
+    jobs=None,
+    cache=True,
+    ccache_dir=CCACHE_DIR,
+    precompile=False,
+):
+    """
+    Return a dictionary of the stages of BUILD_STAGES to tuples of the stages they
+    depend on and the function running them.
+    """
+
+    jobs = jobs or make_jobs()
+    configured = {}
+
+    def configure():
+        configured["firmware"] = configure_kyanit_core(cache, precompile, jobs)
+
+    def firmware():
+        # nothing to build if configure restored the firmware from the cache
+        if configured.get("firmware") is not None:
+            make_kyanit_core(*configured["firmware"], clean, jobs, ccache_dir)
+
+    functions = {
+        "clone-sdk": lambda: clone_esp_open_sdk(rebuild_esp_open_sdk, jobs),
+        "build-sdk": lambda: make_esp_open_sdk(rebuild_esp_open_sdk, jobs),
+        "clone-mpy": lambda: clone_mpy(rebuild_mpy, jobs),
+        "build-mpy-cross": lambda: build_mpy_cross(rebuild_mpy, jobs),
+        "submodules": lambda: build_mpy_submodules(rebuild_mpy, jobs),
+        "configure": configure,
+        "firmware": firmware,
+    }
+    return {name: (BUILD_STAGES[name], functions[name]) for name in BUILD_STAGES}
+
+
+def stage_order(stages, targets):
+    """
+    Return the names of the `targets` stages and the stages they depend on
+    (recursively), in an order where every stage comes after its dependencies.
+    """
+
+    order = []
+
+    def visit(name):
+        if name not in order:
+            for dependency in stages[name][0]:
+                visit(dependency)
+            order.append(name)
+
+    for target in targets:
+        visit(target)
+    return order
+
+
+def _run_stage(function):
+    # stages exit() on errors (after printing them), which only ends the thread
+    try:
+        function()
+    except SystemExit:
+        return False
+    return True
+
+
+def run_stages(stages, targets):
+    """
+    Run the `targets` stages of `stages` (see `build_stages`) and the stages they
+    depend on, each as soon as its dependencies are done. After a stage fails no more
+    stages are started, the ones running are waited for. Return True if all succeeded.
+    """
+
+    pending = stage_order(stages, targets)
+    done = set()
+    failed = False
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        while pending or running:
+            if not failed:
+                for name in [
+                    name
+                    for name in pending
+                    if all(dependency in done for dependency in stages[name][0])
+                ]:
+                    pending.remove(name)
+                    running[executor.submit(_run_stage, stages[name][1])] = name
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                name = running.pop(future)
+                if future.result():
+                    done.add(name)
+                else:
+                    failed = True
+    return not failed
+
+
 def get_fw_binary():
     fw_path = os.path.join(
         WORK_DIR,
@@ -515,69 +1725,289 @@ def get_fw_version():
                 return ver
 
 
-def fw_upload(serial_port, no_erase=False):
+def changed_sectors(old_image, new_image, sector_size=FLASH_SECTOR_SIZE):
+    """
+    Return the (offset, size) tuples of the ranges of consecutive flash sectors that
+    differ between `old_image` and `new_image` (what `new_image` has beyond the end of
+    `old_image` differs too).
+    """
+
+    ranges = []
+    for offset in range(0, len(new_image), sector_size):
+        new_sector = new_image[offset : offset + sector_size]
+        if old_image[offset : offset + sector_size] == new_sector:
+            continue
+        if ranges and sum(ranges[-1]) == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + len(new_sector))
+        else:
+            ranges.append((offset, len(new_sector)))
+    return ranges
+
+
+def flashed_image_path(mac):
+    return os.path.join(FLASHED_IMAGES_DIR, f"{mac.replace(':', '-')}.bin")
+
+
+# devices uploaded to concurrently remember their baud rates one at a time
+_baud_rates_lock = threading.Lock()
+
+
+def load_baud_rates():
+    try:
+        with open(UPLOAD_BAUD_RATES_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baud_rate(serial_port, baud):
+    # remember the baud rate for `serial_port`, forget it if None
+    with _baud_rates_lock:
+        baud_rates = load_baud_rates()
+        if baud is None:
+            baud_rates.pop(serial_port, None)
+        else:
+            baud_rates[serial_port] = baud
+        with open(UPLOAD_BAUD_RATES_FILE, "w") as f:
+            json.dump(baud_rates, f, indent=2)
+
+
+def open_device(serial_port):
+    """
+    Return a session with the device on `serial_port` (see `device.DeviceSession`) at
+    the fastest of UPLOAD_BAUD_RATES it works at, or None (after printing the error).
+    The baud rate found is remembered for the port, and only tested again if it fails.
+    """
+
+    name = f"upload {serial_port}"
+    remembered = load_baud_rates().get(serial_port)
+    baud_rates = [remembered] if remembered is not None else []
+    baud_rates.extend(baud for baud in UPLOAD_BAUD_RATES if baud != remembered)
+    for baud in baud_rates:
+        if baud != remembered:
+            print_status(name, f"testing {baud} baud ...")
+        session = None
+        try:
+            session = DeviceSession(serial_port, baud)
+            session.read_flash(0, BAUD_RATE_PROBE_SIZE)
+        except PortError as e:
+            print_status(name, str(e), error=True)
+            return None
+        except ConnectError as e:
+            print_status(
+                name,
+                f"could not connect to device ({e}).",
+                error=True,
+                tail=e.output[-TAIL_LINES:],
+            )
+            return None
+        except TransferError as e:
+            # the link doesn't work at this baud rate
+            if session is not None:
+                session.close(reset=False)
+            error = e
+            continue
+        if baud != remembered:
+            save_baud_rate(serial_port, baud)
+        return session
+    save_baud_rate(serial_port, None)
+    print_status(
+        name,
+        f"could not communicate with device ({error}).",
+        error=True,
+        tail=error.output[-TAIL_LINES:],
+    )
+    return None
+
+
+def _write_progress(name):
+    # progress callback of writes, printing every 10 percent
+    shown = [-1]
+
+    def progress(written, total):
+        percent = 100 * written // total
+        if percent // 10 > shown[0]:
+            shown[0] = percent // 10
+            print_status(name, f"writing ... {percent}%")
+
+    return progress
+
+
+def flash_device(session, fw_path, no_erase=False, full_erase=False):
+    """
+    Upload the firmware in `fw_path` to the device of `session`. If the device was
+    uploaded to before (and not `full_erase`), only the flash sectors that changed
+    since are written. Otherwise the flash is erased first (unless `no_erase`) and the
+    whole image is written. Either way the whole image is verified by its hash after.
+    Return True on success.
+    """
+
+    name = f"upload {session.port}"
+    with open(fw_path, "rb") as f:
+        image = f.read()
+
+    previous_image = None
+    if not full_erase:
+        try:
+            with open(flashed_image_path(session.mac), "rb") as f:
+                previous_image = f.read()
+        except OSError:
+            pass
+
+    try:
+        if previous_image is not None:
+            ranges = changed_sectors(previous_image, image)
+            changed = -(-sum(size for _, size in ranges) // FLASH_SECTOR_SIZE)
+            total = -(-len(image) // FLASH_SECTOR_SIZE)
+            print_status(
+                name,
+                f"writing {changed} of {total} sectors changed since the last upload",
+            )
+            for offset, size in ranges:
+                session.write(
+                    offset, image[offset : offset + size], _write_progress(name)
+                )
+            try:
+                session.verify(0, image)
+            except VerifyError:
+                # the device was programmed with something else since
+                print_status(
+                    name, "flash differs from the last upload, writing all ..."
+                )
+            else:
+                previous_image = image
+
+        if previous_image is not image:
+            if not no_erase:
+                print_status(name, "erasing flash ...")
+                session.erase()
+                print_status(name, "done erasing device flash.")
+            print_status(name, "uploading ...")
+            session.write(0, image, _write_progress(name))
+            session.verify(0, image)
+    except TransferError as e:
+        # the baud rate is tested again with the next upload
+        save_baud_rate(session.port, None)
+        print_status(
+            name,
+            f"could not program device ({e}).",
+            error=True,
+            tail=e.output[-TAIL_LINES:],
+        )
+        return False
+    except VerifyError as e:
+        print_status(
+            name,
+            f"could not program device ({e}).",
+            error=True,
+            tail=e.output[-TAIL_LINES:],
+        )
+        return False
+
+    os.makedirs(FLASHED_IMAGES_DIR, exist_ok=True)
+    with open(flashed_image_path(session.mac), "wb") as f:
+        f.write(image)
+    print_status(name, "done programming device.")
+    return True
+
+
+def upload_device(serial_port, fw_path, no_erase=False, full_erase=False, retries=0):
+    """
+    Upload the firmware in `fw_path` to the device on `serial_port`, retrying `retries`
+    times if it fails. Return a dictionary of the port, the MAC address of the device
+    (None if it couldn't be connected to), the number of attempts, the time it took in
+    seconds and the result ("ok" or "failed").
+    """
+
+    start = time.monotonic()
+    result = {"port": serial_port, "mac": None, "attempts": 0, "result": "failed"}
+    while result["attempts"] <= retries:
+        if result["attempts"]:
+            print_status(f"upload {serial_port}", "retrying ...")
+        result["attempts"] += 1
+        session = open_device(serial_port)
+        if session is None:
+            continue
+        with session:
+            result["mac"] = session.mac
+            print_status(
+                f"upload {serial_port}",
+                f"uploading to {session.mac} at {session.baud} baud.",
+            )
+            if flash_device(session, fw_path, no_erase, full_erase):
+                result["result"] = "ok"
+                break
+    result["seconds"] = round(time.monotonic() - start, 1)
+    return result
+
+
+def serial_ports(patterns):
+    """
+    Return the serial ports of `patterns`, which are ports, or glob patterns (ex.
+    '/dev/ttyUSB*') of ports, without duplicates.
+    """
+
+    ports = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for port in matches:
+            if port not in ports:
+                ports.append(port)
+    return ports
+
+
+def fw_upload(
+    serial_ports,
+    no_erase=False,
+    full_erase=False,
+    jobs=UPLOAD_JOBS,
+    retries=UPLOAD_RETRIES,
+    report_path=None,
+):
+    """
+    Upload the firmware built last to the devices on `serial_ports`, at most `jobs` at
+    the same time (see `upload_device` and `flash_device`). Print a summary of the
+    results, and write them to `report_path` as JSON, if given. Return the results.
+    """
+
     fw_ver = get_fw_version()
     fw_path = get_fw_binary()
     if fw_ver is None or fw_path is None:
         print_status("upload", "no existing firmware build found.")
-        return
+        return []
 
     print_status("upload", f"firmware version is '{fw_ver}'")
 
-    if not no_erase:
-        print_status("upload", "erasing flash ...", end="\n\n")
-        try:
-            proc = subprocess.run(
-                ["esptool.py", "--port", serial_port, "erase_flash"],
-                stderr=subprocess.PIPE,
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(
+            executor.map(
+                lambda serial_port: upload_device(
+                    serial_port, fw_path, no_erase, full_erase, retries
+                ),
+                serial_ports,
             )
-            print()
-        except FileNotFoundError:
-            print_status("upload", "esptool.py not found.", error=True)
-            return
-        else:
-            if proc.returncode > 0:
-                # some error occurred
-                if f"could not open port {serial_port}" in proc.stderr.decode():
-                    print_status(
-                        "upload", f"could not open port {serial_port}", error=True
-                    )
-                else:
-                    print_status("upload", f"could not erase device.", error=True)
-                return
-            else:
-                print_status("upload", f"done erasing device flash.")
+        )
 
-    print_status("upload", "uploading ...", end="\n\n")
-    try:
-        proc = subprocess.run(
-            [
-                "esptool.py",
-                "--port",
-                serial_port,
-                "--baud",
-                "230400",
-                "write_flash",
-                "--flash_size=detect",
-                "0",
-                fw_path,
-            ],
-            stderr=subprocess.PIPE,
+    if len(results) > 1:
+        port_width = max(len(result["port"]) for result in results)
+        for result in results:
+            print_status(
+                "upload",
+                f"{result['port']:{port_width}}  {result['mac'] or '-':17}  "
+                f"{result['seconds']:6.1f}s  {result['result']}",
+            )
+        failed = sum(result["result"] != "ok" for result in results)
+        print_status(
+            "upload", f"{len(results) - failed} of {len(results)} devices programmed."
         )
-        print()
-    except FileNotFoundError:
-        print_status("upload", "esptool.py not found.", error=True)
-        return
-    else:
-        if proc.returncode > 0:
-            # some error occurred
-            if f"could not open port {serial_port}" in proc.stderr.decode():
-                print_status("upload", f"could not open port {serial_port}", error=True)
-            else:
-                print_status("upload", f"could not program device.", error=True)
-            return
-        else:
-            print_status("upload", f"done programming device.")
+
+    if report_path is not None:
+        try:
+            with open(report_path, "w") as f:
+                json.dump({"version": fw_ver, "devices": results}, f, indent=2)
+        except OSError as e:
+            print_status("upload", f"cannot write report ({e}).", error=True)
+    return results
 
 
 def command_line():
@@ -593,23 +2023,116 @@ def command_line():
         "micropython; this is optional, as it's done automatically with the first "
         "firmware build",
     )
+    parser.add_argument(
+        "--export-toolchain",
+        metavar="FILE",
+        help="export the built toolchain (esp-open-sdk and mpy-cross) into FILE (a "
+        "compressed archive, with its checksum in FILE.sha256), to be imported on "
+        "another machine",
+    )
+    parser.add_argument(
+        "--import-toolchain",
+        metavar="FILE",
+        help="import a toolchain exported with --export-toolchain instead of building "
+        "it",
+    )
     parser.add_argument(
         "-b",
         "--build",
         action="store_true",
         help="determine version number and build the kyanit core firmware",
     )
+    parser.add_argument(
+        "--clean",
+        action="store_true",
+        help="remove the previous firmware build before building; by default only what "
+        "changed since is rebuilt, unless micropython, the toolchain or the board "
+        "configuration changed",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always build the firmware; by default a firmware previously built from "
+        "the same sources, toolchain and version is restored from the cache",
+    )
+    parser.add_argument(
+        "--ccache-dir",
+        metavar="DIRECTORY",
+        default=CCACHE_DIR,
+        help="directory of the compiler cache used when ccache is installed; defaults "
+        f"to '{CCACHE_DIR}'",
+    )
+    parser.add_argument(
+        "--no-ccache",
+        action="store_true",
+        help="do not use ccache even if it's installed",
+    )
+    parser.add_argument(
+        "--precompile",
+        action="store_true",
+        help="compile the frozen modules in parallel when configuring (with as many "
+        f"jobs as the firmware build), cached by their contents in '{MPY_CACHE_DIR}', "
+        "instead of in the firmware build; only if the manifest freezes the "
+        "'$(BOARD_DIR)/modules' directory as a whole",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of parallel make jobs; defaults to the number of available CPUs "
+        f"(except for {', '.join(SERIAL_MAKE_STAGES)}, which is built with 1)",
+    )
+    parser.add_argument(
+        "--stage-jobs",
+        metavar="STAGE=JOBS",
+        action="append",
+        default=[],
+        help="number of parallel make jobs for one build stage, overriding --jobs; "
+        f"STAGE is one of {', '.join(MAKE_STAGES)}; can be given multiple times",
+    )
     parser.add_argument(
         "-u",
         "--upload",
         metavar="SERIAL_PORT",
+        nargs="+",
         help="upload the firmware to kyanit; by default the previously built firmware "
-        "is uploaded; if '--file' is provided, that file is uploaded instead",
+        "is uploaded; if '--file' is provided, that file is uploaded instead; multiple "
+        "ports, or glob patterns of ports (ex. '/dev/ttyUSB*') are uploaded to "
+        "concurrently",
+    )
+    parser.add_argument(
+        "--upload-jobs",
+        metavar="JOBS",
+        type=int,
+        default=UPLOAD_JOBS,
+        help="number of devices uploaded to at the same time; defaults to "
+        f"{UPLOAD_JOBS}",
+    )
+    parser.add_argument(
+        "--upload-retries",
+        metavar="RETRIES",
+        type=int,
+        default=UPLOAD_RETRIES,
+        help="number of times a failed upload is retried; defaults to "
+        f"{UPLOAD_RETRIES}",
+    )
+    parser.add_argument(
+        "--upload-report",
+        metavar="FILE",
+        help="write the results of the upload (port, MAC address, duration and result "
+        "of each device) to FILE as JSON",
     )
     parser.add_argument(
         "--no-erase",
         action="store_true",
-        help="do not erase flash before uploading the firmware",
+        help="do not erase flash before uploading the firmware to a device for the "
+        "first time",
+    )
+    parser.add_argument(
+        "--full-erase",
+        action="store_true",
+        help="erase the flash and write the whole firmware; by default only the flash "
+        "sectors that changed since the last upload to the device are written",
     )
     parser.add_argument("-f", "--file", help="external firmware file to upload")
     parser.add_argument(
@@ -640,8 +2163,22 @@ def command_line():
         action="store_true",
         help="force the rebuild of both esp-open-sdk and micropython",
     )
+    parser.add_argument(
+        "--print-stages",
+        action="store_true",
+        help="print the stages of the build and the stages they depend on, stages not "
+        "depending on each other are run concurrently",
+    )
     args = parser.parse_args()
 
+    stage_jobs = {}
+    for stage_job in args.stage_jobs:
+        stage, _, stage_job_count = stage_job.partition("=")
+        if stage not in MAKE_STAGES or not stage_job_count.isdigit():
+            parser.error(f"invalid --stage-jobs '{stage_job}'")
+        stage_jobs[stage] = max(1, int(stage_job_count))
+    jobs = make_jobs(args.jobs, stage_jobs)
+
     try:
         subprocess.Popen("git", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except FileNotFoundError:
@@ -654,10 +2191,15 @@ def command_line():
 
     nothing_to_do = True
 
-    if args.init:
+    if args.import_toolchain:
+        nothing_to_do = False
+        if not import_toolchain(args.import_toolchain):
+            exit()
+
+    if args.print_stages:
         nothing_to_do = False
-        build_esp_open_sdk()
-        build_mpy()
+        for name, dependencies in BUILD_STAGES.items():
+            print(f"{name} <- {', '.join(dependencies)}" if dependencies else name)
 
     if args.firmware_version:
         nothing_to_do = False
@@ -667,23 +2209,49 @@ def command_line():
         else:
             print_status("version", "no existing firmware build found.", error=True)
 
-    if args.rebuild_esp_open_sdk or args.rebuild_toolchain:
-        nothing_to_do = False
-        build_esp_open_sdk(force_rebuild=True)
+    # the stages of --init, --rebuild-* and --build run together
+    targets = []
+    rebuild_esp_open_sdk = args.rebuild_esp_open_sdk or args.rebuild_toolchain
+    rebuild_mpy = args.rebuild_micropython or args.rebuild_toolchain
+    if args.init or rebuild_esp_open_sdk:
+        targets.append("build-sdk")
+    if args.init or rebuild_mpy:
+        targets.extend(["build-mpy-cross", "submodules"])
+    if args.build:
+        targets.append("firmware")
 
-    if args.rebuild_micropython or args.rebuild_toolchain:
+    if targets:
         nothing_to_do = False
-        build_mpy(force_rebuild=True)
+        stages = build_stages(
+            rebuild_esp_open_sdk=rebuild_esp_open_sdk,
+            rebuild_mpy=rebuild_mpy,
+            clean=args.clean,
+            jobs=jobs,
+            cache=not args.no_cache,
+            ccache_dir=None if args.no_ccache else args.ccache_dir,
+            precompile=args.precompile,
+        )
+        if not run_stages(stages, targets):
+            exit()
 
-    if args.build:
+    if args.export_toolchain:
         nothing_to_do = False
-        build_esp_open_sdk()
-        build_mpy()
-        build_kyanit_core()
+        export_toolchain(args.export_toolchain)
 
     if args.upload:
         nothing_to_do = False
-        fw_upload(args.upload, args.no_erase)
+        ports = serial_ports(args.upload)
+        if not ports:
+            print_status("upload", "no serial ports found.", error=True)
+        else:
+            fw_upload(
+                ports,
+                args.no_erase,
+                args.full_erase,
+                jobs=args.upload_jobs,
+                retries=args.upload_retries,
+                report_path=args.upload_report,
+            )
 
     if args.output:
         nothing_to_do = False
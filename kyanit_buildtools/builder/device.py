@@ -0,0 +1,243 @@
+"""
+Driver of the ESP8266 bootloader, with esptool as a library.
+
+A `DeviceSession` is one connection to a device: it resets it into the bootloader,
+reads its MAC address, loads the flasher stub and detects the flash size once, then
+changes the baud rate, erases, writes (compressed) and verifies over the same
+connection. Errors are raised as subclasses of `DeviceError`, by what failed, with
+what esptool printed in the session until then.
+
+The port is opened with pyserial's `serial_for_url`, so besides serial ports it can be
+the URL of an emulated device (ex. 'socket://localhost:5000' or
+'rfc2217://localhost:5000').
+"""
+
+import sys
+import zlib
+import types
+import hashlib
+import threading
+import contextlib
+
+import serial
+import esptool
+
+
+class DeviceError(Exception):
+    # lines printed by esptool in the session, until the error
+    output = ()
+
+
+class PortError(DeviceError):
+    pass
+
+
+class ConnectError(DeviceError):
+    pass
+
+
+class TransferError(DeviceError):
+    pass
+
+
+class VerifyError(DeviceError):
+    pass
+
+
+class _SessionOutput:
+    # file-like object collecting what's written to it in `lines`
+
+    def __init__(self, lines):
+        self.lines = lines
+        self._line = ""
+
+    def write(self, text):
+        *complete, self._line = (self._line + text).split("\n")
+        # progress is printed over the same line, only the last of it is kept
+        self.lines.extend(line.rpartition("\r")[2] for line in complete)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def snapshot(self):
+        # the lines so far, with the unfinished one
+        unfinished = self._line.rpartition("\r")[2]
+        return self.lines + [unfinished] if unfinished else list(self.lines)
+
+
+# esptool prints its progress (with `print` and `sys.stdout`), what it prints while a
+# session runs it (in that session's thread) is kept in the session's `output` instead,
+# esptool is only patched while sessions run it
+_session_output = threading.local()
+_patch_lock = threading.Lock()
+_patch_count = 0
+
+
+def _stdout():
+    return getattr(_session_output, "file", None) or sys.stdout
+
+
+def _esptool_print(*args, file=None, **kwargs):
+    print(*args, file=file or _stdout(), **kwargs)
+
+
+class _EsptoolSys(types.ModuleType):
+    # the sys module for esptool, with the stdout of the thread
+
+    def __getattr__(self, name):
+        return getattr(sys, name)
+
+    @property
+    def stdout(self):
+        return _stdout()
+
+
+@contextlib.contextmanager
+def _capture_output(file):
+    # capture what esptool prints in this thread into `file`
+    global _patch_count
+    _session_output.file = file
+    with _patch_lock:
+        if not _patch_count:
+            esptool.print = _esptool_print
+            esptool.sys = _EsptoolSys("sys")
+        _patch_count += 1
+    try:
+        yield
+    finally:
+        _session_output.file = None
+        with _patch_lock:
+            _patch_count -= 1
+            if not _patch_count:
+                del esptool.print
+                esptool.sys = sys
+
+
+class DeviceSession:
+    """
+    Connection to the bootloader of the ESP8266 on `port`, running the flasher stub
+    (at `baud`, if given). Use as a context manager, or `close` it. The device is reset
+    (to run its firmware) when closed.
+    """
+
+    def __init__(self, port, baud=None):
+        self.port = port
+        # lines printed by esptool
+        self.output = []
+        self._output = _SessionOutput(self.output)
+        self.baud = esptool.ESPLoader.ESP_ROM_BAUD
+        try:
+            self.serial = serial.serial_for_url(port)
+        except (serial.SerialException, OSError) as e:
+            raise PortError(f"could not open port {port}") from e
+
+        try:
+            with self._esptool(ConnectError):
+                self.esp = esptool.ESP8266ROM(self.serial, self.baud)
+                self.esp.connect()
+                self.mac = ":".join(f"{byte:02x}" for byte in self.esp.read_mac())
+                self.esp = self.esp.run_stub()
+                size_id = self.esp.flash_id() >> 16
+                self.flash_size = esptool.DETECTED_FLASH_SIZES.get(size_id, "4MB")
+                self.esp.flash_set_parameters(esptool.flash_size_bytes(self.flash_size))
+            if baud is not None and baud != self.baud:
+                self.change_baud(baud)
+        except DeviceError:
+            self.serial.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextlib.contextmanager
+    def _esptool(self, error):
+        # run esptool with its output in this session, and its errors raised as `error`
+        try:
+            with _capture_output(self._output):
+                yield
+        except (esptool.FatalError, serial.SerialException, OSError) as e:
+            raise self._error(error, str(e)) from e
+
+    def _error(self, error, message):
+        # `error` with the output of the session so far
+        exception = error(message)
+        exception.output = self._output.snapshot()
+        return exception
+
+    def change_baud(self, baud):
+        with self._esptool(TransferError):
+            self.esp.change_baud(baud)
+        self.baud = baud
+
+    def read_flash(self, offset, size):
+        # the stub checks what it sent by its hash
+        with self._esptool(TransferError):
+            return self.esp.read_flash(offset, size)
+
+    def erase(self):
+        with self._esptool(TransferError):
+            self.esp.erase_flash()
+
+    def image(self, offset, data):
+        """
+        Return `data` as written at `offset`: padded to 4 bytes, and with the flash size
+        in its header set to the detected one, if it's a firmware image at 0.
+        """
+
+        data = esptool.pad_to(data, 4)
+        if offset == 0 and data[:1] == bytes([esptool.ESPLoader.ESP_IMAGE_MAGIC]):
+            size = esptool.ESP8266ROM.FLASH_SIZES[self.flash_size]
+            data = data[:3] + bytes([(data[3] & 0x0F) | size]) + data[4:]
+        return data
+
+    def write(self, offset, data, progress=None):
+        """
+        Write `data` to the flash at `offset` compressed (see `image`), calling
+        `progress` with the bytes written so far and the total after each block.
+        """
+
+        data = self.image(offset, data)
+        compressed = zlib.compress(data, 9)
+        block_size = self.esp.FLASH_WRITE_SIZE
+        # blocks are decompressed and written to flash before the stub answers
+        timeout = esptool.DEFAULT_TIMEOUT * len(data) / len(compressed) * 2
+        with self._esptool(TransferError):
+            blocks = self.esp.flash_defl_begin(len(data), len(compressed), offset)
+            for seq in range(blocks):
+                self.esp.flash_defl_block(
+                    compressed[seq * block_size : (seq + 1) * block_size],
+                    seq,
+                    timeout=timeout,
+                )
+                if progress is not None:
+                    written = min((seq + 1) * block_size, len(compressed))
+                    progress(written, len(compressed))
+            # leave the stub in flash mode, instead of running the firmware
+            self.esp.flash_begin(0, 0)
+            self.esp.flash_defl_finish(False)
+
+    def md5(self, offset, size):
+        with self._esptool(TransferError):
+            return self.esp.flash_md5sum(offset, size)
+
+    def verify(self, offset, data):
+        # raise VerifyError if the flash at `offset` isn't `data` (see `image`)
+        data = self.image(offset, data)
+        if self.md5(offset, len(data)) != hashlib.md5(data).hexdigest():
+            raise self._error(
+                VerifyError, f"flash at 0x{offset:x} differs from the image"
+            )
+
+    def close(self, reset=True):
+        try:
+            if reset:
+                with self._esptool(TransferError):
+                    self.esp.hard_reset()
+        except DeviceError:
+            pass
+        finally:
+            self.serial.close()
@@ -1,12 +1,25 @@
 import os
 import re
+import glob
+import json
+import time
+import logging
+import queue
+import sqlite3
 import argparse
+import threading
 import subprocess
 import collections
+import concurrent.futures
 from io import StringIO
+from types import MappingProxyType
 
 import semver
 
+from . import gitdir
+
+_log = logging.getLogger(__name__)
+
 
 class GitNotFound(Exception):
     pass
@@ -36,6 +49,45 @@ class GitTagVersionNotSemVer(Exception):
     pass
 
 
+def _find_git_dir(work_dir):
+    """
+    Return the git directory of the repository containing `work_dir` without invoking
+    git, or None if it cannot be found. Resolves `.git` files (worktrees, submodules)
+    and honors the GIT_DIR environment variable.
+    """
+
+    if os.environ.get("GIT_DIR"):
+        return os.path.abspath(os.path.join(work_dir, os.environ["GIT_DIR"]))
+
+    path = os.path.abspath(work_dir)
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            try:
+                with open(dot_git) as f:
+                    match = re.match(r"gitdir:\s*(.*)", f.read().strip())
+            except OSError:
+                return None
+            if match is None:
+                return None
+            return os.path.normpath(os.path.join(path, match.group(1)))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _find_common_dir(git_dir):
+    # the common directory holds the objects and refs shared by all worktrees
+    try:
+        with open(os.path.join(git_dir, "commondir")) as f:
+            return os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    except OSError:
+        return git_dir
+
+
 def _print_status(proc_name, message, error=False, check_file_path=None, end="\n"):
     print("kyanit-versioning: ", end="")
     if not error:
@@ -50,6 +102,968 @@ def _print_status(proc_name, message, error=False, check_file_path=None, end="\n
             print(f"{proc_name} ERROR: {message}", end=end)
 
 
+def _parse_commit(revision, log_entry):
+    # parse a commit from the header and the (indented) message part of a git log entry
+    commit_body = StringIO(log_entry)
+
+    while commit_body.readline().strip():
+        pass  # discard commit header
+
+    try:
+        conventional_commit = re.match(
+            r"^\s*"  # leading whitespace
+            r"([a-z|A-Z|0-9|\.|\_|\-]+)"  # type
+            r"(?:\(([a-z|A-Z|0-9|\.|\_|\-]+)\))?"  # scope
+            r"(\!)?"  # breaking or not (bang in type)
+            r"\:\s(.*)$",  # summary text
+            commit_body.readline().strip(),
+        )
+        commit_type = conventional_commit.group(1)
+    except AttributeError:
+        raise GitCommitNotConventional(revision)
+
+    commit_scope = conventional_commit.group(2)
+    commit_breaking = bool(conventional_commit.group(3))
+    commit_summary = conventional_commit.group(4)
+    # rest of commit body without unnecessary whitespace
+    commit_description = re.sub(r"\n\s+", "\n", commit_body.read().strip())
+
+    if (
+        "\nBREAKING CHANGE" in commit_description
+        or "\nBREAKING-CHANGE" in commit_description
+    ):
+        commit_breaking = True
+
+    return {
+        "type": commit_type,
+        "scope": commit_scope,
+        "breaking": commit_breaking,
+        "summary": commit_summary,
+        "description": commit_description or None,
+    }
+
+
+class ConventionalCommit(
+    collections.namedtuple(
+        "ConventionalCommit",
+        ["hash", "type", "scope", "breaking", "summary", "description"],
+    )
+):
+    """
+    Immutable record of a parsed conventional commit.
+    """
+
+    __slots__ = ()
+
+    def as_dict(self, with_hash=False):
+        """
+        Return the commit as a dictionary in the scheme of `GitReleaseStatus.commits`
+        (including "hash" if `with_hash` is True).
+        """
+
+        commit = self._asdict()
+        if not with_hash:
+            del commit["hash"]
+        return dict(commit)
+
+
+class ReleaseSummary:
+    """
+    Immutable summary of the commits since the latest release, built in a single pass
+    over the commits.
+
+    Attributes:
+
+    `commits`: tuple of `ConventionalCommit` records, newest first
+    `counts`: read-only mapping of commit type to the number of commits of that type
+    `breaking`: tuple of the hashes of breaking changes, newest first
+    `bump`: the highest bump level required by the commits (one of `NONE`, `PATCH`,
+    `MINOR` and `MAJOR`)
+    """
+
+    NONE = 0
+    PATCH = 1
+    MINOR = 2
+    MAJOR = 3
+
+    __slots__ = ("commits", "counts", "breaking", "bump")
+
+    def __init__(self, commits):
+        """
+        Build the summary from an iterable of `(commit_hash, commit)` tuples, like the
+        ones yielded by `GitReleaseStatus.iter_commits`.
+        """
+
+        records = []
+        counts = {}
+        breaking = []
+        bump = self.NONE
+
+        for revision, commit in commits:
+            record = ConventionalCommit(
+                revision,
+                commit["type"],
+                commit["scope"],
+                commit["breaking"],
+                commit["summary"],
+                commit["description"],
+            )
+            records.append(record)
+            counts[record.type] = counts.get(record.type, 0) + 1
+            if record.breaking:
+                breaking.append(record.hash)
+            bump = max(bump, self.bump_level(record))
+
+        object.__setattr__(self, "commits", tuple(records))
+        object.__setattr__(self, "counts", MappingProxyType(counts))
+        object.__setattr__(self, "breaking", tuple(breaking))
+        object.__setattr__(self, "bump", bump)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    @classmethod
+    def bump_level(cls, commit):
+        """
+        Return the bump level required by a single commit (a `ConventionalCommit` or a
+        commit dictionary).
+        """
+
+        if isinstance(commit, dict):
+            commit_type, commit_breaking = commit["type"], commit["breaking"]
+        else:
+            commit_type, commit_breaking = commit.type, commit.breaking
+
+        if commit_breaking:
+            return cls.MAJOR
+        elif commit_type == "feat":
+            return cls.MINOR
+        elif commit_type == "fix":
+            return cls.PATCH
+        else:
+            return cls.NONE
+
+    def group(self, types):
+        """
+        Return a dictionary of the commits of the given `types`, grouped by type, each
+        group being a tuple of `ConventionalCommit` records, newest first.
+        """
+
+        grouped = {commit_type: [] for commit_type in types}
+        for commit in self.commits:
+            if commit.type in grouped:
+                grouped[commit.type].append(commit)
+        return {commit_type: tuple(group) for commit_type, group in grouped.items()}
+
+
+class _CommitCache:
+    """
+    Persistent cache of parsed conventional commits, keyed by commit hash, stored in an
+    sqlite database. Commits are immutable, so entries never go stale, only the least
+    recently used ones are evicted when the cache grows over `max_entries`.
+
+    The cache is best-effort: if the database is corrupt it's recreated, and if that
+    fails too (or the database is locked or read-only), the cache is disabled (with a
+    warning logged) and every lookup misses.
+    """
+
+    # bump when the format of the parsed commits changes, to discard stale entries
+    SCHEMA_VERSION = 1
+    # bound parameters of a statement, the limit of sqlite before 3.32
+    MAX_VARIABLES = 999
+
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._db = None
+        try:
+            self._db = self._open()
+        except sqlite3.OperationalError as e:
+            # locked or cannot be opened, run without cache
+            self._disable(e)
+        except sqlite3.DatabaseError:
+            # corrupt (or not a database at all), start over
+            try:
+                os.remove(self.path)
+                self._db = self._open()
+            except (OSError, sqlite3.DatabaseError) as e:
+                self._disable(e)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, timeout=1)
+        try:
+            if db.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                db.execute("DROP TABLE IF EXISTS commits")
+                db.execute(
+                    "CREATE TABLE commits ("
+                    "hash TEXT PRIMARY KEY, type TEXT, scope TEXT, breaking INTEGER, "
+                    "summary TEXT, description TEXT, used INTEGER)"
+                )
+                db.execute("CREATE INDEX commits_used ON commits (used)")
+                db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+                db.commit()
+            self._clock = db.execute(
+                "SELECT COALESCE(MAX(used), 0) FROM commits"
+            ).fetchone()[0]
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        return db
+
+    def get(self, revisions):
+        """
+        Return a dictionary of the commits in `revisions` found in the cache.
+        """
+
+        if self._db is None or not revisions:
+            return {}
+
+        rows = []
+        self._clock += 1
+        # the UPDATE binds the clock too
+        chunk_size = self.MAX_VARIABLES - 1
+        try:
+            for start in range(0, len(revisions), chunk_size):
+                chunk = revisions[start : start + chunk_size]
+                placeholders = ", ".join("?" * len(chunk))
+                found = self._db.execute(
+                    "SELECT hash, type, scope, breaking, summary, description "
+                    f"FROM commits WHERE hash IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                if found:
+                    self._db.execute(
+                        f"UPDATE commits SET used = ? WHERE hash IN ({placeholders})",
+                        [self._clock, *chunk],
+                    )
+                rows.extend(found)
+            self._db.commit()
+        except sqlite3.DatabaseError as e:
+            self._disable(e)
+            return {}
+
+        return {
+            row[0]: {
+                "type": row[1],
+                "scope": row[2],
+                "breaking": bool(row[3]),
+                "summary": row[4],
+                "description": row[5],
+            }
+            for row in rows
+        }
+
+    def put(self, commits):
+        """
+        Store the `(commit_hash, commit)` tuples of `commits` in the cache, evicting the
+        least recently used entries if the cache is full.
+        """
+
+        if self._db is None or not commits:
+            return
+
+        self._clock += 1
+        try:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        revision,
+                        commit["type"],
+                        commit["scope"],
+                        int(commit["breaking"]),
+                        commit["summary"],
+                        commit["description"],
+                        self._clock,
+                    )
+                    for revision, commit in commits
+                ],
+            )
+            excess = (
+                self._db.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+                - self.max_entries
+            )
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM commits WHERE hash IN "
+                    "(SELECT hash FROM commits ORDER BY used LIMIT ?)",
+                    (excess,),
+                )
+            self._db.commit()
+        except sqlite3.DatabaseError as e:
+            self._disable(e)
+
+    def _disable(self, error):
+        _log.warning(f"commit cache '{self.path}' disabled ({error})")
+        self.close()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class _SubprocessBackend:
+    """
+    Answers the git queries of GitReleaseStatus by running git.
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+
+    def describe(self, revision=None):
+        """
+        Return the output of `git describe` for `revision` (HEAD with the dirty flag if
+        None), or None if there is no version tag that can describe it.
+        """
+
+        if revision is None:
+            revision_args = ["--dirty", "--broken"]
+        else:
+            revision_args = [revision]
+
+        try:
+            proc = subprocess.run(
+                ["git", "describe", "--tags", "--match", "v[0-9]*", *revision_args],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.work_dir,
+            )
+        except FileNotFoundError:
+            raise GitNotFound
+
+        if proc.stderr:
+            if "not a git repository" in proc.stderr.decode():
+                raise GitRepositoryNotFound
+            elif (
+                "no names found" in proc.stderr.decode().lower()
+                or "no tags can describe" in proc.stderr.decode().lower()
+            ):
+                return None
+            else:
+                raise GitUnexpectedError(proc.stderr.decode())
+
+        return proc.stdout.decode()
+
+    def describe_untagged(self, revision=None):
+        """
+        Return the commit count, the abbreviated hash of `revision` (HEAD if None) and
+        whether the working tree is dirty (always False if `revision` is given), for
+        describing it without a version tag.
+        """
+
+        try:
+            proc = subprocess.run(
+                ["git", "rev-parse", "--short", revision or "HEAD"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.work_dir,
+            )
+        except FileNotFoundError:
+            raise GitNotFound
+        if proc.stderr:
+            if "needed a single revision" in proc.stderr.decode().lower():
+                # no commits yet
+                raise GitRepositoryEmpty
+            else:
+                raise GitUnexpectedError(proc.stderr.decode())
+        rev_hash = proc.stdout.decode().strip()
+
+        # get number of commits
+        proc = subprocess.run(
+            ["git", "rev-list", "--count", revision or "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.work_dir,
+        )
+        if proc.stderr:
+            raise GitUnexpectedError(proc.stderr.decode())
+        rev_count = proc.stdout.decode().strip()
+
+        # determine if the working tree contains changes
+        dirty = revision is None and bool(
+            subprocess.run(
+                ["git", "diff", "--quiet"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                cwd=self.work_dir,
+            ).returncode
+        )
+
+        return rev_count, rev_hash, dirty
+
+    def describe_range(self, include, exclude):
+        """
+        Return a generator yielding `(commit_hash, abbreviated_hash, tag, distance)` for
+        the commits reachable from the revisions in `include` but not from the ones in
+        `exclude`, in topological order (see `gitdir.propagate_tags`).
+        """
+
+        proc = subprocess.run(
+            ["git", "log", "--topo-order", "--reverse", "--boundary"]
+            + ["--format=%m %H %h %P"]
+            + list(include)
+            + [f"^{revision}" for revision in exclude]
+            + ["--"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.work_dir,
+        )
+        if proc.returncode:
+            if "not a git repository" in proc.stderr.decode():
+                raise GitRepositoryNotFound
+            raise GitUnexpectedError(proc.stderr.decode())
+
+        commits = []
+        boundary = []
+        for line in proc.stdout.decode().splitlines():
+            mark, commit, abbrev, *parents = line.split()
+            if mark == "-":
+                boundary.append(commit)
+            else:
+                commits.append((commit, abbrev, parents))
+
+        tags = self._version_tags()
+        seeds = {commit: self._describe_boundary(commit) for commit in boundary}
+        abbrevs = {commit: abbrev for commit, abbrev, _ in commits}
+
+        graph = None
+
+        def count_new(include_commits, exclude_commits):
+            # counted in this process, walking the history of `include` (merged
+            # branches may have commits outside of the range), read with one more git
+            # log at the first merge
+            nonlocal graph
+            if graph is None:
+                graph = self._commit_graph(include)
+            walk = gitdir.walk_log(None, include_commits, exclude_commits, graph)
+            return sum(1 for _ in walk)
+
+        return (
+            (commit, abbrevs.pop(commit), tag, distance)
+            for commit, tag, distance in gitdir.propagate_tags(
+                ((commit, parents) for commit, _, parents in commits),
+                tags,
+                count_new,
+                seeds,
+            )
+        )
+
+    def _commit_graph(self, revisions):
+        # gitdir.CommitGraph of the whole history of `revisions`, from one git log
+        proc = subprocess.run(
+            ["git", "log", "--format=%H %ct %P"] + list(revisions) + ["--"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.work_dir,
+        )
+        if proc.returncode:
+            raise GitUnexpectedError(proc.stderr.decode())
+        graph = gitdir.CommitGraph(None)
+        for line in proc.stdout.decode().splitlines():
+            commit, time, *parents = line.split()
+            graph.add(commit, parents, int(time))
+        return graph
+
+    def _version_tags(self):
+        # commit hashes to version tag names, like gitdir.version_tags
+        proc = subprocess.run(
+            [
+                "git",
+                "for-each-ref",
+                "--sort=refname",
+                "--format=%(refname:strip=2) %(objecttype) %(objectname) "
+                "%(*objecttype) %(*objectname) %(taggerdate:unix)",
+                "refs/tags/v[0-9]*",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.work_dir,
+        )
+        if proc.returncode:
+            raise GitUnexpectedError(proc.stderr.decode())
+
+        def candidates():
+            for line in proc.stdout.decode().splitlines():
+                name, object_type, sha, *peeled = line.split()
+                if object_type == "commit":
+                    yield name, sha, False, 0
+                elif peeled[:1] == ["commit"]:
+                    yield name, peeled[1], True, int(peeled[2] if peeled[2:] else 0)
+
+        return {
+            commit: name
+            for commit, (name, _) in gitdir.select_tags(candidates()).items()
+        }
+
+    def _describe_boundary(self, revision):
+        # `(tag, depth)` of a commit outside of a range, `(None, count)` if untagged
+        description = self.describe(revision)
+        if description is None:
+            return None, int(self.describe_untagged(revision)[0])
+        match = re.match(r"(.+)-(\d+)-g[0-9a-f]+$", description.strip())
+        if match is None:
+            return description.strip(), 0
+        return match.group(1), int(match.group(2))
+
+    def iter_log(self, since):
+        """
+        Generator yielding the parsed `(commit_hash, commit)` tuples of the commits
+        since the tag `since` (or all commits if None), newest first.
+        """
+
+        return self._iter_log(
+            ["git", "log", "--no-decorate", "--log-size"]
+            + ([f"{since}.."] if since else [])
+        )
+
+    def iter_revisions(self, since):
+        """
+        Generator yielding the hashes of the commits since the tag `since` (or all
+        commits if None), newest first.
+        """
+
+        git_process = self._popen(
+            ["git", "rev-list", f"{since}.." if since else "HEAD"]
+        )
+        try:
+            for line in git_process.stdout:
+                yield line.strip().decode()
+        finally:
+            self._close_process(git_process)
+
+    def read_log(self, revisions):
+        """
+        Return a list of the parsed `(commit_hash, commit)` tuples of `revisions`.
+        """
+
+        return list(
+            self._iter_log(
+                [
+                    "git",
+                    "log",
+                    "--no-decorate",
+                    "--log-size",
+                    "--no-walk=unsorted",
+                    "--stdin",
+                ],
+                stdin="\n".join(revisions).encode(),
+            )
+        )
+
+    def _popen(self, cmd, stdin=None):
+        try:
+            return subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                cwd=self.work_dir,
+            )
+        except FileNotFoundError:
+            raise GitNotFound
+
+    @staticmethod
+    def _close_process(process):
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+    def _iter_log(self, cmd, stdin=None):
+        # parse the output of a `git log --log-size` command incrementally
+        git_process = self._popen(cmd, stdin)
+        try:
+            if stdin is not None:
+                # git reads all revisions from stdin before it starts writing output
+                git_process.stdin.write(stdin)
+                git_process.stdin.close()
+
+            while True:
+                line = git_process.stdout.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue  # empty line between commits
+
+                revision = re.match(rb"commit ([0-9a-f]+)", line).group(1).decode()
+                log_size = int(
+                    re.match(rb"log size (\d+)", git_process.stdout.readline()).group(1)
+                )
+
+                yield revision, _parse_commit(
+                    revision, git_process.stdout.read(log_size).decode(errors="replace")
+                )
+        finally:
+            self._close_process(git_process)
+
+
+class _PythonBackend:
+    """
+    Answers the git queries of GitReleaseStatus by reading the git directory directly
+    (see `gitdir`), without starting any processes. Raises
+    `gitdir.UnsupportedRepository` for repositories it can't handle.
+    """
+
+    def __init__(self, work_dir):
+        try:
+            self.store = gitdir.Repository.discover(work_dir)
+        except gitdir.UnsupportedRepository:
+            raise
+        except gitdir.GitDirError:
+            raise GitRepositoryNotFound
+        self.graph = gitdir.CommitGraph(self.store)
+
+    def _resolve(self, revision):
+        return self.store.resolve(revision)
+
+    def _is_dirty(self, against_head):
+        return self.store.is_dirty(against_head)
+
+    def _commit(self, revision):
+        sha = self._resolve(revision or "HEAD")
+        if sha is None:
+            if revision is None:
+                raise GitRepositoryEmpty
+            raise GitUnexpectedError(f"unknown revision '{revision}'")
+        try:
+            return gitdir.peel(self.store, sha)[0]
+        except gitdir.MissingObject:
+            raise GitRepositoryBroken
+
+    def describe(self, revision=None):
+        try:
+            commit = self._commit(revision)
+        except GitRepositoryEmpty:
+            return None  # describe_untagged will raise
+        try:
+            description = gitdir.describe(self.store, commit, graph=self.graph)
+            if description is None:
+                return None
+            tag, depth = description
+            if depth:
+                tag = f"{tag}-{depth}-g{self.store.abbreviate(commit)}"
+            if revision is None and self._is_dirty(against_head=True):
+                tag = f"{tag}-dirty"
+        except gitdir.MissingObject:
+            raise GitRepositoryBroken
+        return tag
+
+    def describe_untagged(self, revision=None):
+        commit = self._commit(revision)
+        try:
+            return (
+                gitdir.count(self.store, commit, graph=self.graph),
+                self.store.abbreviate(commit),
+                revision is None and self._is_dirty(against_head=False),
+            )
+        except gitdir.MissingObject:
+            raise GitRepositoryBroken
+
+    def describe_range(self, include, exclude):
+        include = [self._commit(revision) for revision in include]
+        exclude = [self._commit(revision) for revision in exclude]
+        try:
+            descriptions = gitdir.describe_range(
+                self.store, include, exclude, graph=self.graph
+            )
+        except gitdir.MissingObject:
+            raise GitRepositoryBroken
+        return (
+            (commit, self.store.abbreviate(commit), tag, distance)
+            for commit, tag, distance in descriptions
+        )
+
+    def iter_log(self, since):
+        for revision in self.iter_revisions(since):
+            yield revision, self._read_commit(revision)
+
+    def iter_revisions(self, since):
+        head = self._commit(None)
+        exclude = []
+        if since is not None:
+            tag = self._resolve(f"refs/tags/{since}")
+            if tag is None:
+                raise GitUnexpectedError(f"tag '{since}' not found")
+            try:
+                exclude.append(gitdir.peel(self.store, tag)[0])
+            except gitdir.MissingObject:
+                raise GitRepositoryBroken
+        try:
+            yield from gitdir.walk_log(self.store, [head], exclude, self.graph)
+        except gitdir.MissingObject:
+            raise GitRepositoryBroken
+
+    def read_log(self, revisions):
+        return [(revision, self._read_commit(revision)) for revision in revisions]
+
+    def _read_commit(self, revision):
+        try:
+            commit = gitdir.parse_commit(self.store.read_object(revision)[1])
+        except gitdir.MissingObject:
+            raise GitRepositoryBroken
+        try:
+            message = commit.message.decode(commit.encoding, errors="replace")
+        except LookupError:
+            message = commit.message.decode(errors="replace")
+        # empty header, like the part of a git log entry before the message
+        return _parse_commit(revision, "\n" + message)
+
+    def close(self):
+        self.store.close()
+
+
+class _CatFileWorker:
+    # a `git cat-file --batch` process, and a `--batch-check` one started on demand
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self._processes = {}
+
+    def _process(self, option):
+        process = self._processes.get(option)
+        if process is None:
+            try:
+                process = subprocess.Popen(
+                    ["git", "cat-file", option],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    cwd=self.work_dir,
+                )
+            except FileNotFoundError:
+                raise GitNotFound
+            self._processes[option] = process
+        return process
+
+    def request(self, name, contents=True):
+        """
+        Return `(sha, type, data)` of the object `name` (data is None if `contents` is
+        False), or None if it's missing or ambiguous.
+        """
+
+        process = self._process("--batch" if contents else "--batch-check")
+        try:
+            process.stdin.write(name.encode() + b"\n")
+            process.stdin.flush()
+            header = process.stdout.readline()
+        except BrokenPipeError:
+            header = b""
+        if not header:
+            self._fail(process)
+
+        fields = header.split()
+        if len(fields) != 3:
+            return None  # "<name> missing" or "<name> ambiguous"
+        data = None
+        if contents:
+            data = process.stdout.read(int(fields[2]))
+            process.stdout.read(1)  # newline after contents
+        return fields[0].decode(), fields[1].decode(), data
+
+    def _fail(self, process):
+        process.kill()
+        error = process.stderr.read().decode(errors="replace")
+        self.close()
+        if "not a git repository" in error:
+            raise GitRepositoryNotFound
+        raise GitUnexpectedError(error or "git cat-file exited")
+
+    def close(self):
+        for process in self._processes.values():
+            for pipe in (process.stdin, process.stdout, process.stderr):
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+            process.wait()
+        self._processes = {}
+
+
+class GitSession:
+    """
+    A persistent git session, reading objects through long-lived
+    `git cat-file --batch` and `--batch-check` processes, so any number of queries
+    cost a constant number of process startups.
+
+    It provides the object store interface of `gitdir` (`read_object`, `refs`,
+    `abbreviate`), so the history algorithms there (describe, commit count, log walk)
+    run over it without starting git for every query.
+
+    The session is safe to use from multiple threads: requests are multiplexed over a
+    pool of `workers` worker processes (started on demand), each serving one request
+    at a time. Use it as a context manager, or call `close()` when done.
+    """
+
+    def __init__(self, work_dir=None, workers=1):
+        if work_dir is None:
+            self.work_dir = os.getcwd()
+        else:
+            self.work_dir = work_dir
+        self._idle = queue.LifoQueue()
+        self._workers = []
+        self._max_workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._refs = None
+        self._abbrev = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _request(self, name, contents=True):
+        with self._lock:
+            if self._closed:
+                raise GitUnexpectedError("git session is closed")
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                if len(self._workers) < self._max_workers:
+                    worker = _CatFileWorker(self.work_dir)
+                    self._workers.append(worker)
+                else:
+                    worker = None
+        if worker is None:
+            worker = self._idle.get()
+        try:
+            return worker.request(name, contents)
+        finally:
+            self._idle.put(worker)
+
+    def run(self, *args):
+        """
+        Run a git command in the work directory of the session, return the
+        CompletedProcess (with stdout and stderr captured).
+        """
+
+        try:
+            return subprocess.run(
+                ["git", *args],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.work_dir,
+            )
+        except FileNotFoundError:
+            raise GitNotFound
+
+    def resolve(self, revision):
+        """
+        Return the object hash `revision` names (any revision syntax git understands),
+        or None if it names nothing.
+        """
+
+        result = self._request(revision, contents=False)
+        return None if result is None else result[0]
+
+    def read_object(self, sha):
+        """
+        Return `(type, data)` of the object `sha`. Raises gitdir.MissingObject if it's
+        not found.
+        """
+
+        result = self._request(sha)
+        if result is None:
+            raise gitdir.MissingObject(sha)
+        return result[1], result[2]
+
+    def refs(self, prefix="refs/"):
+        """
+        Return a dictionary of ref names starting with `prefix` and the object hashes
+        they point to (listed once per session).
+        """
+
+        with self._lock:
+            if self._refs is None:
+                proc = self.run("for-each-ref", "--format=%(objectname) %(refname)")
+                if proc.returncode:
+                    if "not a git repository" in proc.stderr.decode():
+                        raise GitRepositoryNotFound
+                    raise GitUnexpectedError(proc.stderr.decode())
+                self._refs = dict(
+                    reversed(line.split(" ", 1))
+                    for line in proc.stdout.decode().splitlines()
+                )
+        return {
+            name: sha for name, sha in self._refs.items() if name.startswith(prefix)
+        }
+
+    def abbreviate(self, sha):
+        """
+        Return the shortest unique abbreviation of `sha`, the same way git does.
+        """
+
+        with self._lock:
+            if self._abbrev is None:
+                abbrev = self.run("config", "core.abbrev").stdout.decode().strip()
+                if abbrev.lower() in ("no", "false", "off"):
+                    self._abbrev = 40
+                elif abbrev.isdigit():
+                    self._abbrev = max(4, min(40, int(abbrev)))
+                else:
+                    counts = self.run("count-objects", "-v").stdout.decode()
+                    match = re.search(r"^in-pack: (\d+)", counts, re.MULTILINE)
+                    count = int(match.group(1)) if match else 0
+                    self._abbrev = max(7, (count.bit_length() + 1) // 2)
+
+        length = self._abbrev
+        while length < 40 and self._request(sha[:length], contents=False) is None:
+            length += 1  # ambiguous
+        return sha[:length]
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+
+        with self._lock:
+            self._closed = True
+            for worker in self._workers:
+                worker.close()
+            self._workers = []
+
+
+class _BatchBackend(_PythonBackend):
+    """
+    Answers the git queries of GitReleaseStatus over a `GitSession`, with the same
+    algorithms as the python backend.
+    """
+
+    def __init__(self, work_dir, session=None):
+        self.owns_session = session is None
+        self.store = GitSession(work_dir) if session is None else session
+        self.graph = gitdir.CommitGraph(self.store)
+        # the history walks need every parent, which shallow clones don't have
+        proc = self.store.run("rev-parse", "--is-shallow-repository")
+        if proc.stdout.strip() == b"true":
+            self.close()
+            raise gitdir.UnsupportedRepository("shallow repository")
+
+    def _resolve(self, revision):
+        return self.store.resolve(revision)
+
+    def _is_dirty(self, against_head):
+        if against_head:
+            # the working tree compared to HEAD, like `git describe --dirty` (which
+            # refreshes the index first since git 2.42)
+            self.store.run("update-index", "-q", "--refresh")
+            proc = self.store.run("diff-index", "--quiet", "HEAD", "--")
+        else:
+            proc = self.store.run("diff", "--quiet")
+        if proc.returncode > 1:
+            raise GitUnexpectedError(proc.stderr.decode())
+        return bool(proc.returncode)
+
+    def close(self):
+        if self.owns_session:
+            self.store.close()
+
+
 class GitReleaseStatus:
     """
     This class aids in the release process of a project managed in a git repository.
@@ -70,13 +1084,160 @@ class GitReleaseStatus:
 
     Non-version-tags MUST NEVER start with the letter "v" immediately followed by a
     number (ex. v1-this-is-a-tag). This would also result in unexpected errors.
+
+    SNAPSHOT MODE:
+
+    If `snapshot` is True (the default), the results of the git queries (the describe
+    result, HEAD hash, dirty flag and parsed log) are computed at most once and shared
+    between `head`, `latest`, `commits` and `next`. The snapshot is invalidated
+    automatically when HEAD, the refs or the mtime of the index change. Edits to the
+    working tree that don't touch the index are not detected, so long-lived instances
+    that need to track the dirty flag should pass `snapshot=False`.
+
+    COMMIT CACHE:
+
+    If `commit_cache` is True (the default), parsed commits are also stored in a
+    persistent cache in the git directory (`kyanit-versioning-commits.sqlite`), so
+    later runs only parse the commits they haven't seen before.
+
+    BACKENDS:
+
+    `backend` selects how git is queried: "subprocess" runs git (the default), "python"
+    reads the git directory directly without starting any processes, falling back to
+    running git for repositories it doesn't support (see `gitdir`), and "batch" reads
+    objects over a persistent `GitSession`. If `backend` is None, it's taken from the
+    KYANIT_VERSIONING_BACKEND environment variable. Passing a `session` selects the
+    "batch" backend over that (possibly shared) session.
+
+    Backends may hold resources (processes, mapped files), use the instance as a
+    context manager, or call `close()` when done.
     """
 
-    def __init__(self, work_dir=None):
+    COMMIT_CACHE_FILE = "kyanit-versioning-commits.sqlite"
+    BACKENDS = {
+        "subprocess": _SubprocessBackend,
+        "python": _PythonBackend,
+        "batch": _BatchBackend,
+    }
+
+    def __init__(
+        self,
+        work_dir=None,
+        snapshot=True,
+        commit_cache=True,
+        backend=None,
+        session=None,
+    ):
         if work_dir is None:
             self.work_dir = os.getcwd()
         else:
             self.work_dir = work_dir
+        if session is not None:
+            backend = "batch"
+        elif backend is None:
+            backend = os.environ.get("KYANIT_VERSIONING_BACKEND") or "subprocess"
+        if backend not in self.BACKENDS:
+            raise ValueError(f"unknown backend '{backend}'")
+        self.backend = backend
+        self.session = session
+        self.snapshot = snapshot
+        self.commit_cache = commit_cache
+        self._snapshot = {}
+        self._snapshot_key = None
+        self._commit_cache = None
+        self._backend = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Release the resources held by the backend and the commit cache.
+        """
+
+        if self._backend is not None and hasattr(self._backend, "close"):
+            self._backend.close()
+        self._backend = None
+        if self._commit_cache is not None:
+            self._commit_cache.close()
+            self._commit_cache = None
+
+    def _query(self, name, *args):
+        # run a query on the backend, falling back to git if the backend can't do it
+        if self._backend is None:
+            try:
+                if self.session is not None:
+                    self._backend = _BatchBackend(self.work_dir, self.session)
+                else:
+                    self._backend = self.BACKENDS[self.backend](self.work_dir)
+            except gitdir.UnsupportedRepository:
+                self._backend = _SubprocessBackend(self.work_dir)
+        try:
+            return getattr(self._backend, name)(*args)
+        except gitdir.UnsupportedRepository:
+            self.close()
+            self._backend = _SubprocessBackend(self.work_dir)
+            return getattr(self._backend, name)(*args)
+
+    def _snapshot_state(self):
+        # identifies the state of HEAD, the refs and the index, without invoking git
+        git_dir = _find_git_dir(self.work_dir)
+        if git_dir is None:
+            return None
+
+        common_dir = _find_common_dir(git_dir)
+
+        try:
+            with open(os.path.join(git_dir, "HEAD")) as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+
+        paths = [
+            os.path.join(git_dir, "HEAD"),
+            os.path.join(git_dir, "index"),
+            os.path.join(common_dir, "packed-refs"),
+            os.path.join(common_dir, "refs", "tags"),
+        ]
+        if head.startswith("ref: "):
+            paths.append(os.path.join(common_dir, *head[5:].split("/")))
+
+        state = [head]
+        for path in paths:
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                state.append(None)
+            else:
+                state.append((stat_result.st_mtime_ns, stat_result.st_size))
+        return tuple(state)
+
+    def _memoized(self, name, compute):
+        if not self.snapshot:
+            return compute()
+
+        state = self._snapshot_state()
+        if state is None:
+            return compute()
+        if state != self._snapshot_key:
+            self._snapshot = {}
+            self._snapshot_key = state
+
+        if name not in self._snapshot:
+            self._snapshot[name] = compute()
+            # git may refresh (rewrite) the index while answering a query, adopt the
+            # resulting state, so the snapshot isn't invalidated by git itself
+            self._snapshot_key = self._snapshot_state()
+        return self._snapshot[name]
+
+    def _cached(self, name):
+        # return the value memoized in the snapshot if it's still valid, otherwise None
+        if not self.snapshot or self._snapshot_state() != self._snapshot_key:
+            return None
+        return self._snapshot.get(name)
 
     @property
     def head(self):
@@ -105,85 +1266,77 @@ class GitReleaseStatus:
         3.0.1+3.8d99ee4.clean
         """
 
-        try:
-            proc = subprocess.run(
-                [
-                    "git",
-                    "describe",
-                    "--tags",
-                    "--match",
-                    "v[0-9]*",
-                    "--dirty",
-                    "--broken",
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=self.work_dir,
-            )
-        except FileNotFoundError:
-            raise GitNotFound
+        return self._memoized("head", self._describe)
 
-        if proc.stderr:
-            if "not a git repository" in proc.stderr.decode():
-                raise GitRepositoryNotFound
-            elif (
-                "no names found" in proc.stderr.decode().lower()
-                or "no tags can describe" in proc.stderr.decode().lower()
-            ):
-                # no version tag exists yet, or existing tags can't describe the commit,
-                # get the commit hash instead
-                proc = subprocess.run(
-                    ["git", "rev-parse", "--short", "HEAD"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    cwd=self.work_dir,
-                )
-                if proc.stderr:
-                    if "needed a single revision" in proc.stderr.decode().lower():
-                        # no commits yet
-                        raise GitRepositoryEmpty
-                    else:
-                        raise GitUnexpectedError(proc.stderr.decode())
-                rev_hash = proc.stdout.decode().strip()
-
-                # get number of commits
-                proc = subprocess.run(
-                    ["git", "rev-list", "--count", "HEAD"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    cwd=self.work_dir,
-                )
-                if proc.stderr:
-                    raise GitUnexpectedError(proc.stderr.decode())
-                rev_count = proc.stdout.decode().strip()
-
-                # determine if the working tree contains changes
-                dirty = bool(
-                    subprocess.run(
-                        ["git", "diff", "--quiet"],
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                        cwd=self.work_dir,
-                    ).returncode
-                )
+    def describe(self, revision):
+        """
+        Version string of `revision` (any revision git understands, ex. a commit hash,
+        a branch or a tag), in the same format as `head`. The working tree isn't
+        checked, so it's never dirty.
 
-                # returned version will be 0.0.0+<num_commits>.<commit_hash>.clean/dirty
-                return f"0.0.0+{rev_count}.{rev_hash}.{'dirty' if dirty else 'clean'}"
+        With the "batch" and "python" backends, describing any number of revisions
+        doesn't start any additional processes.
+        """
+
+        return self._describe(revision)
+
+    def describe_range(self, revision_range):
+        """
+        Generator yielding `(commit_hash, version)` tuples for every commit in
+        `revision_range` ("A..B" for the commits reachable from B but not from A, where
+        an omitted side is HEAD, or "B" for the whole history of B), parents first.
+
+        Versions are in the same format as `describe`, but all of them are computed in
+        a single walk of the history, so it's much faster than calling `describe` for
+        each commit. The commit count of a version is the number of commits reachable
+        from the commit but not from the tag, the same as `describe` gives, unless
+        commit times are out of order, where `git describe` (walking by date) may count
+        commits reachable from the tag too (see `gitdir.propagate_tags`).
+        """
+
+        if ".." in revision_range:
+            exclude, include = revision_range.split("..", 1)
+            if include.startswith("."):
+                raise ValueError("symmetric difference ranges are not supported")
+            include, exclude = [include or "HEAD"], [exclude or "HEAD"]
+        else:
+            include, exclude = [revision_range], []
+
+        for commit, rev_hash, tag, distance in self._query(
+            "describe_range", include, exclude
+        ):
+            if tag is None:
+                yield commit, f"0.0.0+{distance}.{rev_hash}.clean"
+                continue
+            match = re.search(r"([0-9]+\.[0-9]+\.[0-9]+)", tag)
+            if match is None:
+                raise GitTagVersionNotSemVer(tag)
+            if distance:
+                yield commit, f"{match.group(1)}+{distance}.{rev_hash}.clean"
             else:
-                raise GitUnexpectedError(proc.stderr.decode())
+                yield commit, match.group(1)
+
+    def _describe(self, revision=None):
+        description = self._query("describe", revision)
+
+        if description is None:
+            # no version tag exists yet, or existing tags can't describe the commit
+            rev_count, rev_hash, dirty = self._query("describe_untagged", revision)
+            # returned version will be 0.0.0+<num_commits>.<commit_hash>.clean/dirty
+            return f"0.0.0+{rev_count}.{rev_hash}.{'dirty' if dirty else 'clean'}"
 
-        if "-broken" in proc.stdout.decode():
+        if "-broken" in description:
             raise GitRepositoryBroken
-        
+
         match = re.search(
             r"([0-9]+\.[0-9]+\.[0-9]+)(?:\-([0-9]+))?(?:\-g([0-9a-f]+))?(?:-(dirty))?",
-            proc.stdout.decode(),
+            description,
         )
 
         try:
             version = match.group(1)
         except AttributeError:
-            raise GitTagVersionNotSemVer(f"{proc.stdout.decode()}")
+            raise GitTagVersionNotSemVer(f"{description}")
 
         rev_count = match.group(2)
         rev_hash = match.group(3)
@@ -224,68 +1377,80 @@ class GitReleaseStatus:
         First key is the newest commit.
         """
 
-        latest = self.latest
-        if latest != "0.0.0":  # there is at least one version tag
-            GIT_CMD = ["git", "log", "--no-decorate", "--log-size", f"v{latest}.."]
-        else:
-            GIT_CMD = ["git", "log", "--no-decorate", "--log-size"]
-
-        git_process = subprocess.Popen(
-            GIT_CMD, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        return collections.OrderedDict(
+            (commit.hash, commit.as_dict()) for commit in self.summary.commits
         )
 
-        git_output = StringIO(git_process.communicate()[0].decode())
-        commits = collections.OrderedDict()
-
-        while True:
-            line = git_output.readline()
-            if not line:
-                break
+    @property
+    def summary(self):
+        """
+        A `ReleaseSummary` of the commits since the latest release. It's built in a
+        single pass over the log, and shared by `commits`, `next` and `group_commits`.
+        """
 
-            revision = re.search(r"commit ([0-9|a-f]+)", line).group(1)
-            log_size = int(re.search(r"log size (\d+)", git_output.readline()).group(1))
+        return self._memoized("summary", lambda: ReleaseSummary(self.iter_commits()))
 
-            commit_body = StringIO(git_output.read(log_size))
+    def iter_commits(self):
+        """
+        Generator yielding `(commit_hash, commit)` tuples of the git log since the
+        latest release, newest first. `commit` is a dictionary with the same scheme as
+        the values of `commits`.
 
-            while commit_body.readline().strip():
-                pass  # discard commit header
+        Commits are parsed incrementally from the output of git (framed by
+        `--log-size`), so memory use doesn't depend on the length of the history.
+        Closing the generator before it's exhausted terminates git.
+        """
 
-            try:
-                conventional_commit = re.match(
-                    r"^\s*"  # leading whitespace
-                    r"([a-z|A-Z|0-9|\.|\_|\-]+)"  # type
-                    r"(?:\(([a-z|A-Z|0-9|\.|\_|\-]+)\))?"  # scope
-                    r"(\!)?"  # breaking or not (bang in type)
-                    r"\:\s(.*)$",  # summary text
-                    commit_body.readline().strip(),
-                )
-            except AttributeError:
-                raise GitCommitNotConventional(revision)
-
-            commit_type = conventional_commit.group(1)
-            commit_scope = conventional_commit.group(2)
-            commit_breaking = bool(conventional_commit.group(3))
-            commit_summary = conventional_commit.group(4)
-            # rest of commit body without unnecessary whitespace
-            commit_description = re.sub(r"\n\s+", "\n", commit_body.read().strip())
-
-            if (
-                "\nBREAKING CHANGE" in commit_description
-                or "\nBREAKING-CHANGE" in commit_description
-            ):
-                commit_breaking = True
-
-            commits[revision] = {
-                "type": commit_type,
-                "scope": commit_scope,
-                "breaking": commit_breaking,
-                "summary": commit_summary,
-                "description": commit_description or None,
-            }
+        latest = self.latest
+        if latest != "0.0.0":  # there is at least one version tag
+            since = f"v{latest}"
+        else:
+            since = None
 
-            git_output.readline()  # read empty line after commit body
+        cache = self._get_commit_cache()
+        if cache is None:
+            yield from self._query("iter_log", since)
+            return
 
-        return commits  # newest first
+        # list the revisions only, and parse the ones not in the cache in batches
+        revisions_iterator = self._query("iter_revisions", since)
+        try:
+            batch_size = 256
+            while True:
+                revisions = []
+                for revision in revisions_iterator:
+                    revisions.append(revision)
+                    if len(revisions) == batch_size:
+                        break
+                if not revisions:
+                    break
+                batch_size = min(batch_size * 2, 4096)
+
+                commits = cache.get(revisions)
+                missing = [
+                    revision for revision in revisions if revision not in commits
+                ]
+                if missing:
+                    parsed = self._query("read_log", missing)
+                    cache.put(parsed)
+                    commits.update(parsed)
+
+                for revision in revisions:
+                    yield revision, commits[revision]
+        finally:
+            revisions_iterator.close()
+
+    def _get_commit_cache(self):
+        if not self.commit_cache:
+            return None
+        if self._commit_cache is None:
+            git_dir = _find_git_dir(self.work_dir)
+            if git_dir is None:
+                return None
+            self._commit_cache = _CommitCache(
+                os.path.join(_find_common_dir(git_dir), self.COMMIT_CACHE_FILE)
+            )
+        return self._commit_cache
 
     @property
     def latest(self):
@@ -336,24 +1501,28 @@ class GitReleaseStatus:
         except ValueError:
             raise GitTagVersionNotSemVer(self.latest)
 
-        commits = self.commits.values()
-
-        for commit in commits:
-            if commit["breaking"]:
-                if version.major == 0:
-                    return str(version.bump_minor())
-                else:
-                    return str(version.bump_major())
-
-        for commit in commits:
-            if commit["type"] == "feat":
-                return str(version.bump_minor())
-
-        for commit in commits:
-            if commit["type"] == "fix":
+        summary = self._cached("summary")
+        if summary is not None:
+            bump = summary.bump
+        else:
+            # stream the log instead, so it can be stopped at the first breaking change
+            bump = ReleaseSummary.NONE
+            for _, commit in self.iter_commits():
+                bump = max(bump, ReleaseSummary.bump_level(commit))
+                if bump == ReleaseSummary.MAJOR:
+                    break
+
+        if bump == ReleaseSummary.MAJOR:
+            if version.major == 0:
                 return str(version.bump_minor())
-
-        return version
+            else:
+                return str(version.bump_major())
+        elif bump in (ReleaseSummary.MINOR, ReleaseSummary.PATCH):
+            # fix-only histories bump the MINOR version as well, as they always have
+            # (not the PATCH version described above)
+            return str(version.bump_minor())
+        else:
+            return str(version)
 
     def group_commits(self, types=["feat", "fix"]):
         """
@@ -377,17 +1546,129 @@ class GitReleaseStatus:
         }
         """
 
-        # apply filter, preserving feat and fix types at the beginning
-        commit_types = set(types)
-        grouped_history = {commit_type: [] for commit_type in commit_types}
-        commits = self.commits.items()
+        grouped = self.summary.group(set(types))
+        return {
+            commit_type: [commit.as_dict(with_hash=True) for commit in commits]
+            for commit_type, commits in grouped.items()
+        }
+
+
+_GIT_ERRORS = (
+    GitNotFound,
+    GitRepositoryNotFound,
+    GitRepositoryEmpty,
+    GitRepositoryBroken,
+    GitUnexpectedError,
+    GitCommitNotConventional,
+    GitTagVersionNotSemVer,
+)
+
+
+def release_status(work_dir, backend=None, commit_cache=True):
+    """
+    Return a dictionary of the release status of the repository in `work_dir` (queried
+    with `backend`, using the commit cache if `commit_cache`), with
+    the keys "work_dir", "latest", "next", "head", "commits" (the number of commits
+    since the latest release), "counts" (the number of commits of each type since the
+    latest release), "breaking" (the number of breaking commits), "seconds" (the time
+    it took) and "error" (None, or the error that prevented getting the status, in
+    which case the other keys may be None).
+    """
+
+    status = dict.fromkeys(
+        ("work_dir", "latest", "next", "head", "commits", "counts", "breaking")
+    )
+    status["work_dir"] = work_dir
+    status["error"] = None
+    start = time.perf_counter()
+    try:
+        if not os.path.isdir(work_dir):
+            raise GitRepositoryNotFound("not a directory")
+        with GitReleaseStatus(
+            work_dir, commit_cache=commit_cache, backend=backend
+        ) as repo_status:
+            summary = repo_status.summary
+            status["latest"] = repo_status.latest
+            status["next"] = repo_status.next
+            status["head"] = repo_status.head
+            status["commits"] = len(summary.commits)
+            status["counts"] = dict(summary.counts)
+            status["breaking"] = len(summary.breaking)
+    except _GIT_ERRORS + (gitdir.GitDirError,) as error:
+        # errors of gitdir the python backend doesn't map to its own (ex. an invalid
+        # gitfile or a symbolic ref loop) are reported the same way
+        status["error"] = type(error).__name__
+        if str(error):
+            status["error"] += f": {error}"
+    status["seconds"] = time.perf_counter() - start
+    return status
+
+
+def release_statuses(work_dirs, jobs=None, backend=None, commit_cache=True):
+    """
+    Generator yielding the `release_status` of each repository in `work_dirs` (in the
+    same order), computed concurrently by a pool of `jobs` threads (the number of CPUs
+    by default).
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=jobs or os.cpu_count() or 1
+    ) as executor:
+        yield from executor.map(
+            lambda work_dir: release_status(work_dir, backend, commit_cache), work_dirs
+        )
 
-        for commit in commits:
-            if commit[1]["type"] in commit_types:
-                grouped_history[commit[1]["type"]].append(commit[1])
-                grouped_history[commit[1]["type"]][-1]["hash"] = commit[0]
 
-        return grouped_history
+def _expand_repos(patterns):
+    # directories given, and the ones matching glob patterns (if the shell didn't
+    # expand them)
+    work_dirs = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            work_dirs.extend(sorted(filter(os.path.isdir, glob.glob(pattern))))
+        else:
+            work_dirs.append(pattern)
+    return work_dirs
+
+
+def _print_release_table(statuses):
+    # one row per repository, columns aligned
+    header = ("REPOSITORY", "LATEST", "NEXT", "HEAD", "FEAT", "FIX", "BREAKING", "TIME")
+    rows = []
+    start = time.perf_counter()
+    for status in statuses:
+        if status["error"] is not None:
+            row = (status["work_dir"], f"ERROR: {status['error']}")
+        else:
+            row = (
+                status["work_dir"],
+                status["latest"],
+                status["next"],
+                status["head"],
+                str(status["counts"].get("feat", 0)),
+                str(status["counts"].get("fix", 0)),
+                str(status["breaking"]),
+            )
+        rows.append(row + ("",) * (len(header) - 1 - len(row)))
+        rows[-1] += (f"{status['seconds']:.2f}s",)
+
+    widths = [len(column) for column in header]
+    for row in rows:
+        if not row[1].startswith("ERROR: "):
+            widths = [max(width, len(cell)) for width, cell in zip(widths, row)]
+    for row in [header] + rows:
+        if row[1].startswith("ERROR: "):
+            print(f"{row[0]:<{widths[0]}}  {row[1]}  ({row[-1]})")
+        else:
+            print(
+                "  ".join(
+                    f"{cell:<{width}}" for cell, width in zip(row, widths)
+                ).rstrip()
+            )
+    _print_status(
+        "repositories",
+        f"{len(rows)} checked in {time.perf_counter() - start:.2f}s",
+    )
 
 
 def command_line(*args):
@@ -435,9 +1716,97 @@ def command_line(*args):
         'passed',
     )
 
+    parser.add_argument(
+        "--backend",
+        choices=sorted(GitReleaseStatus.BACKENDS),
+        help="how to query git: run git (subprocess), read the repository directly "
+        "(python), or read objects from one persistent git process (batch); defaults "
+        "to the KYANIT_VERSIONING_BACKEND environment variable, or subprocess",
+    )
+
+    parser.add_argument(
+        "--no-commit-cache",
+        action="store_true",
+        help="do not read or store parsed commits in the commit cache of the "
+        "repository",
+    )
+
+    parser.add_argument(
+        "--describe-range",
+        metavar="RANGE",
+        help="print the version of every commit in RANGE (A..B, or B for its whole "
+        "history), as JSON lines of commit hash and version, parents first; the "
+        "commit counts may differ from git describe where commit times are out of "
+        "order",
+    )
+
+    parser.add_argument(
+        "--repos",
+        metavar="DIR",
+        nargs="+",
+        help="print the release status (latest, next, head and changelog counts) of "
+        "every repository DIR (or glob pattern) concurrently, as a table",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of repositories to check concurrently with --repos; defaults to "
+        "the number of CPUs",
+    )
+
+    parser.add_argument(
+        "--json", action="store_true", help="print JSON instead of text",
+    )
+
     args = parser.parse_args(*args)
 
-    repo_status = GitReleaseStatus()
+    if args.repos:
+        statuses = release_statuses(
+            _expand_repos(args.repos),
+            jobs=args.jobs,
+            backend=args.backend,
+            commit_cache=not args.no_commit_cache,
+        )
+        if args.json:
+            print(json.dumps({"repositories": list(statuses)}, indent=2))
+        else:
+            _print_release_table(statuses)
+        return
+
+    repo_status = GitReleaseStatus(
+        commit_cache=not args.no_commit_cache, backend=args.backend
+    )
+
+    if args.describe_range:
+        for commit, version in repo_status.describe_range(args.describe_range):
+            print(json.dumps({"commit": commit, "version": version}), flush=True)
+        return
+
+    if args.json:
+        # everything from the one summary of the log
+        summary = repo_status.summary
+        print(
+            json.dumps(
+                {
+                    "latest": repo_status.latest,
+                    "next": repo_status.next,
+                    "head": repo_status.head,
+                    "changelog": repo_status.group_commits(
+                        args.changelog or ["feat", "fix"]
+                    ),
+                    "counts": dict(summary.counts),
+                    "breaking": list(summary.breaking),
+                },
+                indent=2,
+            )
+        )
+        return
+
+    if args.changelog or args.all:
+        # the changelog needs the whole log anyway, summarize it once for all queries
+        summary = repo_status.summary
 
     if args.latest or args.all:
         version = repo_status.latest
@@ -482,12 +1851,13 @@ def command_line(*args):
                         )
                     print()
 
-        aggregate  = ""
+        aggregate = ""
         for type_ in args.changelog:
+            count = summary.counts.get(type_, 0)
             if not aggregate:
-                aggregate = f"{len(changelog[type_])} {type_} commit(s)"
+                aggregate = f"{count} {type_} commit(s)"
             else:
-                aggregate = f"{aggregate}, {len(changelog[type_])} {type_} commit(s)"
+                aggregate = f"{aggregate}, {count} {type_} commit(s)"
         _print_status(
             "changelog",
             f"{aggregate} since last release",
@@ -0,0 +1,363 @@
+"""
+Benchmarks of GitReleaseStatus over synthetic repositories.
+
+Generates git repositories of conventional commits (with `git fast-import`) of
+configurable size, tag density, body length and frequency of BREAKING CHANGE footers,
+then times the queries of GitReleaseStatus (`head`, `latest`, `commits`, `next`,
+`group_commits`) and `command_line --all` on each backend. Every measurement runs in a
+fresh process, so it starts cold and its peak RSS is its own.
+
+Run it with `python -m kyanit_buildtools.versioning.benchmark`, results are written to
+a JSON file with the wall time, the number of processes started and the peak RSS of
+each measurement.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+from . import GitReleaseStatus, command_line as versioning_command_line
+
+OPERATIONS = ("head", "latest", "commits", "next", "group_commits", "all")
+
+_TYPES = ("feat", "fix", "fix", "chore", "docs", "refactor", "perf", "test")
+_SCOPES = (None, "core", "wlan", "http", "build", "runner")
+_WORDS = (
+    "firmware board flash serial network module runner config update release build "
+    "partition memory socket timer sensor driver stack buffer cache status event"
+).split()
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _message(rng, index, paragraphs, breaking):
+    # a conventional commit message with a multi-paragraph body
+    commit_type = rng.choice(_TYPES)
+    scope = rng.choice(_SCOPES)
+    header = f"{commit_type}({scope})" if scope else commit_type
+    lines = [f"{header}: {_sentence(rng, 6)} {index}"]
+    for _ in range(paragraphs):
+        lines.append("")
+        lines.extend(_sentence(rng, 12) for _ in range(rng.randint(2, 6)))
+    if breaking:
+        lines.extend(["", f"BREAKING CHANGE: {_sentence(rng, 10)}"])
+    return "\n".join(lines) + "\n"
+
+
+def generate_repo(path, commits, tag_every=0, paragraphs=3, breaking_every=0, seed=0):
+    """
+    Create a git repository in `path` with `commits` conventional commits on master,
+    each with `paragraphs` paragraphs of body, and a BREAKING CHANGE footer in every
+    `breaking_every`-th commit. Every `tag_every`-th commit gets an annotated version
+    tag (except the last commit, so there are always commits since the latest
+    release). No tags, or no breaking commits if 0.
+    """
+
+    rng = random.Random(seed)
+    subprocess.run(["git", "init", "-q", path], check=True)
+    stream = io.BytesIO()
+    tag_count = 0
+    for index in range(1, commits + 1):
+        timestamp = 1600000000 + index * 60
+        message = _message(
+            rng,
+            index,
+            paragraphs,
+            bool(breaking_every) and index % breaking_every == 0,
+        ).encode()
+        content = f"{index}\n".encode()
+        stream.write(b"commit refs/heads/master\nmark :%d\n" % index)
+        stream.write(b"committer Bench <bench@example.com> %d +0000\n" % timestamp)
+        stream.write(b"data %d\n%s" % (len(message), message))
+        stream.write(b"M 644 inline file\ndata %d\n%s\n" % (len(content), content))
+        if tag_every and index % tag_every == 0 and index != commits:
+            tag_count += 1
+            tag_message = f"release {tag_count}\n".encode()
+            stream.write(b"tag v0.%d.0\nfrom :%d\n" % (tag_count, index))
+            stream.write(b"tagger Bench <bench@example.com> %d +0000\n" % timestamp)
+            stream.write(b"data %d\n%s\n" % (len(tag_message), tag_message))
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        input=stream.getvalue(),
+        cwd=path,
+        check=True,
+    )
+    subprocess.run(["git", "checkout", "-q", "-f", "master"], cwd=path, check=True)
+
+
+def _peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _run_operation(repo, backend, operation, commit_cache):
+    # run one measurement in this (fresh) process, return its results
+    processes = [0]
+    popen_init = subprocess.Popen.__init__
+
+    def counting_init(self, *args, **kwargs):
+        processes[0] += 1
+        popen_init(self, *args, **kwargs)
+
+    subprocess.Popen.__init__ = counting_init
+    os.chdir(repo)
+    start = time.perf_counter()
+    if operation == "all":
+        with contextlib.redirect_stdout(io.StringIO()):
+            cache_args = [] if commit_cache else ["--no-commit-cache"]
+            versioning_command_line(["--all", "--backend", backend] + cache_args)
+    else:
+        with GitReleaseStatus(
+            repo, backend=backend, commit_cache=commit_cache
+        ) as repo_status:
+            if operation == "group_commits":
+                repo_status.group_commits(["feat", "fix"])
+            else:
+                getattr(repo_status, operation)
+    wall = time.perf_counter() - start
+    subprocess.Popen.__init__ = popen_init
+
+    return {
+        "wall_seconds": wall,
+        "subprocesses": processes[0],
+        "peak_rss_kb": _peak_rss_kb(),
+    }
+
+
+def _measure(repo, backend, operation, commit_cache, repeat):
+    # run a measurement `repeat` times, each in a new process, keep the fastest
+    cache_file = os.path.join(repo, ".git", GitReleaseStatus.COMMIT_CACHE_FILE)
+    runs = []
+    for _ in range(repeat):
+        if commit_cache == "cold":
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(cache_file)
+        proc = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "kyanit_buildtools.versioning.benchmark",
+                "--run-operation",
+                json.dumps([repo, backend, operation, commit_cache != "off"]),
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        runs.append(json.loads(proc.stdout))
+    result = min(runs, key=lambda run: run["wall_seconds"])
+    result["wall_seconds_all"] = [run["wall_seconds"] for run in runs]
+    return result
+
+
+def run_benchmarks(
+    work_dir,
+    sizes=(1000, 10000, 100000),
+    tag_every=(0, 100),
+    paragraphs=3,
+    breaking_every=50,
+    backends=None,
+    operations=OPERATIONS,
+    commit_cache="cold",
+    repeat=3,
+):
+    """
+    Generator yielding a dictionary of results for every combination of repository
+    size, tag density, backend and operation. Repositories are generated in
+    `work_dir` (reused if they already exist there). `commit_cache` is "off" (not
+    used), "cold" (deleted before each run) or "warm" (kept between runs).
+    """
+
+    for commits in sizes:
+        for tag_density in tag_every:
+            repo = os.path.join(
+                work_dir,
+                f"repo-{commits}-t{tag_density}-p{paragraphs}-b{breaking_every}",
+            )
+            if not os.path.isdir(repo):
+                generate_start = time.perf_counter()
+                generate_repo(repo, commits, tag_density, paragraphs, breaking_every)
+                print(
+                    f"generated {repo} in {time.perf_counter() - generate_start:.1f}s",
+                    file=sys.stderr,
+                )
+            if commit_cache == "warm":
+                # fill the cache once, outside of the measurements
+                GitReleaseStatus(repo).summary
+            for backend in backends or sorted(GitReleaseStatus.BACKENDS):
+                for operation in operations:
+                    result = {
+                        "commits": commits,
+                        "tag_every": tag_density,
+                        "paragraphs": paragraphs,
+                        "breaking_every": breaking_every,
+                        "backend": backend,
+                        "operation": operation,
+                        "commit_cache": commit_cache,
+                    }
+                    result.update(
+                        _measure(repo, backend, operation, commit_cache, repeat)
+                    )
+                    print(
+                        f"{commits:>7} commits, tag every {tag_density:>4}, "
+                        f"{backend:<10} {operation:<14} "
+                        f"{result['wall_seconds']:8.3f}s "
+                        f"{result['subprocesses']:>4} processes "
+                        f"{result['peak_rss_kb'] / 1024:7.1f} MiB",
+                        file=sys.stderr,
+                    )
+                    yield result
+
+
+def _git_version():
+    try:
+        return (
+            subprocess.run(["git", "--version"], stdout=subprocess.PIPE)
+            .stdout.decode()
+            .strip()
+        )
+    except FileNotFoundError:
+        return None
+
+
+def command_line(*args):
+    parser = argparse.ArgumentParser(
+        prog="python -m kyanit_buildtools.versioning.benchmark",
+        description="Benchmark kyanit-versioning over synthetic git repositories.",
+    )
+
+    parser.add_argument(
+        "--sizes",
+        metavar="N",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="number of commits of the generated repositories (default: 1000 10000 "
+        "100000)",
+    )
+
+    parser.add_argument(
+        "--tag-every",
+        metavar="N",
+        type=int,
+        nargs="+",
+        default=[0, 100],
+        help="tag densities: a version tag on every N-th commit, 0 for no tags "
+        "(default: 0 100)",
+    )
+
+    parser.add_argument(
+        "--paragraphs",
+        type=int,
+        default=3,
+        help="paragraphs in the body of each commit message (default: 3)",
+    )
+
+    parser.add_argument(
+        "--breaking-every",
+        metavar="N",
+        type=int,
+        default=50,
+        help="a BREAKING CHANGE footer in every N-th commit, 0 for none (default: 50)",
+    )
+
+    parser.add_argument(
+        "--backend",
+        dest="backends",
+        nargs="+",
+        choices=sorted(GitReleaseStatus.BACKENDS),
+        help="backends to benchmark (default: all)",
+    )
+
+    parser.add_argument(
+        "--operation",
+        dest="operations",
+        nargs="+",
+        choices=OPERATIONS,
+        default=list(OPERATIONS),
+        help="operations to time (default: all), 'all' is `kyanit-versioning --all`",
+    )
+
+    parser.add_argument(
+        "--commit-cache",
+        choices=("off", "cold", "warm"),
+        default="cold",
+        help="commit cache state of the measurements (default: cold)",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="run each measurement this many times, keep the fastest (default: 3)",
+    )
+
+    parser.add_argument(
+        "--work-dir",
+        help="where to generate the repositories, they are reused from here in later "
+        "runs (default: a temporary directory, removed at the end)",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="versioning-benchmark.json",
+        help="JSON file to write the results to (default: versioning-benchmark.json)",
+    )
+
+    parser.add_argument("--run-operation", help=argparse.SUPPRESS)
+
+    args = parser.parse_args(*args)
+
+    if args.run_operation:
+        print(json.dumps(_run_operation(*json.loads(args.run_operation))))
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="kyanit-versioning-bench-")
+    try:
+        results = list(
+            run_benchmarks(
+                work_dir,
+                sizes=args.sizes,
+                tag_every=args.tag_every,
+                paragraphs=args.paragraphs,
+                breaking_every=args.breaking_every,
+                backends=args.backends,
+                operations=args.operations,
+                commit_cache=args.commit_cache,
+                repeat=args.repeat,
+            )
+        )
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "git": _git_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print(f"results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    command_line()
@@ -0,0 +1,1328 @@
+"""
+Pure-Python reader of git repositories.
+
+Reads refs, packed-refs, tags, loose objects and packfiles (through their `.idx` files,
+with mmap) directly from the git directory, and implements the history queries needed
+for versioning (describe, commit count, log walk, dirty check) on top of them, so they
+can be answered without starting git.
+
+Only what's needed for versioning is supported. Repositories using anything else
+(SHA-256 object format, reftables, shallow clones, grafts, replace refs, partial
+clones, split or sparse indexes, submodules, content filters on changed files, etc.)
+raise `UnsupportedRepository`, and the caller is expected to fall back to git itself.
+
+The history algorithms (`describe`, `count`, `walk_log`) work with any object store
+providing `read_object(sha)`, `refs(prefix)` and `abbreviate(sha)`.
+"""
+
+import os
+import re
+import mmap
+import stat
+import zlib
+import heapq
+import struct
+import fnmatch
+import hashlib
+import binascii
+import collections
+
+
+class GitDirError(Exception):
+    pass
+
+
+class UnsupportedRepository(GitDirError):
+    pass
+
+
+class MissingObject(GitDirError):
+    pass
+
+
+OBJECT_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+OFS_DELTA = 6
+REF_DELTA = 7
+
+# extensions of repository format version 1 that don't affect reading
+SAFE_EXTENSIONS = {"noop", "preciousobjects", "worktreeconfig"}
+
+# maximum number of tags considered by describe, same as git's default
+DESCRIBE_CANDIDATES = 10
+
+CommitInfo = collections.namedtuple(
+    "CommitInfo", ["tree", "parents", "time", "encoding", "message"]
+)
+
+
+def read_config(path):
+    """
+    Return the variables of a git config file in a dictionary, keyed by
+    "section.key" or "section.subsection.key" (section and key in lowercase). Missing
+    files result in an empty dictionary. Includes are not followed.
+    """
+
+    config = {}
+    section = ""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return config
+
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        match = re.match(r'\[\s*([^\s\]"]+)(?:\s+"(.*)")?\s*\](.*)', line)
+        if match is not None:
+            section = match.group(1).lower()
+            if match.group(2) is not None:
+                section = f"{section}.{match.group(2)}"
+            line = match.group(3).strip()
+            if not line:
+                continue
+        match = re.match(r"([A-Za-z][A-Za-z0-9-]*)\s*(?:=\s*(.*))?$", line)
+        if match is None:
+            continue
+        value = match.group(2)
+        if value is None:
+            value = "true"  # key without value is a boolean true
+        else:
+            value = re.sub(r'\s*[#;][^"]*$', "", value).strip().strip('"')
+        config[f"{section}.{match.group(1).lower()}"] = value
+    return config
+
+
+def config_bool(value, default):
+    if value is None:
+        return default
+    return value.lower() in ("true", "yes", "on", "1")
+
+
+def parse_commit(data):
+    """
+    Parse the raw data of a commit object into a `CommitInfo`.
+    """
+
+    header, _, message = data.partition(b"\n\n")
+    tree = None
+    parents = []
+    time = 0
+    encoding = "utf-8"
+    for line in header.split(b"\n"):
+        if line.startswith(b"tree "):
+            tree = line[5:].decode()
+        elif line.startswith(b"parent "):
+            parents.append(line[7:].decode())
+        elif line.startswith(b"committer "):
+            time = int(line.rsplit(b" ", 2)[1])
+        elif line.startswith(b"encoding "):
+            encoding = line[9:].decode()
+    return CommitInfo(tree, tuple(parents), time, encoding, message)
+
+
+def parse_tag(data):
+    """
+    Return the object hash, object type and tagger timestamp of a tag object.
+    """
+
+    header = data.partition(b"\n\n")[0]
+    target = target_type = None
+    time = 0
+    for line in header.split(b"\n"):
+        if line.startswith(b"object "):
+            target = line[7:].decode()
+        elif line.startswith(b"type "):
+            target_type = line[5:].decode()
+        elif line.startswith(b"tagger "):
+            try:
+                time = int(line.rsplit(b" ", 2)[1])
+            except (IndexError, ValueError):
+                pass
+    return target, target_type, time
+
+
+def parse_tree(data):
+    """
+    Generator yielding `(mode, name, sha)` tuples of the entries of a tree object.
+    """
+
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        yield int(data[pos:space], 8), data[space + 1 : nul], data[nul + 1 : nul + 21]
+        pos = nul + 21
+
+
+def _inflate(buffer, offset):
+    # decompress a zlib stream starting at offset, without copying the whole buffer
+    decompressor = zlib.decompressobj()
+    chunks = []
+    chunk_size = 4096
+    with memoryview(buffer) as view:
+        while not decompressor.eof:
+            with view[offset : offset + chunk_size] as chunk:
+                if not chunk:
+                    raise zlib.error("truncated zlib stream")
+                chunks.append(decompressor.decompress(chunk))
+            offset += chunk_size
+            chunk_size = min(chunk_size * 4, 1 << 20)
+    return b"".join(chunks)
+
+
+def _apply_delta(base, delta):
+    def varint(pos):
+        value = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, pos
+
+    base_size, pos = varint(0)
+    result_size, pos = varint(pos)
+    if base_size != len(base):
+        raise zlib.error("delta base size mismatch")
+
+    result = bytearray()
+    while pos < len(delta):
+        opcode = delta[pos]
+        pos += 1
+        if opcode & 0x80:  # copy from base
+            copy_offset = copy_size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    copy_offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if opcode & (1 << (4 + i)):
+                    copy_size |= delta[pos] << (8 * i)
+                    pos += 1
+            result += base[copy_offset : copy_offset + (copy_size or 0x10000)]
+        elif opcode:  # insert
+            result += delta[pos : pos + opcode]
+            pos += opcode
+        else:
+            raise zlib.error("invalid delta opcode")
+
+    if len(result) != result_size:
+        raise zlib.error("delta result size mismatch")
+    return bytes(result)
+
+
+class Pack:
+    """
+    A packfile and its index (version 1 or 2), both accessed through mmap.
+    """
+
+    def __init__(self, idx_path):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-4] + ".pack"
+        with open(idx_path, "rb") as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pack = None
+
+        if self._idx[:4] == b"\377tOc":
+            version = struct.unpack(">I", self._idx[4:8])[0]
+            if version != 2:
+                raise UnsupportedRepository(f"pack index version {version}")
+            self._fanout_offset = 8
+            self.version = 2
+        else:
+            self._fanout_offset = 0
+            self.version = 1
+
+        self._fanout = struct.unpack(
+            ">256I", self._idx[self._fanout_offset : self._fanout_offset + 1024]
+        )
+        self.count = self._fanout[255]
+        self._names_offset = self._fanout_offset + 1024
+        if self.version == 2:
+            self._offsets_offset = self._names_offset + self.count * 24  # name + crc
+            self._large_offsets_offset = self._offsets_offset + self.count * 4
+
+    def __len__(self):
+        return self.count
+
+    def _name(self, index):
+        if self.version == 2:
+            start = self._names_offset + index * 20
+        else:
+            start = self._names_offset + index * 24 + 4
+        return self._idx[start : start + 20]
+
+    def _offset(self, index):
+        if self.version == 1:
+            start = self._names_offset + index * 24
+            return struct.unpack(">I", self._idx[start : start + 4])[0]
+        start = self._offsets_offset + index * 4
+        offset = struct.unpack(">I", self._idx[start : start + 4])[0]
+        if offset & 0x80000000:
+            start = self._large_offsets_offset + (offset & 0x7FFFFFFF) * 8
+            offset = struct.unpack(">Q", self._idx[start : start + 8])[0]
+        return offset
+
+    def _bisect(self, name):
+        # index of the first entry not less than name
+        low = self._fanout[name[0] - 1] if name[0] else 0
+        high = self._fanout[name[0]]
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, name):
+        """
+        Return the pack offset of the object with the (binary) hash `name`, or None.
+        """
+
+        index = self._bisect(name)
+        if index < self.count and self._name(index) == name:
+            return self._offset(index)
+        return None
+
+    def names_from(self, name):
+        """
+        Generator yielding the hashes in the index from the position of `name` on.
+        """
+
+        for index in range(self._bisect(name), self.count):
+            yield self._name(index)
+
+    def neighbors(self, name):
+        """
+        Return the hashes of the entries around the position of `name` in the index
+        (excluding `name` itself).
+        """
+
+        index = self._bisect(name)
+        result = []
+        if index > 0:
+            result.append(self._name(index - 1))
+        if index < self.count and self._name(index) == name:
+            index += 1
+        if index < self.count:
+            result.append(self._name(index))
+        return result
+
+    def read_entry(self, offset):
+        """
+        Return `(type, data, base)` of the entry at `offset`, where type is the pack
+        object type number, and base is the base offset (OFS_DELTA), the base hash
+        (REF_DELTA) or None. Delta data is returned undecoded.
+        """
+
+        if self._pack is None:
+            with open(self.pack_path, "rb") as f:
+                self._pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pack = self._pack
+
+        start = offset
+        byte = pack[offset]
+        offset += 1
+        object_type = (byte >> 4) & 7
+        while byte & 0x80:  # skip size, it's implied by the zlib stream
+            byte = pack[offset]
+            offset += 1
+
+        base = None
+        if object_type == OFS_DELTA:
+            byte = pack[offset]
+            offset += 1
+            distance = byte & 0x7F
+            while byte & 0x80:
+                byte = pack[offset]
+                offset += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7F)
+            base = start - distance  # relative to the start of the entry
+        elif object_type == REF_DELTA:
+            base = pack[offset : offset + 20]
+            offset += 20
+
+        return object_type, _inflate(pack, offset), base
+
+    def close(self):
+        self._idx.close()
+        if self._pack is not None:
+            self._pack.close()
+
+
+class Repository:
+    """
+    Read-only access to a git repository on disk. `git_dir` is the git directory,
+    `work_tree` is the root of the working tree (None for bare repositories).
+
+    Use `Repository.discover(path)` to find the repository containing a directory.
+    """
+
+    # number of delta bases kept in memory (delta chains share their bases)
+    BASE_CACHE_SIZE = 256
+
+    def __init__(self, git_dir, work_tree=None):
+        self.git_dir = git_dir
+        self.work_tree = work_tree
+        try:
+            with open(os.path.join(git_dir, "commondir")) as f:
+                self.common_dir = os.path.normpath(
+                    os.path.join(git_dir, f.read().strip())
+                )
+        except OSError:
+            self.common_dir = git_dir
+        if not os.path.isfile(os.path.join(git_dir, "HEAD")):
+            raise GitDirError(f"not a git directory: {git_dir}")
+
+        self.config = read_config(os.path.join(self.common_dir, "config"))
+        if config_bool(self.config.get("extensions.worktreeconfig"), False):
+            self.config.update(read_config(os.path.join(git_dir, "config.worktree")))
+
+        self.objects_dir = os.path.join(self.common_dir, "objects")
+        self._object_dirs = [self.objects_dir]
+        self._read_alternates(self.objects_dir)
+        self._packs = None
+        self._packed_refs = None
+        self._base_cache = collections.OrderedDict()
+        self._check_supported()
+
+    @classmethod
+    def discover(cls, path):
+        """
+        Return the repository containing `path` (searching parent directories).
+        Raises GitDirError if there's none.
+        """
+
+        for variable in ("GIT_DIR", "GIT_WORK_TREE", "GIT_OBJECT_DIRECTORY"):
+            if os.environ.get(variable):
+                raise UnsupportedRepository(f"{variable} is set")
+
+        path = os.path.abspath(path)
+        while True:
+            dot_git = os.path.join(path, ".git")
+            if os.path.isdir(dot_git):
+                return cls(dot_git, path)
+            if os.path.isfile(dot_git):
+                with open(dot_git) as f:
+                    match = re.match(r"gitdir:\s*(.*)", f.read().strip())
+                if match is None:
+                    raise GitDirError(f"invalid gitfile: {dot_git}")
+                return cls(os.path.normpath(os.path.join(path, match.group(1))), path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise GitDirError("not a git repository")
+            path = parent
+
+    def _check_supported(self):
+        config = self.config
+        version = int(config.get("core.repositoryformatversion", "0") or 0)
+        if version > 1:
+            raise UnsupportedRepository(f"repository format version {version}")
+        if version == 1:
+            for key, value in config.items():
+                if not key.startswith("extensions."):
+                    continue
+                extension = key[len("extensions.") :]
+                if extension == "objectformat" and value.lower() == "sha1":
+                    continue
+                if extension not in SAFE_EXTENSIONS:
+                    raise UnsupportedRepository(f"extension {extension}={value}")
+        if config.get("core.worktree"):
+            raise UnsupportedRepository("core.worktree is set")
+        for name in ("shallow", os.path.join("info", "grafts")):
+            if os.path.exists(os.path.join(self.common_dir, name)):
+                raise UnsupportedRepository(f"{name} exists")
+        if os.environ.get("GIT_NO_REPLACE_OBJECTS") is None and self.refs(
+            "refs/replace/"
+        ):
+            raise UnsupportedRepository("replace refs exist")
+
+    def _read_alternates(self, objects_dir, depth=0):
+        try:
+            with open(os.path.join(objects_dir, "info", "alternates")) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            alternate = os.path.normpath(os.path.join(objects_dir, line))
+            if alternate not in self._object_dirs and depth < 5:
+                self._object_dirs.append(alternate)
+                self._read_alternates(alternate, depth + 1)
+
+    # REFS
+
+    def _get_packed_refs(self):
+        if self._packed_refs is None:
+            self._packed_refs = {}
+            try:
+                with open(os.path.join(self.common_dir, "packed-refs"), "rb") as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                lines = []
+            for line in lines:
+                if not line or line[:1] in (b"#", b"^"):
+                    continue
+                sha, _, name = line.decode(errors="replace").partition(" ")
+                self._packed_refs[name] = sha
+        return self._packed_refs
+
+    def _ref_dir(self, name):
+        # per-worktree refs live in the git directory, the rest in the common one
+        if "/" not in name or name.startswith(
+            ("refs/bisect/", "refs/worktree/", "refs/rewritten/")
+        ):
+            return self.git_dir
+        return self.common_dir
+
+    def read_ref(self, name, depth=0):
+        """
+        Return the object hash a ref (ex. "HEAD", "refs/tags/v1.0.0") points to,
+        following symbolic refs, or None if the ref doesn't exist (or is unborn).
+        """
+
+        if depth > 5:
+            raise GitDirError(f"symbolic ref loop at {name}")
+        try:
+            with open(os.path.join(self._ref_dir(name), *name.split("/"))) as f:
+                value = f.read().strip()
+        except (IsADirectoryError, NotADirectoryError, FileNotFoundError):
+            return self._get_packed_refs().get(name)
+        if value.startswith("ref:"):
+            return self.read_ref(value[4:].strip(), depth + 1)
+        return value
+
+    def resolve(self, revision):
+        """
+        Return the object hash `revision` names, or None if it names nothing. Only
+        full or abbreviated hashes and ref names are supported (in the same order of
+        precedence as git), other revision syntax raises UnsupportedRepository.
+        """
+
+        if re.match(r"^[0-9a-f]{40}$", revision):
+            return revision
+        for name in (
+            revision,
+            f"refs/{revision}",
+            f"refs/tags/{revision}",
+            f"refs/heads/{revision}",
+            f"refs/remotes/{revision}",
+            f"refs/remotes/{revision}/HEAD",
+        ):
+            if name != "HEAD" and "/" not in name:
+                continue  # only HEAD is looked up outside of refs/
+            sha = self.read_ref(name)
+            if sha is not None:
+                return sha
+        if re.match(r"^[0-9a-f]{4,39}$", revision):
+            return self._find_prefix(revision)
+        raise UnsupportedRepository(f"revision syntax '{revision}'")
+
+    def _find_prefix(self, prefix):
+        # the only object whose hash starts with prefix, or None
+        padded = binascii.unhexlify((prefix + "0" * 40)[:40])
+        found = set()
+        for pack in self._get_packs():
+            for name in pack.names_from(padded):
+                if not name.hex().startswith(prefix) or len(found) > 1:
+                    break
+                found.add(name.hex())
+        for objects_dir in self._object_dirs:
+            try:
+                names = os.listdir(os.path.join(objects_dir, prefix[:2]))
+            except OSError:
+                continue
+            found.update(
+                prefix[:2] + rest
+                for rest in names
+                if (prefix[:2] + rest).startswith(prefix) and len(rest) == 38
+            )
+        if len(found) > 1:
+            raise UnsupportedRepository(f"ambiguous revision '{prefix}'")
+        return found.pop() if found else None
+
+    def refs(self, prefix="refs/"):
+        """
+        Return a dictionary of ref names starting with `prefix` (which must end with a
+        slash) and the object hashes they point to.
+        """
+
+        result = {
+            name: sha
+            for name, sha in self._get_packed_refs().items()
+            if name.startswith(prefix)
+        }
+        root = os.path.join(self._ref_dir(prefix + "x"), *prefix.split("/"))
+        for directory, _, files in os.walk(root):
+            relative = os.path.relpath(directory, root)
+            for file_name in files:
+                if file_name.endswith(".lock"):
+                    continue
+                if relative == ".":
+                    name = prefix + file_name
+                else:
+                    name = prefix + "/".join(relative.split(os.sep) + [file_name])
+                sha = self.read_ref(name)
+                if sha is not None and re.match(r"^[0-9a-f]{40}$", sha):
+                    result[name] = sha
+        return result
+
+    # OBJECTS
+
+    def _get_packs(self):
+        if self._packs is None:
+            self._packs = []
+            for objects_dir in self._object_dirs:
+                pack_dir = os.path.join(objects_dir, "pack")
+                try:
+                    names = sorted(os.listdir(pack_dir))
+                except OSError:
+                    continue
+                for name in names:
+                    if name.endswith(".idx") and os.path.exists(
+                        os.path.join(pack_dir, name[:-4] + ".pack")
+                    ):
+                        self._packs.append(Pack(os.path.join(pack_dir, name)))
+        return self._packs
+
+    def _read_loose(self, sha):
+        for objects_dir in self._object_dirs:
+            try:
+                with open(os.path.join(objects_dir, sha[:2], sha[2:]), "rb") as f:
+                    raw = zlib.decompress(f.read())
+            except FileNotFoundError:
+                continue
+            header, _, data = raw.partition(b"\0")
+            return header.split(b" ")[0].decode(), data
+        return None
+
+    def _read_packed(self, pack, offset):
+        # resolve delta chains iteratively, caching the bases
+        chain = []
+        while True:
+            key = (pack.pack_path, offset)
+            cached = self._base_cache.get(key)
+            if cached is not None:
+                self._base_cache.move_to_end(key)
+                object_type, data = cached
+                break
+            entry_type, data, base = pack.read_entry(offset)
+            if entry_type == OFS_DELTA:
+                chain.append((key, data))
+                offset = base
+            elif entry_type == REF_DELTA:
+                chain.append((key, data))
+                base_sha = binascii.hexlify(base).decode()
+                for base_pack in self._get_packs():
+                    base_offset = base_pack.find(base)
+                    if base_offset is not None:
+                        pack, offset = base_pack, base_offset
+                        break
+                else:
+                    object_type, data = self.read_object(base_sha)
+                    break
+            else:
+                object_type = OBJECT_TYPES[entry_type]
+                self._cache_base(key, object_type, data)
+                break
+
+        for key, delta in reversed(chain):
+            data = _apply_delta(data, delta)
+            self._cache_base(key, object_type, data)
+        return object_type, data
+
+    def _cache_base(self, key, object_type, data):
+        self._base_cache[key] = (object_type, data)
+        if len(self._base_cache) > self.BASE_CACHE_SIZE:
+            self._base_cache.popitem(last=False)
+
+    def read_object(self, sha):
+        """
+        Return `(type, data)` of the object with hash `sha`, where type is one of
+        "commit", "tree", "blob" and "tag". Raises MissingObject if it's not found.
+        """
+
+        name = binascii.unhexlify(sha)
+        for pack in self._get_packs():
+            offset = pack.find(name)
+            if offset is not None:
+                try:
+                    return self._read_packed(pack, offset)
+                except (zlib.error, IndexError, KeyError) as error:
+                    raise MissingObject(f"{sha} is corrupt ({error})")
+        try:
+            loose = self._read_loose(sha)
+        except zlib.error as error:
+            raise MissingObject(f"{sha} is corrupt ({error})")
+        if loose is None:
+            raise MissingObject(sha)
+        return loose
+
+    def abbreviate(self, sha):
+        """
+        Return the shortest unique abbreviation of `sha`, the same way git does.
+        """
+
+        abbrev = self.config.get("core.abbrev", "auto").lower()
+        if abbrev in ("no", "false", "off"):
+            return sha
+        if abbrev.isdigit():
+            length = max(4, min(40, int(abbrev)))
+        else:
+            count = sum(len(pack) for pack in self._get_packs())
+            length = max(7, (count.bit_length() + 1) // 2)
+
+        # common prefix with the closest other objects
+        name = binascii.unhexlify(sha)
+        for pack in self._get_packs():
+            for other in pack.neighbors(name):
+                length = max(length, _common_hex_prefix(sha, other.hex()) + 1)
+        for objects_dir in self._object_dirs:
+            try:
+                names = os.listdir(os.path.join(objects_dir, sha[:2]))
+            except OSError:
+                continue
+            for rest in names:
+                other = sha[:2] + rest
+                if other != sha and len(other) == 40:
+                    length = max(length, _common_hex_prefix(sha, other) + 1)
+        return sha[: min(length, 40)]
+
+    # WORKING TREE
+
+    def is_dirty(self, against_head=True):
+        """
+        Return whether the working tree has changes, ignoring untracked files. If
+        `against_head` is True, the working tree is compared to HEAD (like
+        `git describe --dirty`), otherwise to the index (like `git diff --quiet`).
+        """
+
+        if self.work_tree is None:
+            raise UnsupportedRepository("bare repository")
+
+        index = Index(os.path.join(self.git_dir, "index"))
+        checked_blobs = []  # paths whose contents differed from the index by stat
+        missing = set()  # paths in the index, but not in the working tree
+
+        for entry in index.entries:
+            if entry.stage:
+                return True  # unmerged
+            if entry.mode == 0o160000:
+                raise UnsupportedRepository("submodules")
+            if entry.intent_to_add:
+                return True
+            if entry.skip_worktree:
+                continue
+            path = os.path.join(self.work_tree, *entry.path.decode().split("/"))
+            try:
+                stat_result = os.lstat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                if not against_head:
+                    return True
+                # only a change if it's in HEAD (not if it was added to the index)
+                missing.add(entry.path)
+                continue
+            if _mode_changed(entry.mode, stat_result, self.config):
+                return True
+            if not index.stat_matches(entry, stat_result):
+                # a zero size means the stat data was never recorded (or smudged)
+                if entry.size and entry.size != stat_result.st_size & 0xFFFFFFFF:
+                    return True
+                checked_blobs.append((entry, path, stat_result))
+
+        for entry, path, stat_result in checked_blobs:
+            if stat.S_ISLNK(stat_result.st_mode):
+                content = os.fsencode(os.readlink(path))
+            else:
+                with open(path, "rb") as f:
+                    content = f.read()
+            blob_hash = hashlib.sha1(b"blob %d\0" % len(content) + content).digest()
+            if blob_hash != entry.sha:
+                if self._has_filters(index):
+                    # content may only differ by eol conversion or a clean filter
+                    raise UnsupportedRepository("content filters")
+                return True
+
+        if against_head:
+            head = self.read_ref("HEAD")
+            if head is None:
+                return bool(index.entries)
+            tree = parse_commit(self.read_object(head)[1]).tree
+            if index.root_tree is not None and index.root_tree == tree:
+                # the cache tree of the index matches HEAD, so missing paths are in it
+                return bool(missing)
+            head_entries = {}
+            self._flatten_tree(tree, b"", head_entries)
+            if any(path in head_entries for path in missing):
+                return True
+            index_entries = {
+                entry.path: (entry.mode, entry.sha)
+                for entry in index.entries
+                if entry.path not in missing
+            }
+            if head_entries != index_entries:
+                return True
+
+        return False
+
+    def _has_filters(self, index):
+        if self.config.get("core.autocrlf", "false").lower() not in ("false", "no"):
+            return True
+        return any(
+            entry.path == b".gitattributes" or entry.path.endswith(b"/.gitattributes")
+            for entry in index.entries
+        ) or os.path.exists(os.path.join(self.common_dir, "info", "attributes"))
+
+    def _flatten_tree(self, tree, prefix, entries):
+        object_type, data = self.read_object(tree)
+        if object_type != "tree":
+            raise MissingObject(f"{tree} is not a tree")
+        for mode, name, sha in parse_tree(data):
+            if mode == 0o040000:
+                self._flatten_tree(sha.hex(), prefix + name + b"/", entries)
+            else:
+                entries[prefix + name] = (mode, sha)
+
+    def close(self):
+        for pack in self._packs or []:
+            pack.close()
+        self._packs = None
+
+
+def _common_hex_prefix(a, b):
+    length = 0
+    for char_a, char_b in zip(a, b):
+        if char_a != char_b:
+            break
+        length += 1
+    return length
+
+
+def _mode_changed(index_mode, stat_result, config):
+    if stat.S_ISLNK(stat_result.st_mode):
+        return index_mode != 0o120000 and config_bool(config.get("core.symlinks"), True)
+    if not stat.S_ISREG(stat_result.st_mode) or index_mode == 0o120000:
+        return True
+    if config_bool(config.get("core.filemode"), True):
+        return (index_mode == 0o100755) != bool(stat_result.st_mode & stat.S_IXUSR)
+    return False
+
+
+IndexEntry = collections.namedtuple(
+    "IndexEntry",
+    [
+        "path",
+        "mode",
+        "sha",
+        "stage",
+        "ctime",
+        "mtime",
+        "ino",
+        "size",
+        "skip_worktree",
+        "intent_to_add",
+    ],
+)
+
+
+class Index:
+    """
+    The entries (and the root of the cache tree) of a git index file, versions 2-4.
+    """
+
+    def __init__(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+                self.mtime = os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            self.entries = []
+            self.root_tree = None
+            self.mtime = 0
+            return
+
+        signature, version, count = struct.unpack(">4sII", data[:12])
+        if signature != b"DIRC" or version not in (2, 3, 4):
+            raise UnsupportedRepository(f"index version {version}")
+
+        self.entries = []
+        self.root_tree = None
+        pos = 12
+        previous_path = b""
+        for _ in range(count):
+            fields = struct.unpack(">10I20sH", data[pos : pos + 62])
+            flags = fields[11]
+            extended_flags = 0
+            header_size = 62
+            if version >= 3 and flags & 0x4000:
+                extended_flags = struct.unpack(">H", data[pos + 62 : pos + 64])[0]
+                header_size = 64
+            name_start = pos + header_size
+            if version == 4:
+                # path is prefix-compressed against the previous entry
+                strip, name_start = _index_varint(data, name_start)
+                name_end = data.index(b"\0", name_start)
+                path = (
+                    previous_path[: len(previous_path) - strip]
+                    + data[name_start:name_end]
+                )
+                pos = name_end + 1
+            else:
+                name_end = data.index(b"\0", name_start)
+                path = data[name_start:name_end]
+                pos += (header_size + len(path) + 8) & ~7
+            previous_path = path
+            self.entries.append(
+                IndexEntry(
+                    path=path,
+                    mode=fields[6],
+                    sha=fields[10],
+                    stage=(flags >> 12) & 3,
+                    ctime=(fields[0], fields[1]),
+                    mtime=(fields[2], fields[3]),
+                    ino=fields[5],
+                    size=fields[9],
+                    skip_worktree=bool(extended_flags & 0x4000),
+                    intent_to_add=bool(extended_flags & 0x2000),
+                )
+            )
+
+        # extensions, up to the trailing checksum
+        while pos + 8 <= len(data) - 20:
+            name, size = struct.unpack(">4sI", data[pos : pos + 8])
+            body = data[pos + 8 : pos + 8 + size]
+            if name in (b"link", b"sdir"):
+                raise UnsupportedRepository("split or sparse index")
+            if name == b"TREE":
+                # root entry: path (empty), NUL, entry count, space, subtrees, LF, sha
+                match = re.match(rb"\0(-?\d+) (\d+)\n", body)
+                if match is not None and int(match.group(1)) >= 0:
+                    self.root_tree = body[match.end() : match.end() + 20].hex()
+            pos += 8 + size
+
+    def stat_matches(self, entry, stat_result):
+        """
+        Return whether the stat data of a file matches the one recorded in the index,
+        so its contents can be assumed to be unchanged.
+        """
+
+        mtime = (int(stat_result.st_mtime), stat_result.st_mtime_ns % 1000000000)
+        ctime = (int(stat_result.st_ctime), stat_result.st_ctime_ns % 1000000000)
+        if (
+            entry.mtime != mtime
+            or entry.ctime != ctime
+            or entry.ino != stat_result.st_ino & 0xFFFFFFFF
+            or entry.size != stat_result.st_size & 0xFFFFFFFF
+        ):
+            return False
+        # racily clean: modified in the same instant the index was written
+        return stat_result.st_mtime_ns < self.mtime
+
+
+def _index_varint(data, pos):
+    # offset-encoded varint used by index version 4
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+
+# HISTORY
+
+
+def peel(store, sha):
+    """
+    Follow tag objects until a non-tag object, return its hash and type.
+    """
+
+    for _ in range(16):
+        object_type, data = store.read_object(sha)
+        if object_type != "tag":
+            return sha, object_type
+        sha = parse_tag(data)[0]
+    raise GitDirError(f"tag chain too long at {sha}")
+
+
+class CommitGraph:
+    """
+    Cache of the parents and committer times of commits read from a store, or added
+    with `add` (the store may be None if all commits needed are added).
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._commits = {}
+
+    def __getitem__(self, sha):
+        info = self._commits.get(sha)
+        if info is None:
+            if self.store is None:
+                raise MissingObject(sha)
+            object_type, data = self.store.read_object(sha)
+            if object_type != "commit":
+                raise MissingObject(f"{sha} is not a commit")
+            commit = parse_commit(data)
+            info = self._commits[sha] = (commit.parents, commit.time)
+        return info
+
+    def add(self, sha, parents, time):
+        # a commit known without reading it (ex. from the output of git log)
+        self._commits[sha] = (tuple(parents), time)
+
+    def parents(self, sha):
+        return self[sha][0]
+
+    def time(self, sha):
+        return self[sha][1]
+
+
+class _DateQueue:
+    # newest commit first, ties in insertion order (like git's commit lists by date)
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._heap = []
+        self._counter = 0
+
+    def __bool__(self):
+        return bool(self._heap)
+
+    def __iter__(self):
+        return (entry[2] for entry in self._heap)
+
+    def peek(self):
+        return self._heap[0][2]
+
+    def push(self, sha):
+        heapq.heappush(self._heap, (-self.graph.time(sha), self._counter, sha))
+        self._counter += 1
+
+    def pop(self):
+        return heapq.heappop(self._heap)[2]
+
+
+def version_tags(store, pattern):
+    """
+    Return a dictionary of commit hashes to `(tag_name, annotated)` of the tags
+    matching `pattern` (in `git describe --tags` priority: annotated tags first, then
+    the newest tag, then the first by name).
+    """
+
+    def candidates():
+        for ref, sha in sorted(store.refs("refs/tags/").items()):
+            name = ref[len("refs/tags/") :]
+            if not fnmatch.fnmatchcase(name, pattern):
+                continue
+            object_type, data = store.read_object(sha)
+            annotated = object_type == "tag"
+            tag_time = parse_tag(data)[2] if annotated else 0
+            commit, peeled_type = peel(store, sha)
+            if peeled_type == "commit":
+                yield name, commit, annotated, tag_time
+
+    return select_tags(candidates())
+
+
+def select_tags(candidates):
+    """
+    Return a dictionary of commit hashes to `(tag_name, annotated)` of the preferred
+    tag of each commit, from `(tag_name, commit, annotated, tag_time)` tuples ordered by
+    name (see `version_tags`).
+    """
+
+    names = {}
+    for name, commit, annotated, tag_time in candidates:
+        existing = names.get(commit)
+        if existing is None or (annotated, tag_time) > existing[1:]:
+            names[commit] = (name, annotated, tag_time)
+    return {commit: (name, annotated) for commit, (name, annotated, _) in names.items()}
+
+
+def describe(store, sha, pattern="v[0-9]*", graph=None):
+    """
+    Find the tag matching `pattern` closest to commit `sha`, the same way as
+    `git describe --tags --match <pattern>`. Returns `(tag_name, depth)`, where depth
+    is the number of commits reachable from `sha` but not from the tag (0 if `sha` is
+    tagged), or None if no tag can describe the commit.
+    """
+
+    graph = graph or CommitGraph(store)
+    tags = version_tags(store, pattern)
+    if not tags:
+        return None
+    if sha in tags:
+        return tags[sha][0], 0
+
+    SEEN = 1
+    flags = {sha: SEEN}
+    queue = _DateQueue(graph)
+    queue.push(sha)
+    matches = []  # [name, depth, flag, found_order]
+    annotated_count = 0
+    seen_commits = 0
+    gave_up_on = None
+
+    while queue:
+        commit = queue.pop()
+        seen_commits += 1
+        tag = tags.get(commit)
+        if tag is not None:
+            if len(matches) < DESCRIBE_CANDIDATES:
+                flag = 1 << (len(matches) + 1)
+                matches.append([tag[0], seen_commits - 1, flag, len(matches)])
+                flags[commit] |= flag
+                annotated_count += tag[1]
+            else:
+                gave_up_on = commit
+                break
+        for match in matches:
+            if not flags[commit] & match[2]:
+                match[1] += 1
+        if annotated_count and not queue:
+            # stop if the last remaining path is already covered by the best candidates
+            best_depth = min(match[1] for match in matches)
+            best_within = 0
+            for match in matches:
+                if match[1] == best_depth:
+                    best_within |= match[2]
+            if flags[commit] & best_within == best_within:
+                break
+        for parent in graph.parents(commit):
+            parent_flags = flags.get(parent, 0)
+            if not parent_flags & SEEN:
+                queue.push(parent)
+            flags[parent] = parent_flags | flags[commit]
+
+    if not matches:
+        return None
+
+    matches.sort(key=lambda match: (match[1], match[3]))
+    best = matches[0]
+    if gave_up_on is not None:
+        queue.push(gave_up_on)
+
+    # finish the depth computation of the best candidate
+    while queue:
+        commit = queue.pop()
+        if flags[commit] & best[2]:
+            if all(flags[other] & best[2] for other in queue):
+                break
+        else:
+            best[1] += 1
+        for parent in graph.parents(commit):
+            parent_flags = flags.get(parent, 0)
+            if not parent_flags & SEEN:
+                queue.push(parent)
+            flags[parent] = parent_flags | flags[commit]
+
+    return best[0], best[1]
+
+
+def count(store, sha, graph=None):
+    """
+    Return the number of commits reachable from `sha` (like `git rev-list --count`).
+    """
+
+    graph = graph or CommitGraph(store)
+    seen = {sha}
+    stack = [sha]
+    while stack:
+        for parent in graph.parents(stack.pop()):
+            if parent not in seen:
+                seen.add(parent)
+                stack.append(parent)
+    return len(seen)
+
+
+def walk_log(store, include, exclude=(), graph=None):
+    """
+    Generator yielding the hashes of the commits reachable from the commits in
+    `include` but not from the ones in `exclude`, in the same order as `git log`
+    (newest first by committer date).
+    """
+
+    graph = graph or CommitGraph(store)
+    SEEN = 1
+    UNINTERESTING = 2
+    flags = {}
+    queue = _DateQueue(graph)
+    for sha in exclude:
+        flags[sha] = SEEN | UNINTERESTING
+        queue.push(sha)
+    for sha in include:
+        if sha not in flags:
+            flags[sha] = SEEN
+            queue.push(sha)
+
+    if not exclude:
+        # not limited, commits can be output as they are walked
+        while queue:
+            commit = queue.pop()
+            for parent in graph.parents(commit):
+                if parent not in flags:
+                    flags[parent] = SEEN
+                    queue.push(parent)
+            yield commit
+        return
+
+    def mark_uninteresting(commit):
+        # propagate to the ancestors already walked
+        stack = list(graph.parents(commit))
+        while stack:
+            parent = stack.pop()
+            parent_flags = flags.get(parent, 0)
+            if parent_flags & UNINTERESTING:
+                continue
+            flags[parent] = parent_flags | UNINTERESTING
+            if parent_flags & SEEN:
+                stack.extend(graph.parents(parent))
+
+    # limited walk (like git's limit_list), the uninteresting flag of a commit can
+    # change after it's walked, so filter at the end
+    SLOP = 5
+    slop = SLOP
+    last_time = None
+    output = []
+    while queue:
+        commit = queue.pop()
+        if flags[commit] & UNINTERESTING:
+            for parent in graph.parents(commit):
+                parent_flags = flags.get(parent, 0)
+                flags[parent] = parent_flags | UNINTERESTING
+                mark_uninteresting(parent)
+                if not parent_flags & SEEN:
+                    flags[parent] |= SEEN
+                    queue.push(parent)
+            if not queue:
+                break
+            if last_time is not None and last_time <= graph.time(queue.peek()):
+                slop = SLOP
+            elif any(not flags[other] & UNINTERESTING for other in queue):
+                slop = SLOP
+            else:
+                slop -= 1
+                if not slop:
+                    break
+            continue
+        for parent in graph.parents(commit):
+            if not flags.get(parent, 0) & SEEN:
+                flags[parent] = flags.get(parent, 0) | SEEN
+                queue.push(parent)
+        last_time = graph.time(commit)
+        output.append(commit)
+
+    for commit in output:
+        if not flags[commit] & UNINTERESTING:
+            yield commit
+
+
+def propagate_tags(commits, tags, count_new, seeds=None):
+    """
+    Generator propagating the nearest tag through `commits`, an iterable of
+    `(sha, parents)` tuples in topological order (parents first), yielding
+    `(sha, tag_name, distance)` for each commit.
+
+    `tags` is a dictionary of tagged commit hashes to tag names, `seeds` a dictionary
+    of `(tag_name, distance)` of the parents not in `commits` (ex. from `describe`).
+    `count_new(include, exclude)` must return the number of commits reachable from the
+    commits in `include` but not from the ones in `exclude`, it's called for merges.
+
+    The distance is the number of commits reachable from the commit but not from the
+    tag (the depth `git describe` reports, as long as commit times are in order), or
+    the number of commits reachable from it (like `git rev-list --count`) if no tag
+    is reachable (`tag_name` is None). A merge is described by the tag of one of its
+    parents, the one giving the smallest distance (tagged ones first). `git describe`
+    considers the other tags reachable from the merge too, so in rare histories it
+    may pick a different tag.
+    """
+
+    tag_commits = {name: sha for sha, name in tags.items()}
+    state = dict(seeds or {})
+    for sha, parents in commits:
+        tag = tags.get(sha)
+        if tag is not None:
+            nearest = (tag, 0)
+        elif not parents:
+            nearest = (None, 1)  # root commit
+        elif len(parents) == 1:
+            parent_tag, distance = state[parents[0]]
+            nearest = (parent_tag, distance + 1)
+        else:
+            nearest = None
+            for index, parent in enumerate(parents):
+                parent_tag, distance = state[parent]
+                if any(state[other][0] == parent_tag for other in parents[:index]):
+                    continue  # the same tag gives the same distance
+                # the commits of the other parents, not counted for this one yet
+                exclude = [parent]
+                if parent_tag is not None:
+                    exclude.append(tag_commits[parent_tag])
+                others = parents[:index] + parents[index + 1 :]
+                candidate = (parent_tag, distance + 1 + count_new(others, exclude))
+                if nearest is None or (candidate[0] is None, candidate[1]) < (
+                    nearest[0] is None,
+                    nearest[1],
+                ):
+                    nearest = candidate
+        state[sha] = nearest
+        yield (sha,) + nearest
+
+
+def describe_range(store, include, exclude=(), pattern="v[0-9]*", graph=None):
+    """
+    Generator yielding `(sha, tag_name, distance)` for each commit reachable from the
+    commits in `include` but not from the ones in `exclude`, in topological order
+    (parents first), with a single walk of the history, plus walks of the branches
+    merged in at merges (see `propagate_tags`).
+    """
+
+    graph = graph or CommitGraph(store)
+    commits = set(walk_log(store, include, exclude, graph))
+    tags = {commit: name for commit, (name, _) in version_tags(store, pattern).items()}
+
+    # parents outside the range are seeded with their own description
+    seeds = {}
+
+    def seed(sha):
+        description = describe(store, sha, pattern, graph)
+        if description is None:
+            return (None, count(store, sha, graph))
+        return description
+
+    # depth-first post-order gives parents before children
+    order = []
+    visited = set()
+    for start in include:
+        stack = [(start, False)]
+        while stack:
+            sha, expanded = stack.pop()
+            if expanded:
+                order.append(sha)
+                continue
+            if sha in visited or sha not in commits:
+                continue
+            visited.add(sha)
+            stack.append((sha, True))
+            for parent in reversed(graph.parents(sha)):
+                if parent in commits:
+                    if parent not in visited:
+                        stack.append((parent, False))
+                elif parent not in seeds:
+                    seeds[parent] = seed(parent)
+
+    def count_new(include, exclude):
+        return sum(1 for _ in walk_log(store, include, exclude, graph))
+
+    return propagate_tags(
+        ((sha, graph.parents(sha)) for sha in order), tags, count_new, seeds
+    )
@@ -0,0 +1,211 @@
+"""
+Emulated ESP8266 bootloader, for testing uploads without a device.
+
+`serve(device)` listens on a local TCP port and returns its pyserial URL (ex.
+'socket://127.0.0.1:5000'). Every connection speaks the SLIP-framed protocol of the
+ROM bootloader and of esptool's flasher stub (sync, registers, RAM download, stub
+handshake, baud change, plain and compressed flash writes, MD5, erase and flash
+reads), on the flash of `device`.
+"""
+
+import zlib
+import socket
+import struct
+import hashlib
+import threading
+
+SYNC = 0x08
+READ_REG = 0x0A
+MEM_BEGIN = 0x05
+MEM_END = 0x06
+MEM_DATA = 0x07
+WRITE_REG = 0x09
+FLASH_BEGIN = 0x02
+FLASH_DATA = 0x03
+FLASH_END = 0x04
+SPI_SET_PARAMS = 0x0B
+SPI_ATTACH = 0x0D
+CHANGE_BAUD = 0x0F
+FLASH_DEFL_BEGIN = 0x10
+FLASH_DEFL_DATA = 0x11
+FLASH_DEFL_END = 0x12
+SPI_FLASH_MD5 = 0x13
+ERASE_FLASH = 0xD0
+ERASE_REGION = 0xD1
+READ_FLASH = 0xD2
+# commands only acknowledged
+ACKNOWLEDGED = (WRITE_REG, SPI_SET_PARAMS, SPI_ATTACH, FLASH_END, FLASH_DEFL_END)
+
+# flash id of a 4MB flash (size id 0x16)
+FLASH_ID = 0x1640EF
+
+
+class Device:
+    """
+    Emulated ESP8266 with `flash_size` bytes of flash and the MAC address `mac` (a
+    tuple of 6 integers). Connections changing to a baud rate over `max_baud` are
+    dropped (like a link that doesn't work at that rate). If not `responsive`, every
+    connection is dropped right away.
+
+    `baud_rates` are the rates connections changed to, `written` the number of bytes
+    written to the flash, `erases` the number of full erases.
+    """
+
+    def __init__(
+        self,
+        mac=(0x18, 0xFE, 0x34, 0x01, 0x02, 0x03),
+        flash_size=4 * 1024 * 1024,
+        max_baud=None,
+        responsive=True,
+    ):
+        self.mac = mac
+        self.flash = bytearray(b"\xff" * flash_size)
+        self.max_baud = max_baud
+        self.responsive = responsive
+        self.baud_rates = []
+        self.written = 0
+        self.erases = 0
+        self.lock = threading.Lock()
+
+    @property
+    def mac_address(self):
+        return ":".join(f"{byte:02x}" for byte in self.mac)
+
+    def register(self, address):
+        mac = self.mac
+        return {
+            # efuses of the MAC address (with the Espressif OUI 18:fe:34)
+            0x3FF00050: mac[5] << 24,
+            0x3FF00054: (mac[3] << 8) | mac[4],
+            0x3FF00058: 0,
+            0x3FF0005C: 0,
+            # UART clock divider of a 26MHz crystal
+            0x60000014: 451,
+            0x60000200: 0,
+            # SPI_W0, the result of reading the flash id
+            0x60000240: FLASH_ID,
+        }.get(address, 0)
+
+
+def _slip_frames(connection):
+    # generator of the SLIP frames received on `connection`
+    frame = None
+    escaped = False
+    while True:
+        data = connection.recv(1 << 16)
+        if not data:
+            return
+        for byte in data:
+            if frame is None:
+                if byte == 0xC0:
+                    frame = bytearray()
+            elif escaped:
+                frame.append(0xC0 if byte == 0xDC else 0xDB)
+                escaped = False
+            elif byte == 0xDB:
+                escaped = True
+            elif byte == 0xC0:
+                if frame:
+                    yield bytes(frame)
+                    frame = None
+                # an empty frame is the start of the next one
+            else:
+                frame.append(byte)
+
+
+def _slip(data):
+    escaped = data.replace(b"\xdb", b"\xdb\xdd").replace(b"\xc0", b"\xdb\xdc")
+    return b"\xc0" + escaped + b"\xc0"
+
+
+def _handle(device, connection):
+    def reply(command, value=0, data=b""):
+        body = data + b"\x00\x00"  # status: success
+        header = struct.pack("<BBHI", 1, command, len(body), value)
+        connection.sendall(_slip(header + body))
+
+    write = None  # [offset, decompressor or None] of the write in progress
+    for frame in _slip_frames(connection):
+        if len(frame) < 8:
+            continue
+        command = frame[1]
+        data = frame[8:]
+        if command == SYNC:
+            for _ in range(8):
+                reply(command)
+        elif command == READ_REG:
+            reply(command, device.register(struct.unpack("<I", data[:4])[0]))
+        elif command in (MEM_BEGIN, MEM_DATA, *ACKNOWLEDGED):
+            reply(command)
+        elif command == MEM_END:
+            reply(command)
+            connection.sendall(_slip(b"OHAI"))
+        elif command == CHANGE_BAUD:
+            baud = struct.unpack("<I", data[:4])[0]
+            device.baud_rates.append(baud)
+            reply(command)
+            if device.max_baud is not None and baud > device.max_baud:
+                break
+        elif command in (FLASH_BEGIN, FLASH_DEFL_BEGIN):
+            offset = struct.unpack("<IIII", data[:16])[3]
+            write = [offset, zlib.decompressobj() if command != FLASH_BEGIN else None]
+            reply(command)
+        elif command in (FLASH_DATA, FLASH_DEFL_DATA):
+            size = struct.unpack("<I", data[:4])[0]
+            block = data[16 : 16 + size]
+            if write[1] is not None:
+                block = write[1].decompress(block)
+            with device.lock:
+                device.flash[write[0] : write[0] + len(block)] = block
+                device.written += len(block)
+            write[0] += len(block)
+            reply(command)
+        elif command == SPI_FLASH_MD5:
+            offset, size = struct.unpack("<II", data[:8])
+            digest = hashlib.md5(bytes(device.flash[offset : offset + size])).digest()
+            reply(command, data=digest)
+        elif command == ERASE_FLASH:
+            with device.lock:
+                device.flash[:] = b"\xff" * len(device.flash)
+                device.erases += 1
+            reply(command)
+        elif command == ERASE_REGION:
+            offset, size = struct.unpack("<II", data[:8])
+            device.flash[offset : offset + size] = b"\xff" * size
+            reply(command)
+        elif command == READ_FLASH:
+            offset, size, block_size = struct.unpack("<III", data[:12])
+            reply(command)
+            contents = bytes(device.flash[offset : offset + size])
+            for start in range(0, size, block_size):
+                connection.sendall(_slip(contents[start : start + block_size]))
+            connection.sendall(_slip(hashlib.md5(contents).digest()))
+        else:
+            # status: failed, invalid command
+            header = struct.pack("<BBHI", 1, command, 2, 0)
+            connection.sendall(_slip(header + b"\x01\x05"))
+    connection.close()
+
+
+def serve(device):
+    """
+    Serve `device` on a local TCP port, return its pyserial URL. The server runs until
+    the process exits.
+    """
+
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    def accept():
+        while True:
+            connection, _ = server.accept()
+            if not device.responsive:
+                connection.close()
+                continue
+            threading.Thread(
+                target=_handle, args=(device, connection), daemon=True
+            ).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return f"socket://127.0.0.1:{server.getsockname()[1]}"
@@ -0,0 +1,125 @@
+"""
+Tests of the checkouts of the builder (see `git_clone_and_checkout`), from local
+repositories through their mirrors.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import contextlib
+import subprocess
+from unittest import mock
+
+from kyanit_buildtools import builder
+
+
+class TestCheckout(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="kyanit-builder-test-")
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.work_dir = os.path.join(self.temp_dir, "work")
+        os.makedirs(self.work_dir)
+        for name, value in (
+            ("WORK_DIR", self.work_dir),
+            ("MIRROR_DIR", os.path.join(self.work_dir, "mirrors")),
+        ):
+            patch = mock.patch.object(builder, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        # independent of the configuration of the user running the tests, which could
+        # allow the file transport itself
+        environ = mock.patch.dict(
+            os.environ,
+            {
+                "HOME": self.temp_dir,
+                "GIT_CONFIG_NOSYSTEM": "1",
+                "GIT_AUTHOR_NAME": "Test",
+                "GIT_AUTHOR_EMAIL": "test@example.com",
+                "GIT_COMMITTER_NAME": "Test",
+                "GIT_COMMITTER_EMAIL": "test@example.com",
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.stdout = io.StringIO()
+        redirect = contextlib.redirect_stdout(self.stdout)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    def git(self, *args, cwd):
+        return (
+            subprocess.run(
+                ["git", *args],
+                cwd=cwd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            .stdout.decode()
+            .strip()
+        )
+
+    def repository(self, name, submodules=()):
+        """
+        Create the repository `name` with a file (and the repositories in `submodules`
+        as submodules), return its path.
+        """
+
+        path = os.path.join(self.temp_dir, "upstream", name)
+        os.makedirs(path)
+        self.git("init", "-q", "-b", "master", cwd=path)
+        with open(os.path.join(path, "file"), "w") as f:
+            f.write(f"{name}\n")
+        self.git("add", "file", cwd=path)
+        for submodule in submodules:
+            # adding a submodule from a local path needs the file transport
+            self.git(
+                "-c",
+                "protocol.file.allow=always",
+                "submodule",
+                "add",
+                "-q",
+                submodule,
+                os.path.basename(submodule),
+                cwd=path,
+            )
+        self.git("commit", "-q", "-m", f"{name}", cwd=path)
+        return path
+
+    def test_submodules(self):
+        nested = self.repository("nested")
+        submodule = self.repository("submodule", [nested])
+        superproject = self.repository("superproject", [submodule])
+        rev = self.git("rev-parse", "HEAD", cwd=superproject)
+
+        self.assertTrue(
+            builder.git_clone_and_checkout(superproject, rev, recursive=True),
+            self.stdout.getvalue(),
+        )
+        checkout = os.path.join(self.work_dir, "superproject")
+        for path in ("submodule", os.path.join("submodule", "nested")):
+            with open(os.path.join(checkout, path, "file")) as f:
+                self.assertEqual(f.read(), f"{os.path.basename(path)}\n")
+        # the submodule is cloned from its mirror
+        url = self.git("config", "submodule.submodule.url", cwd=checkout)
+        self.assertEqual(url, builder.mirror_path(submodule))
+
+    def test_listed_submodules(self):
+        superproject = self.repository(
+            "superproject", [self.repository("first"), self.repository("second")]
+        )
+        rev = self.git("rev-parse", "HEAD", cwd=superproject)
+
+        self.assertTrue(
+            builder.git_clone_and_checkout(superproject, rev, submodules=["second"]),
+            self.stdout.getvalue(),
+        )
+        checkout = os.path.join(self.work_dir, "superproject")
+        self.assertTrue(os.path.exists(os.path.join(checkout, "second", "file")))
+        self.assertFalse(os.path.exists(os.path.join(checkout, "first", "file")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+"""
+Tests of DeviceSession and the uploads of the builder, on emulated devices (see
+`esp8266_emulator`).
+"""
+
+import io
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import unittest
+import contextlib
+import concurrent.futures
+from unittest import mock
+
+import esptool
+
+from kyanit_buildtools import builder
+from kyanit_buildtools.builder.device import (
+    DeviceSession,
+    PortError,
+    ConnectError,
+    TransferError,
+    VerifyError,
+)
+
+import esp8266_emulator
+
+# nothing listens on port 1
+CLOSED_PORT = "socket://127.0.0.1:1"
+
+
+def random_bytes(size, seed=0):
+    return bytes(random.Random(seed).getrandbits(8) for _ in range(size))
+
+
+class TestDeviceSession(unittest.TestCase):
+    def setUp(self):
+        self.device = esp8266_emulator.Device()
+        self.port = esp8266_emulator.serve(self.device)
+
+    def session(self, baud=None):
+        return self.connect(self.port, baud)
+
+    def connect(self, port, baud=None):
+        session = DeviceSession(port, baud)
+        self.addCleanup(session.close)
+        return session
+
+    def test_connect(self):
+        session = self.session()
+        self.assertEqual(session.mac, self.device.mac_address)
+        self.assertEqual(session.flash_size, "4MB")
+        self.assertEqual(session.baud, esptool.ESPLoader.ESP_ROM_BAUD)
+        self.assertIn("Stub running...", session.output)
+
+    def test_change_baud(self):
+        session = self.session(460800)
+        self.assertEqual(session.baud, 460800)
+        self.assertEqual(self.device.baud_rates, [460800])
+
+    def test_write_and_verify(self):
+        data = random_bytes(100000)
+        progress = []
+        session = self.session()
+        session.write(0x10000, data, lambda *args: progress.append(args))
+        session.verify(0x10000, data)
+        self.assertEqual(bytes(self.device.flash[0x10000 : 0x10000 + len(data)]), data)
+        self.assertEqual(session.read_flash(0x10000, len(data)), data)
+        written, total = progress[-1]
+        self.assertEqual(written, total)
+
+    def test_firmware_header(self):
+        # the flash size in the header of a firmware image is set to the detected one
+        image = bytes([esptool.ESPLoader.ESP_IMAGE_MAGIC, 1, 0, 0]) + random_bytes(999)
+        session = self.session()
+        session.write(0, image)
+        session.verify(0, image)
+        self.assertEqual(self.device.flash[3], esptool.ESP8266ROM.FLASH_SIZES["4MB"])
+
+    def test_verify_error(self):
+        data = random_bytes(8192)
+        session = self.session()
+        session.write(0, data)
+        self.device.flash[5000] ^= 0xFF
+        with self.assertRaises(VerifyError) as context:
+            session.verify(0, data)
+        # errors have the output of the session
+        self.assertIn("Stub running...", context.exception.output)
+
+    def test_erase(self):
+        session = self.session()
+        session.write(0, random_bytes(4096))
+        session.erase()
+        self.assertEqual(self.device.erases, 1)
+        self.assertEqual(session.read_flash(0, 4096), b"\xff" * 4096)
+
+    def test_port_error(self):
+        with self.assertRaises(PortError):
+            DeviceSession(CLOSED_PORT)
+
+    def test_connect_error(self):
+        self.device.responsive = False
+        with self.assertRaises(ConnectError):
+            DeviceSession(self.port)
+
+    def test_transfer_error(self):
+        # the link doesn't work after changing to a baud rate the device can't do
+        self.device.max_baud = 230400
+        with self.assertRaises(TransferError):
+            self.session(921600).read_flash(0, 4096)
+
+    def test_output_captured(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            session = self.session()
+            session.write(0, random_bytes(4096))
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertTrue(session.output)
+        # esptool is only patched while sessions run it
+        self.assertNotIn("print", vars(esptool))
+        self.assertIs(esptool.sys, sys)
+
+    def test_concurrent_sessions(self):
+        devices = [
+            esp8266_emulator.Device(mac=(0x18, 0xFE, 0x34, 0, 0, i)) for i in range(3)
+        ]
+        ports = [esp8266_emulator.serve(device) for device in devices]
+        with concurrent.futures.ThreadPoolExecutor(len(ports)) as executor:
+            sessions = list(executor.map(self.connect, ports))
+        for device, session in zip(devices, sessions):
+            self.assertEqual(session.mac, device.mac_address)
+            # each session has the output of its own connection only
+            self.assertEqual(session.output.count("Stub running..."), 1)
+        self.assertNotIn("print", vars(esptool))
+        self.assertIs(esptool.sys, sys)
+
+
+class TestUpload(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp(prefix="kyanit-builder-test-")
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        for name, path in (
+            ("FLASHED_IMAGES_DIR", os.path.join(temp_dir, "flashed")),
+            ("UPLOAD_BAUD_RATES_FILE", os.path.join(temp_dir, "baud-rates.json")),
+        ):
+            patch = mock.patch.object(builder, name, path)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.fw_path = os.path.join(temp_dir, "firmware-combined.bin")
+        self.image = bytearray(random_bytes(64 * 1024))
+        self.write_image()
+        self.stdout = io.StringIO()
+        redirect = contextlib.redirect_stdout(self.stdout)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    def write_image(self):
+        with open(self.fw_path, "wb") as f:
+            f.write(self.image)
+
+    def assertFlashed(self, device):
+        self.assertEqual(bytes(device.flash[: len(self.image)]), self.image)
+
+    def upload(self, port, **kwargs):
+        result = builder.upload_device(port, self.fw_path, **kwargs)
+        self.assertEqual(result["port"], port)
+        return result
+
+    def test_full_then_changed_sectors(self):
+        device = esp8266_emulator.Device()
+        port = esp8266_emulator.serve(device)
+        result = self.upload(port)
+        self.assertEqual(result["result"], "ok")
+        self.assertEqual(result["mac"], device.mac_address)
+        self.assertEqual(device.erases, 1)
+        self.assertFlashed(device)
+
+        self.image[5000] ^= 1
+        self.image[40000] ^= 1
+        self.write_image()
+        written = device.written
+        self.assertEqual(self.upload(port)["result"], "ok")
+        self.assertEqual(device.written - written, 2 * builder.FLASH_SECTOR_SIZE)
+        self.assertEqual(device.erases, 1)
+        self.assertFlashed(device)
+
+    def test_changed_since_last_upload(self):
+        # the record of the last upload is stale if the device was programmed since
+        device = esp8266_emulator.Device()
+        port = esp8266_emulator.serve(device)
+        self.upload(port)
+        device.flash[100] ^= 0xFF
+        self.assertEqual(self.upload(port)["result"], "ok")
+        self.assertEqual(device.erases, 2)
+        self.assertFlashed(device)
+
+    def test_full_erase(self):
+        device = esp8266_emulator.Device()
+        port = esp8266_emulator.serve(device)
+        self.upload(port)
+        self.upload(port, full_erase=True)
+        self.assertEqual(device.erases, 2)
+
+    def test_baud_rate_fallback(self):
+        device = esp8266_emulator.Device(max_baud=460800)
+        port = esp8266_emulator.serve(device)
+        self.assertEqual(self.upload(port)["result"], "ok")
+        self.assertEqual(device.baud_rates, [921600, 460800])
+        with open(builder.UPLOAD_BAUD_RATES_FILE) as f:
+            self.assertEqual(json.load(f), {port: 460800})
+
+        # the remembered rate is used right away
+        self.assertEqual(self.upload(port)["result"], "ok")
+        self.assertEqual(device.baud_rates, [921600, 460800, 460800])
+        self.assertFlashed(device)
+
+    def test_error_output(self):
+        # the last lines esptool printed are shown with the error of a failed upload
+        device = esp8266_emulator.Device(responsive=False)
+        result = self.upload(esp8266_emulator.serve(device))
+        self.assertEqual(result["result"], "failed")
+        output = self.stdout.getvalue()
+        self.assertIn("could not connect to device", output)
+        self.assertIn("\n    Connecting...", output)
+
+        # the link doesn't work at any of the baud rates, after connecting
+        device = esp8266_emulator.Device(max_baud=115200)
+        self.assertEqual(
+            self.upload(esp8266_emulator.serve(device))["result"], "failed"
+        )
+        error = self.stdout.getvalue().split("could not communicate with device")[1]
+        self.assertIn("\n    Stub running...\n", error)
+        self.assertIn("\n    Changing baud rate to 230400\n", error)
+
+    def test_retries(self):
+        result = self.upload(CLOSED_PORT, retries=2)
+        self.assertEqual(result["result"], "failed")
+        self.assertEqual(result["attempts"], 3)
+        self.assertIsNone(result["mac"])
+        self.assertIn("could not open port", self.stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
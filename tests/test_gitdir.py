@@ -0,0 +1,369 @@
+"""
+Cross-checks of the backends of GitReleaseStatus on generated repositories.
+
+The subprocess backend (running git) is the reference, the python backend (reading the
+git directory with `gitdir`) and the batch backend (reading objects over a GitSession)
+must give the same results for `head`, `latest`, `commits`, `next` and `describe`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+from kyanit_buildtools.versioning import GitReleaseStatus
+from kyanit_buildtools.versioning.benchmark import generate_repo
+
+BACKENDS = sorted(GitReleaseStatus.BACKENDS)
+
+
+class BackendsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="kyanit-versioning-test-")
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.repo = os.path.join(self.temp_dir, "repo")
+        self.time = 1600000000
+        # independent of the configuration of the user running the tests
+        environ = mock.patch.dict(
+            os.environ,
+            {
+                "HOME": self.temp_dir,
+                "GIT_CONFIG_NOSYSTEM": "1",
+                "GIT_AUTHOR_NAME": "Test",
+                "GIT_AUTHOR_EMAIL": "test@example.com",
+                "GIT_COMMITTER_NAME": "Test",
+                "GIT_COMMITTER_EMAIL": "test@example.com",
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        for variable in ("GIT_DIR", "GIT_WORK_TREE", "KYANIT_VERSIONING_BACKEND"):
+            os.environ.pop(variable, None)
+
+    def git(self, *args, cwd=None):
+        return (
+            subprocess.run(
+                ["git", *args],
+                cwd=cwd or self.repo,
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+            .stdout.decode()
+            .strip()
+        )
+
+    def init(self):
+        self.git("init", "-q", "-b", "master", self.repo, cwd=self.temp_dir)
+
+    def write(self, path, content):
+        path = os.path.join(self.repo, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def commit(self, message, path="file", skew=0):
+        """
+        Commit `message` changing `path`, a minute after the previous commit (plus
+        `skew` seconds, to make commit times out of order), return its hash.
+        """
+
+        self.time += 60
+        self.write(path, f"{message} {self.time}\n")
+        self.git("add", path)
+        date = f"{self.time + skew} +0000"
+        with mock.patch.dict(
+            os.environ, {"GIT_AUTHOR_DATE": date, "GIT_COMMITTER_DATE": date}
+        ):
+            self.git("commit", "-q", "-m", message)
+        return self.git("rev-parse", "HEAD")
+
+    def merge(self, branch, message):
+        self.time += 60
+        date = f"{self.time} +0000"
+        with mock.patch.dict(
+            os.environ, {"GIT_AUTHOR_DATE": date, "GIT_COMMITTER_DATE": date}
+        ):
+            self.git("merge", "-q", "--no-ff", "-m", message, branch)
+        return self.git("rev-parse", "HEAD")
+
+    def results(self, backend, revisions, fallback=False):
+        with GitReleaseStatus(self.repo, commit_cache=False, backend=backend) as status:
+            results = {
+                "head": status.head,
+                "latest": status.latest,
+                "commits": status.commits,
+                "next": status.next,
+                "describe": {
+                    revision: status.describe(revision) for revision in revisions
+                },
+            }
+            if not fallback:
+                # a backend falling back to git would be compared with git itself
+                self.assertIs(type(status._backend), GitReleaseStatus.BACKENDS[backend])
+        return results
+
+    def assertBackendsAgree(self, revisions=(), fallback=False):
+        """
+        Assert that all backends give the same results as the subprocess backend for
+        the repository, and `describe` of `revisions`. Backends may fall back to git
+        only if `fallback`. Return the results.
+        """
+
+        expected = self.results("subprocess", revisions)
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(self.results(backend, revisions, fallback), expected)
+        return expected
+
+    def head(self, backend):
+        with GitReleaseStatus(self.repo, commit_cache=False, backend=backend) as status:
+            return status.head
+
+    def rev_parse(self, *revisions):
+        return [self.git("rev-parse", revision) for revision in revisions]
+
+    def all_revisions(self):
+        return self.git("rev-list", "--all").split()
+
+
+class TestLinearHistory(BackendsTestCase):
+    def test_annotated_tags(self):
+        generate_repo(self.repo, 300, tag_every=40, breaking_every=70)
+        revisions = self.all_revisions()[::7] + ["v0.3.0", "master", "HEAD"]
+        results = self.assertBackendsAgree(revisions)
+        self.assertEqual(results["latest"], "0.7.0")
+        self.assertTrue(results["head"].startswith("0.7.0+20."))
+
+    def test_no_tags(self):
+        generate_repo(self.repo, 50)
+        results = self.assertBackendsAgree(self.all_revisions()[::5])
+        self.assertTrue(results["head"].startswith("0.0.0+50."))
+
+    def test_lightweight_tags(self):
+        self.init()
+        for index in range(12):
+            self.commit(f"fix: change {index}")
+            if index % 4 == 3:
+                self.git("tag", f"v0.{index // 4 + 1}.0")
+        self.commit("feat: a feature")
+        # lightweight tags that aren't versions are never used
+        self.git("tag", "latest-build")
+        results = self.assertBackendsAgree(self.all_revisions())
+        self.assertEqual(results["latest"], "0.3.0")
+
+    def test_unsupported_revision_syntax(self):
+        # answered by git, through the fallback of the python backend
+        generate_repo(self.repo, 30, tag_every=10)
+        self.assertBackendsAgree(["HEAD~3", "v0.1.0^{commit}"], fallback=True)
+
+    def test_tagged_head(self):
+        generate_repo(self.repo, 20)
+        self.git("tag", "-a", "-m", "release", "v1.2.3")
+        results = self.assertBackendsAgree()
+        self.assertEqual(results["head"], "1.2.3")
+
+
+class TestMerges(BackendsTestCase):
+    def make_history(self, skew=-600):
+        # master and a feature branch with tags on both, merged twice, with some
+        # commit times out of order (by `skew` seconds per commit)
+        self.init()
+        self.commit("chore: initial commit")
+        self.git("tag", "-a", "-m", "release", "v0.1.0")
+        self.git("checkout", "-q", "-b", "feature")
+        for index in range(5):
+            self.commit(f"feat: feature {index}", path="feature", skew=skew * index)
+        self.git("tag", "v0.2.0")
+        self.git("checkout", "-q", "master")
+        for index in range(3):
+            self.commit(f"fix: fix {index}")
+        self.merge("feature", "chore: merge feature")
+        self.git("checkout", "-q", "feature")
+        self.commit("feat!: breaking feature", path="feature")
+        self.git("checkout", "-q", "master")
+        self.commit("docs: readme", path="README")
+        self.merge("feature", "chore: merge feature again")
+        self.commit("fix: after the merges")
+
+    def test_merges(self):
+        self.make_history()
+        self.assertBackendsAgree(
+            self.all_revisions() + self.rev_parse("HEAD~1^2", "HEAD~1^1", "HEAD~3^2")
+        )
+
+    def test_describe_range(self):
+        # the versions of a range are the same as describing each commit, with
+        # commit times in order (otherwise git describe may count commits reachable
+        # from the tag too)
+        self.make_history(skew=0)
+        self.git("checkout", "-q", "feature")
+        self.commit("fix: on the feature branch", path="feature")
+        self.git("checkout", "-q", "master")
+        self.merge("feature", "chore: merge feature once more")
+        for backend in BACKENDS:
+            for revision_range in ("HEAD", "v0.2.0..HEAD", "HEAD~3..HEAD"):
+                with self.subTest(backend=backend, range=revision_range):
+                    with GitReleaseStatus(
+                        self.repo, commit_cache=False, backend=backend
+                    ) as status:
+                        versions = list(status.describe_range(revision_range))
+                        self.assertTrue(versions)
+                        for commit, version in versions:
+                            self.assertEqual(version, status.describe(commit))
+
+    def test_describe_range_processes(self):
+        # the subprocess backend starts the same few processes however many merges a
+        # range has (not one per merge)
+        self.init()
+        self.commit("chore: initial commit")
+        self.git("tag", "-a", "-m", "release", "v0.1.0")
+        for index in range(15):
+            self.git("checkout", "-q", "-b", f"feature{index}")
+            self.commit(f"feat: feature {index}", path=f"feature{index}")
+            self.git("checkout", "-q", "master")
+            self.commit(f"fix: fix {index}")
+            self.merge(f"feature{index}", f"chore: merge feature {index}")
+
+        popen_init = subprocess.Popen.__init__
+        processes = []
+
+        def counting_init(popen, args, *other_args, **kwargs):
+            processes.append(args)
+            popen_init(popen, args, *other_args, **kwargs)
+
+        with GitReleaseStatus(
+            self.repo, commit_cache=False, backend="subprocess"
+        ) as status:
+            with mock.patch.object(subprocess.Popen, "__init__", counting_init):
+                versions = dict(status.describe_range("HEAD"))
+            self.assertLessEqual(len(processes), 3, processes)
+            for commit, version in versions.items():
+                self.assertEqual(version, status.describe(commit))
+
+    def test_merges_packed(self):
+        self.make_history()
+        self.git("gc", "-q", "--aggressive")
+        self.assertFalse(
+            os.listdir(os.path.join(self.repo, ".git", "refs", "tags")),
+            "tags should be packed",
+        )
+        self.assertBackendsAgree(self.all_revisions())
+
+    def test_worktree(self):
+        self.make_history()
+        worktree = os.path.join(self.temp_dir, "worktree")
+        self.git("worktree", "add", "-q", worktree, "feature")
+        self.repo = worktree
+        self.assertBackendsAgree(self.rev_parse("HEAD~2") + ["master", "v0.2.0"])
+
+
+class TestPackedRepository(BackendsTestCase):
+    def test_packed_refs_and_objects(self):
+        generate_repo(self.repo, 200, tag_every=30, breaking_every=45)
+        self.git("gc", "-q")
+        self.assertTrue(os.path.exists(os.path.join(self.repo, ".git", "packed-refs")))
+        self.assertBackendsAgree(self.all_revisions()[::9])
+
+    def test_loose_and_packed(self):
+        generate_repo(self.repo, 100, tag_every=30)
+        self.git("repack", "-q", "-a", "-d")
+        self.git("pack-refs", "--all")
+        # loose objects and refs on top of the packed ones
+        for index in range(5):
+            self.commit(f"feat: loose {index}")
+        self.git("tag", "-a", "-m", "release", "v1.0.0", "HEAD~2")
+        results = self.assertBackendsAgree(self.all_revisions()[:10])
+        self.assertEqual(results["latest"], "1.0.0")
+
+
+class TestWorkingTree(BackendsTestCase):
+    def make_history(self):
+        self.init()
+        for index in range(6):
+            self.commit(f"fix: change {index}", path=f"dir{index % 2}/file{index}")
+        self.git("tag", "-a", "-m", "release", "v0.1.0")
+        self.commit("feat: a feature")
+
+    def assertIndexVersion(self, version):
+        with open(os.path.join(self.repo, ".git", "index"), "rb") as f:
+            self.assertEqual(int.from_bytes(f.read(8)[4:], "big"), version)
+
+    def test_index_versions(self):
+        self.make_history()
+        for version in (2, 3, 4):
+            with self.subTest(version=version):
+                self.git("update-index", "--index-version", str(version))
+                if version == 3:
+                    # an extended flag, for git to keep the index at version 3
+                    self.git("update-index", "--skip-worktree", "dir0/file0")
+                self.assertIndexVersion(version)
+                results = self.assertBackendsAgree()
+                self.assertTrue(results["head"].endswith(".clean"))
+                self.git("update-index", "--no-skip-worktree", "dir0/file0")
+
+    def test_dirty_and_staged(self):
+        self.make_history()
+        for version in (2, 4):
+            with self.subTest(version=version):
+                self.git("update-index", "--index-version", str(version))
+                self.git("reset", "-q", "--hard")
+
+                # modified in the working tree
+                self.write("dir1/file1", "modified\n")
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".dirty"))
+
+                # staged, and the same in the working tree
+                self.git("add", "dir1/file1")
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".dirty"))
+
+                # added to the index, then removed from the working tree, which is
+                # the same as HEAD again
+                self.git("reset", "-q", "--hard")
+                self.write("dir0/new", "new\n")
+                self.git("add", "dir0/new")
+                os.remove(os.path.join(self.repo, "dir0", "new"))
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".clean"))
+
+                # removed from the working tree
+                self.git("reset", "-q", "--hard")
+                os.remove(os.path.join(self.repo, "dir0", "file0"))
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".dirty"))
+
+                # untracked files don't make the tree dirty
+                self.git("reset", "-q", "--hard")
+                self.write("untracked", "untracked\n")
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".clean"))
+                os.remove(os.path.join(self.repo, "untracked"))
+
+                # intent to add
+                self.git("reset", "-q", "--hard")
+                self.write("dir0/new", "new\n")
+                self.git("add", "-N", "dir0/new")
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".dirty"))
+                self.git("rm", "-q", "--cached", "dir0/new")
+                os.remove(os.path.join(self.repo, "dir0", "new"))
+
+                # removed from the index, but still in the working tree
+                self.git("rm", "-q", "--cached", "dir1/file1")
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".dirty"))
+
+                # touched, but with the same contents: clean by content, git describe
+                # only checks the contents since git 2.42 (it refreshes the index)
+                self.git("reset", "-q", "--hard")
+                os.utime(os.path.join(self.repo, "dir1", "file1"), (0, 0))
+                for backend in ("python", "batch"):
+                    self.assertTrue(self.head(backend).endswith(".clean"))
+                self.git("update-index", "-q", "--refresh")
+                self.assertTrue(self.assertBackendsAgree()["head"].endswith(".clean"))
+
+    def test_dirty_on_tag(self):
+        self.make_history()
+        self.git("tag", "-a", "-m", "release", "v0.2.0")
+        self.write("dir0/file0", "modified\n")
+        self.assertEqual(self.assertBackendsAgree()["head"], "0.2.0+0.dirty")
+
+
+if __name__ == "__main__":
+    unittest.main()